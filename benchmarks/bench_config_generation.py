@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+"""
+bench_config_generation.py [options] [generator ...]
+
+Times the functions that turn branch configs into builders, schedulers and
+status objects, which run on every reconfig and checkconfig, for synthetic
+configs (see synthetic_configs.py) of a given size.  The generators are:
+
+    branch        misc.generateBranchObjects
+    talos         misc.generateTalosBranchObjects
+    test_builder  misc.generateTestBuilder, for each platform and suite
+    project       misc.generateProjectObjects, for spidermonkey projects
+    release       process.release.generateReleaseBranchObjects
+
+All of them are run by default.  For each one this reports the wall time,
+the time taken to run it again with the same configs (which reuses the
+objects it made, for the generators that can), the number of builders made,
+and what the result keeps alive: the number of
+objects tracked by the garbage collector, and their (shallow) size.  Python
+2 can't trace allocations, so objects that are created and thrown away
+don't show up in these numbers.
+
+buildbotcustom's own dependencies (the build and release modules from the
+tools repo, and BuildSlaves.py for release) need to be importable, as they
+are on a master.
+
+Use --save to write the results to a file, and --compare to check a later
+run against them.  --compare exits with status 1 if a generator got more
+than --tolerance slower, or keeps that many more objects alive.
+"""
+import copy
+import gc
+import sys
+import time
+
+from buildbot.util import json
+
+import synthetic_configs
+
+GENERATORS = ['branch', 'talos', 'test_builder', 'project', 'release']
+
+
+def branchNames(options):
+    return ['bench-%i' % i for i in range(options.branches)]
+
+
+def makeBranchRuns(options):
+    from buildbotcustom.misc import generateBranchObjects
+    configs = [(synthetic_configs.makeBranchConfig(
+        name, options.platforms, options.suites, options.chunks), name)
+        for name in branchNames(options)]
+    secrets = synthetic_configs.makeSecrets()
+
+    def run(configs):
+        return [generateBranchObjects(config, name, secrets)
+                for config, name in configs]
+    return configs, run
+
+
+def makeTalosRuns(options):
+    from buildbotcustom.misc import generateTalosBranchObjects
+    configs = [(name, synthetic_configs.makeTalosConfig(
+        name, options.platforms, options.suites, options.chunks,
+        options.talos_suites)) for name in branchNames(options)]
+
+    def run(configs):
+        return [generateTalosBranchObjects(name, *args)
+                for name, args in configs]
+    return configs, run
+
+
+def makeTestBuilderRuns(options):
+    from buildbotcustom.misc import generateTestBuilder
+    configs = []
+    for name in branchNames(options):
+        branch_config, PLATFORMS, SUITES, ACTIVE = \
+            synthetic_configs.makeTalosConfig(
+                name, options.platforms, options.suites, options.chunks, 0)
+        for platform, platform_config in PLATFORMS.items():
+            for slave_platform in platform_config['slave_platforms']:
+                for suites_name, suites in \
+                        branch_config['unittest_suites']:
+                    configs.append(dict(
+                        config=branch_config,
+                        branch_name=name,
+                        platform=platform,
+                        name_prefix='%s %s opt test' % (
+                            platform_config[slave_platform]['name'], name),
+                        build_dir_prefix='%s_%s_test' % (name,
+                                                         slave_platform),
+                        suites_name=suites_name,
+                        suites=suites,
+                        mochitestLeakThreshold=None,
+                        crashtestLeakThreshold=None,
+                        slaves=platform_config[slave_platform]['slaves'],
+                        stagePlatform=platform,
+                        stageProduct='firefox'))
+
+    def run(configs):
+        return [generateTestBuilder(**kwargs) for kwargs in configs]
+    return configs, run
+
+
+def makeProjectRuns(options):
+    from buildbotcustom.misc import generateProjectObjects
+    configs = [synthetic_configs.makeSpiderMonkeyConfig(
+        name, options.platforms, options.variants)
+        for name in branchNames(options)]
+
+    def run(configs):
+        return [generateProjectObjects(project, config, {})
+                for project, config in configs]
+    return configs, run
+
+
+def makeReleaseRuns(options):
+    from buildbotcustom.process.release import generateReleaseBranchObjects
+    configs = [synthetic_configs.makeReleaseConfig(
+        name, options.platforms, options.suites, options.chunks)
+        for name in branchNames(options)]
+    secrets = synthetic_configs.makeSecrets()
+
+    def run(configs):
+        return [generateReleaseBranchObjects(releaseConfig, branchConfig,
+                                             'release-firefox-bench.py',
+                                             secrets=secrets)
+                for releaseConfig, branchConfig in configs]
+    return configs, run
+
+RUNS = {
+    'branch': makeBranchRuns,
+    'talos': makeTalosRuns,
+    'test_builder': makeTestBuilderRuns,
+    'project': makeProjectRuns,
+    'release': makeReleaseRuns,
+}
+
+
+def countBuilders(results):
+    count = 0
+    for r in results:
+        if isinstance(r, dict):
+            count += len(r.get('builders', []))
+        else:
+            count += len(r)
+    return count
+
+
+def resetGlobals(reuseObjects=False):
+    # The generators add to these as they go
+    import buildbotcustom.misc
+    import buildbotcustom.process.factory
+    del buildbotcustom.misc.nomergeBuilders[:]
+    if not reuseObjects:
+        buildbotcustom.misc.clearReusedObjects()
+        buildbotcustom.process.factory.clearSharedSteps()
+
+
+def measure(configs, run, runs):
+    """Runs run(configs) runs times.  Returns a dict of the best and mean
+    wall time, the number of builders made, the objects and bytes kept
+    alive by one run's results, and the time taken by a run with the same
+    configs straight after that one, as in a reconfig that doesn't change
+    them."""
+    times = []
+    for i in range(runs):
+        # The generators are allowed to modify their configs
+        runConfigs = copy.deepcopy(configs)
+        resetGlobals()
+        gc.collect()
+        start = time.time()
+        results = run(runConfigs)
+        times.append(time.time() - start)
+        del results, runConfigs
+
+    runConfigs = copy.deepcopy(configs)
+    resetGlobals()
+    gc.collect()
+    before = set(id(o) for o in gc.get_objects())
+    results = run(runConfigs)
+    gc.collect()
+    new = [o for o in gc.get_objects() if id(o) not in before]
+    retained = {
+        'objects': len(new),
+        'bytes': sum(sys.getsizeof(o) for o in new),
+        'builders': countBuilders(results),
+    }
+    del new, results, runConfigs
+
+    runConfigs = copy.deepcopy(configs)
+    resetGlobals(reuseObjects=True)
+    start = time.time()
+    run(runConfigs)
+    retained['reconfig'] = time.time() - start
+    resetGlobals()
+
+    retained['best'] = min(times)
+    retained['mean'] = sum(times) / len(times)
+    return retained
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of messages about results that are worse than
+    baseline"""
+    regressions = []
+    for name, r in sorted(results.items()):
+        if name not in baseline:
+            continue
+        b = baseline[name]
+        if r['best'] > b['best'] * (1 + tolerance):
+            regressions.append("%s: best time went from %.1fms to %.1fms" %
+                               (name, b['best'] * 1000, r['best'] * 1000))
+        if r['objects'] > b['objects'] * (1 + tolerance):
+            regressions.append("%s: retained objects went from %i to %i" %
+                               (name, b['objects'], r['objects']))
+    return regressions
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(
+        branches=2,
+        platforms=6,
+        suites=10,
+        chunks=3,
+        talos_suites=8,
+        variants=4,
+        runs=3,
+        save=None,
+        compare=None,
+        tolerance=0.25,
+    )
+    parser.add_option("-b", "--branches", dest="branches", type="int",
+                      help="number of branches")
+    parser.add_option("-p", "--platforms", dest="platforms", type="int",
+                      help="number of build platforms per branch")
+    parser.add_option("-s", "--suites", dest="suites", type="int",
+                      help="number of unittest suites")
+    parser.add_option("-c", "--chunks", dest="chunks", type="int",
+                      help="number of chunks for chunked suites and l10n")
+    parser.add_option("-t", "--talos-suites", dest="talos_suites",
+                      type="int", help="number of talos suites")
+    parser.add_option("--variants", dest="variants", type="int",
+                      help="number of spidermonkey variants per platform")
+    parser.add_option("-n", "--runs", dest="runs", type="int",
+                      help="number of times to run each generator")
+    parser.add_option("--save", dest="save",
+                      help="save the results to this file")
+    parser.add_option("--compare", dest="compare",
+                      help="compare the results with ones saved earlier")
+    parser.add_option("--tolerance", dest="tolerance", type="float",
+                      help="how much worse results can be than the saved "
+                      "ones before --compare fails")
+
+    options, args = parser.parse_args()
+    for name in args:
+        if name not in RUNS:
+            parser.error("unknown generator %s" % name)
+    generators = args or GENERATORS
+
+    print "%i branches, %i platforms, %i suites, %i chunks, " \
+        "%i talos suites, %i runs" % (
+            options.branches, options.platforms, options.suites,
+            options.chunks, options.talos_suites, options.runs)
+    print "%-14s %8s %10s %10s %10s %10s %10s" % (
+        "generator", "builders", "best", "mean", "reconfig", "objects",
+        "retained")
+
+    results = {}
+    for name in generators:
+        try:
+            configs, run = RUNS[name](options)
+        except ImportError, e:
+            print "%-14s skipped: %s" % (name, e)
+            continue
+        r = results[name] = measure(configs, run, options.runs)
+        print "%-14s %8i %8.1fms %8.1fms %8.1fms %10i %8.1fMB" % (
+            name, r['builders'], r['best'] * 1000, r['mean'] * 1000,
+            r['reconfig'] * 1000, r['objects'], r['bytes'] / 1024.0 / 1024.0)
+
+    if options.save:
+        f = open(options.save, 'w')
+        json.dump(results, f, indent=2, sort_keys=True)
+        f.close()
+
+    if options.compare:
+        baseline = json.load(open(options.compare))
+        regressions = compare(results, baseline, options.tolerance)
+        for r in regressions:
+            print "REGRESSION: %s" % r
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+bench_import.py [options]
+
+Times loading buildbotcustom.misc, as master.cfg does:
+
+    first import  importing it in a new process, as on startup or in
+                  checkconfig (buildbot and twisted are imported first, and
+                  not counted)
+    reconfig      reloading it, with nothing changed since the last time
+    reload all    reloading it after reloader.forgetModules(), so that
+                  every module is reloaded, as on every reconfig before
+                  reloader.py
+
+buildbotcustom's own dependencies (the build and release modules from the
+tools repo) need to be importable, as they are on a master.
+"""
+import os
+import subprocess
+import sys
+import time
+
+FIRST_IMPORT = """
+import time
+import twisted.internet.reactor
+import buildbot.process.factory, buildbot.scheduler, buildbot.steps.shell
+import buildbot.status.tinderbox, buildbot.status.mail
+start = time.time()
+import buildbotcustom.misc
+print time.time() - start
+"""
+
+
+def firstImport():
+    output = subprocess.Popen([sys.executable, '-c', FIRST_IMPORT],
+                              stdout=subprocess.PIPE,
+                              env=os.environ).communicate()[0]
+    return float(output.strip().splitlines()[-1])
+
+
+def reconfig():
+    import buildbotcustom.misc
+    start = time.time()
+    reload(buildbotcustom.misc)
+    return time.time() - start
+
+
+def reloadAll():
+    from buildbotcustom import reloader
+    reloader.forgetModules()
+    return reconfig()
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(runs=5)
+    parser.add_option("-n", "--runs", dest="runs", type="int",
+                      help="number of times to time each")
+    options, args = parser.parse_args()
+
+    # Make sure there are up to date .pyc files, so that we don't time
+    # compiling
+    import buildbotcustom.misc
+    assert buildbotcustom.misc
+
+    print "%-14s %10s %10s" % ("", "best", "mean")
+    for name, func in [("first import", firstImport),
+                       ("reconfig", reconfig),
+                       ("reload all", reloadAll)]:
+        times = [func() for i in range(options.runs)]
+        print "%-14s %8.1fms %8.1fms" % (name, min(times) * 1000,
+                                         sum(times) / len(times) * 1000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+"""
+bench_step_sharing.py [options]
+
+Reports how much memory the steps of the builders for a synthetic config
+(see synthetic_configs.py) take up, before and after their factories share
+equal steps with each other (see process.factory.shareStepFactories).  The
+default sizes are roughly those of a full production build master: twenty
+branches with six platforms each, their talos and unittest builders, and a
+release.
+
+The memory counted is that of the step factory tuples and everything in
+their arguments (dicts, lists, strings, WithProperties and so on), counting
+each object once however many steps refer to it.  Step classes, functions
+and modules aren't counted.
+
+buildbotcustom's own dependencies (the build and release modules from the
+tools repo, and BuildSlaves.py for release) need to be importable, as they
+are on a master.
+"""
+import sys
+import time
+import types
+
+import synthetic_configs
+
+# Objects that belong to the code rather than to the steps
+NOT_COUNTED = (type, types.ClassType, types.FunctionType, types.MethodType,
+               types.BuiltinFunctionType, types.ModuleType)
+
+
+def stepObjects(builders):
+    """Returns a dict of id to object for everything in the steps of the
+    factories of builders"""
+    seen = {}
+    todo = [s for b in builders for s in b['factory'].steps]
+    while todo:
+        obj = todo.pop()
+        if id(obj) in seen or isinstance(obj, NOT_COUNTED):
+            continue
+        seen[id(obj)] = obj
+        if isinstance(obj, dict):
+            todo.extend(obj.keys())
+            todo.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            todo.extend(obj)
+        elif hasattr(obj, '__dict__'):
+            todo.append(obj.__dict__)
+    return seen
+
+
+def measure(builders):
+    objects = stepObjects(builders)
+    return len(objects), sum(sys.getsizeof(o) for o in objects.values())
+
+
+def makeBuilders(options):
+    """Returns a list of (generator name, builders) for the synthetic
+    config.  The generators are called without sharing any steps."""
+    from buildbotcustom.misc import generateBranchObjects, \
+        generateTalosBranchObjects
+    results = []
+    secrets = synthetic_configs.makeSecrets()
+    branches = ['bench-%i' % i for i in range(options.branches)]
+    builders = []
+    for name in branches:
+        config = synthetic_configs.makeBranchConfig(
+            name, options.platforms, options.suites, options.chunks)
+        builders.extend(generateBranchObjects.uncached(
+            config, name, secrets)['builders'])
+    results.append(('branch', builders))
+
+    builders = []
+    for name in branches:
+        args = synthetic_configs.makeTalosConfig(
+            name, options.platforms, options.suites, options.chunks,
+            options.talos_suites)
+        builders.extend(generateTalosBranchObjects.uncached(
+            name, *args)['builders'])
+    results.append(('talos', builders))
+
+    try:
+        import buildbotcustom.process.release
+    except ImportError, e:
+        print "skipping release: %s" % e
+        return results
+    releaseConfig, branchConfig = synthetic_configs.makeReleaseConfig(
+        'bench-release', options.platforms, options.suites, options.chunks)
+    # Don't share these steps with anything yet
+    shareSteps = buildbotcustom.process.release.shareSteps
+    buildbotcustom.process.release.shareSteps = lambda builders: None
+    try:
+        builders = buildbotcustom.process.release.generateReleaseBranchObjects(
+            releaseConfig, branchConfig, 'release-firefox-bench.py',
+            secrets=secrets)['builders']
+    finally:
+        buildbotcustom.process.release.shareSteps = shareSteps
+    results.append(('release', builders))
+    return results
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(
+        branches=20,
+        platforms=6,
+        suites=20,
+        chunks=3,
+        talos_suites=10,
+    )
+    parser.add_option("-b", "--branches", dest="branches", type="int",
+                      help="number of branches")
+    parser.add_option("-p", "--platforms", dest="platforms", type="int",
+                      help="number of build platforms per branch")
+    parser.add_option("-s", "--suites", dest="suites", type="int",
+                      help="number of unittest suites")
+    parser.add_option("-c", "--chunks", dest="chunks", type="int",
+                      help="number of chunks for chunked suites and l10n")
+    parser.add_option("-t", "--talos-suites", dest="talos_suites",
+                      type="int", help="number of talos suites")
+
+    options, args = parser.parse_args()
+    from buildbotcustom.misc import shareSteps
+    from buildbotcustom.process.factory import clearSharedSteps
+
+    print "%i branches, %i platforms, %i suites, %i chunks, " \
+        "%i talos suites" % (options.branches, options.platforms,
+                             options.suites, options.chunks,
+                             options.talos_suites)
+    results = makeBuilders(options)
+    allBuilders = [b for name, builders in results for b in builders]
+    results.append(('all', allBuilders))
+
+    print "%-10s %8s %8s %10s %10s %10s %10s %6s %8s" % (
+        "builders", "count", "steps", "objects", "shared", "before",
+        "after", "saved", "time")
+    # Start again from unshared steps for each set of builders
+    unshared = [(b, b['factory'].steps) for b in allBuilders]
+    for name, builders in results:
+        for b, steps in unshared:
+            b['factory'].steps = steps
+        clearSharedSteps()
+
+        objects, before = measure(builders)
+        start = time.time()
+        shareSteps(builders)
+        elapsed = time.time() - start
+        sharedObjects, after = measure(builders)
+        print "%-10s %8i %8i %10i %10i %8.1fMB %8.1fMB %5.0f%% %6.0fms" % (
+            name, len(builders),
+            sum(len(b['factory'].steps) for b in builders),
+            objects, sharedObjects, before / 1024.0 / 1024.0,
+            after / 1024.0 / 1024.0, 100.0 * (before - after) / before,
+            elapsed * 1000)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+bench_try_parser.py [options]
+
+Times working out the builders for try pushes, for a generated set of
+builders about the size of mozilla-central's try: build builders for each
+platform, test builders for each platform and test suite, and talos
+builders.  Compares calling TryParser for each push (as tryChooser used to)
+against a TryParserIndex that is kept around, with and without its cache of
+parsed messages.
+"""
+import random
+import time
+
+from buildbotcustom.try_parser import TryParser, TryParserIndex
+
+PLATFORMS = ['linux', 'linux64', 'macosx', 'macosx64', 'win32', 'win64',
+             'android', 'android-armv6', 'android-noion', 'ics_armv7a_gecko',
+             'panda', 'emulator']
+TALOS_SUITES = ['tp5', 'chrome', 'dromaeo', 'svg', 'nochrome', 'other',
+                'dirty', 'xperf', 'remote-ts', 'remote-tsvg']
+
+
+def makeBuilders(suites):
+    """Returns builderNames, prettyNames, unittestPrettyNames and
+    testerPrettyNames for PLATFORMS and the given unittest suites"""
+    builderNames = []
+    prettyNames = {}
+    unittestPrettyNames = {}
+    testerPrettyNames = {}
+    for p in PLATFORMS:
+        for suffix, pretty in [('', '%s try build'),
+                               ('-debug', '%s try leak test build')]:
+            prettyNames[p + suffix] = pretty % p
+            builderNames.append(pretty % p)
+        unittestPrettyNames[p + '-debug'] = '%s try debug test' % p
+        testerPrettyNames[p] = ['Rev3 %s %i' % (p, i) for i in range(3)]
+        for slave_platform in testerPrettyNames[p]:
+            for buildType in ('opt', 'debug'):
+                for suite in suites:
+                    builderNames.append('%s try %s test %s' % (
+                        slave_platform, buildType, suite))
+            for suite in TALOS_SUITES:
+                builderNames.append('%s try talos %s' % (slave_platform,
+                                                         suite))
+    return builderNames, prettyNames, unittestPrettyNames, testerPrettyNames
+
+
+def makeMessages(suites, num):
+    messages = []
+    for i in range(num):
+        platforms = random.sample(PLATFORMS, random.randint(1, 4))
+        tests = random.sample(suites, random.randint(1, 5))
+        messages.append('Bug %i - stuff\ntry: -b %s -p %s -u %s -t %s' % (
+            i, random.choice(['do', 'o', 'd']),
+            random.choice(['all', ','.join(platforms)]),
+            random.choice(['all', 'none', ','.join(tests)]),
+            random.choice(['all', 'none', ','.join(TALOS_SUITES[:3])])))
+    return messages
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(
+        suites=40,
+        pushes=200,
+        distinct=20,
+    )
+    parser.add_option("-s", "--suites", dest="suites", type="int",
+                      help="number of unittest suites")
+    parser.add_option("-n", "--pushes", dest="pushes", type="int",
+                      help="number of pushes to parse")
+    parser.add_option("-d", "--distinct", dest="distinct", type="int",
+                      help="number of different try messages among the pushes")
+
+    options, args = parser.parse_args()
+
+    random.seed(0)
+    suites = ['suite-%i' % i for i in range(options.suites)]
+    builderNames, prettyNames, unittestPrettyNames, testerPrettyNames = \
+        makeBuilders(suites)
+    distinct = makeMessages(suites, options.distinct)
+    messages = [random.choice(distinct) for i in range(options.pushes)]
+    print "%i builders, %i pushes, %i distinct messages" % (
+        len(builderNames), len(messages), len(distinct))
+
+    def oneShot():
+        for m in messages:
+            TryParser(m, builderNames, prettyNames)
+            TryParser(m, builderNames, testerPrettyNames,
+                      unittestPrettyNames, suites)
+            TryParser(m, builderNames, testerPrettyNames, None, None,
+                      TALOS_SUITES)
+
+    def makeIndexes(maxCached):
+        return [TryParserIndex(builderNames, prettyNames,
+                               maxCached=maxCached),
+                TryParserIndex(builderNames, testerPrettyNames,
+                               unittestPrettyNames, suites,
+                               maxCached=maxCached),
+                TryParserIndex(builderNames, testerPrettyNames, None, None,
+                               TALOS_SUITES, maxCached=maxCached)]
+
+    start = time.time()
+    uncachedIndexes = makeIndexes(0)
+    cachedIndexes = makeIndexes(1000)
+    print "%-20s %8.1fms" % ("building indexes", (time.time() - start) / 2 *
+                             1000)
+
+    def indexed(indexes):
+        for m in messages:
+            for index in indexes:
+                index.parse(m)
+
+    for name, func in [("TryParser", oneShot),
+                       ("index, no cache", lambda: indexed(uncachedIndexes)),
+                       ("index, cached", lambda: indexed(cachedIndexes))]:
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        print "%-20s %8.1fms  %6.3fms per push" % (
+            name, elapsed * 1000, elapsed * 1000 / len(messages))
+
+if __name__ == '__main__':
+    main()
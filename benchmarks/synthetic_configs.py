@@ -0,0 +1,416 @@
+"""
+Synthetic master configs for the benchmarks.
+
+These look like the branch, talos and project configs buildbot-configs
+passes to generateBranchObjects and friends, but are generated, so that the
+number of branches, platforms, test suites and chunks can be scaled up and
+down.
+"""
+import copy
+
+OS_TYPES = ['linux', 'linux64', 'macosx64', 'win32', 'win64', 'android']
+
+PRODUCTS = {
+    'android': 'mobile',
+}
+
+# Test slave platforms for each build platform, and the environment talos
+# runs in
+SLAVE_PLATFORMS = {
+    'linux': ['fedora', 'ubuntu32'],
+    'linux64': ['fedora64', 'ubuntu64'],
+    'macosx64': ['snowleopard', 'lion', 'mountainlion'],
+    'win32': ['xp', 'win7', 'win8'],
+    'win64': ['w764'],
+}
+TALOS_ENVS = {
+    'linux': 'linux-perf',
+    'linux64': 'linux-perf',
+    'macosx64': 'mac-perf',
+    'win32': 'win32-perf',
+    'win64': 'win64-perf',
+}
+
+
+def platformNames(num):
+    """Returns num platform names, cycling through OS_TYPES"""
+    names = []
+    for i in range(num):
+        os_type = OS_TYPES[i % len(OS_TYPES)]
+        if i < len(OS_TYPES):
+            names.append(os_type)
+        else:
+            names.append('%s%i' % (os_type, i / len(OS_TYPES)))
+    return names
+
+
+def osType(platform):
+    for os_type in sorted(OS_TYPES, key=len, reverse=True):
+        if platform.startswith(os_type):
+            return os_type
+
+
+def makeSuites(numSuites, numChunks):
+    """Returns a list of (suites name, suites) in the form the
+    *_unittest_suites of branch configs take.  Every third suite is
+    chunked."""
+    suites = []
+    for i in range(numSuites):
+        name = 'suite-%i' % i
+        if numChunks > 1 and i % 3 == 0:
+            suites.append((name, {'suite': 'mochitest-plain',
+                                  'totalChunks': numChunks}))
+        else:
+            suites.append((name, ['reftest']))
+    return suites
+
+
+def makeSlaves(prefix, num=10):
+    return ['%s-%03i' % (prefix, i) for i in range(num)]
+
+
+def makePlatformConfig(branch, platform):
+    """Returns the opt and debug platform configs for platform"""
+    os_type = osType(platform)
+    product = PRODUCTS.get(os_type, 'firefox')
+    base_name = '%s %s' % (platform.capitalize(), branch)
+    pf = {
+        'product_name': product,
+        'app_name': 'browser',
+        'base_name': base_name,
+        'mozconfig': '%s/%s/nightly' % (platform, branch),
+        'src_mozconfig': 'browser/config/mozconfigs/%s/nightly' % platform,
+        'xr_mozconfig': 'xulrunner/config/mozconfigs/%s/xulrunner' % platform,
+        'profiled_build': False,
+        'builds_before_reboot': 1,
+        'build_space': 12,
+        'upload_symbols': True,
+        'packageTests': True,
+        'slaves': makeSlaves('%s-build' % os_type),
+        'platform_objdir': 'obj-firefox',
+        'stage_product': product,
+        'stage_platform': platform,
+        'update_platform': platform,
+        'enable_ccache': os_type.startswith('linux'),
+        'enable_shared_checkouts': True,
+        'env': {
+            'DISPLAY': ':2',
+            'HG_SHARE_BASE_DIR': '/builds/hg-shared',
+            'MOZ_OBJDIR': 'obj-firefox',
+        },
+        'enable_checktests': True,
+        'talos_masters': [('talos-master', False, {})],
+        'unittest_masters': [('test-master', False, {})],
+        'test_pretty_names': True,
+        'l10n_chunks': 5,
+        'try_by_default': True,
+        'tooltool_manifest_src': 'browser/config/tooltool-manifests/%s/releng.manifest' % platform,
+    }
+    if os_type.startswith('linux'):
+        pf['use_mock'] = True
+        pf['mock_target'] = 'mozilla-centos6-%s' % (
+            'x86_64' if os_type == 'linux64' else 'i386')
+        pf['mock_packages'] = ['autoconf213', 'python', 'zip', 'mercurial']
+        pf['mock_copyin_files'] = [('/home/cltbld/.ssh', '/home/mock/.ssh')]
+    debug = copy.deepcopy(pf)
+    debug.update({
+        'base_name': '%s %s leak test' % (platform.capitalize(), branch),
+        'mozconfig': '%s/%s/debug' % (platform, branch),
+        'src_mozconfig': 'browser/config/mozconfigs/%s/debug' % platform,
+        'enable_nightly': False,
+        'stage_platform': '%s-debug' % platform,
+        'enable_xulrunner': False,
+    })
+    return pf, debug
+
+
+def makeBranchConfig(name, numPlatforms=6, numSuites=10, numChunks=3):
+    """Returns a branch config for generateBranchObjects"""
+    platforms = {}
+    unittest_suites = makeSuites(numSuites, numChunks)
+    for platform in platformNames(numPlatforms):
+        opt, debug = makePlatformConfig(name, platform)
+        platforms[platform] = opt
+        platforms['%s-debug' % platform] = debug
+    config = {
+        'repo_path': 'projects/%s' % name,
+        'l10n_repo_path': 'l10n-central',
+        'build_tools_repo_path': 'build/tools',
+        'mozharness_repo_path': 'build/mozharness',
+        'mozharness_tag': 'production',
+        'compare_locales_repo_path': 'build/compare-locales',
+        'compare_locales_tag': 'RELEASE_AUTOMATION',
+        'config_repo_path': 'build/buildbot-configs',
+        'config_subdir': 'mozilla2',
+        'hghost': 'hg.mozilla.org',
+        'hgurl': 'http://hg.mozilla.org/',
+        'base_clobber_url': 'http://clobberer/index.php',
+        'stage_server': 'stage.mozilla.org',
+        'stage_username': 'ffxbld',
+        'stage_username_xulrunner': 'xrbld',
+        'stage_ssh_key': 'ffxbld_dsa',
+        'stage_ssh_xulrunner_key': 'xrbld_dsa',
+        'stage_group': None,
+        'stage_base_path': '/home/ftp/pub/firefox',
+        'download_base_url': 'http://ftp.mozilla.org/pub/mozilla.org/firefox',
+        'mobile_download_base_url': 'http://ftp.mozilla.org/pub/mozilla.org/mobile',
+        'enUS_binaryURL': 'http://ftp.mozilla.org/pub/mozilla.org/firefox/nightly/latest-%s' % name,
+        'package_url': 'http://ftp.mozilla.org/pub/mozilla.org/firefox/try-builds',
+        'package_dir': '%(who)s-%(got_revision)s',
+        'graph_server': 'graphs.mozilla.org',
+        'graph_selector': '/server/collect.cgi',
+        'graph_branch': name,
+        'hash_type': 'sha512',
+        'create_snippet': False,
+        'create_partial': False,
+        'create_partial_l10n': False,
+        'update_channel': 'nightly',
+        'aus2_host': 'aus2.mozilla.org',
+        'aus2_user': 'ffxbld',
+        'aus2_ssh_key': 'auspush',
+        'aus2_base_upload_dir': '/opt/aus2/incoming/2/Firefox/%s' % name,
+        'aus2_base_upload_dir_l10n': '/opt/aus2/incoming/2/Firefox/%s' % name,
+        'aus2_mobile_base_upload_dir': '/opt/aus2/incoming/2/Fennec/%s' % name,
+        'balrog_api_root': None,
+        'balrog_credentials_file': 'BuildSlaves.py',
+        'platforms': platforms,
+        'enabled_products': ['firefox', 'mobile'],
+        'pgo_strategy': None,
+        'pgo_platforms': [],
+        'periodic_pgo_interval': 6,
+        'enable_nightly': True,
+        'enable_xulrunner': False,
+        'enable_valgrind': False,
+        'valgrind_platforms': [],
+        'enable_weekly_bundle': False,
+        'enable_l10n': False,
+        'enable_l10n_onchange': False,
+        'l10n_platforms': [],
+        'l10n_tree': 'fx%s' % name,
+        'l10n_tinderbox_tree': 'Mozilla-l10n',
+        'l10n_modules': ['browser', 'toolkit'],
+        'l10nNightlyUpdate': False,
+        'l10nDatedDirs': False,
+        'enable_multi_locale': False,
+        'multi_locale_merge': True,
+        'default_build_space': 5,
+        'default_l10n_space': 3,
+        'default_clobber_time': 24 * 7,
+        'start_hour': [3],
+        'start_minute': [2],
+        'product_prefix': 'firefox',
+        'mozilla_dir': '',
+        'leak_target': 'mochitest-plain',
+        'email_override': [],
+        'unittest_masters': [('test-master', False, {})],
+        'talos_masters': [('talos-master', False, {})],
+        'unittest_suites': unittest_suites,
+        'tooltool_url_list': ['http://tooltool.pvt.build.mozilla.org/build/'],
+        'tinderbox_tree': name.capitalize(),
+        'packaged_unittest_tinderbox_tree': name.capitalize(),
+        'enable_talos': True,
+        'enable_unittests': True,
+    }
+    return config
+
+
+def makeTalosConfig(name, numPlatforms=6, numSuites=10, numChunks=3,
+                    numTalosSuites=8):
+    """Returns (branch_config, PLATFORMS, SUITES, ACTIVE_UNITTEST_PLATFORMS)
+    for generateTalosBranchObjects"""
+    branch_config = makeBranchConfig(name, numPlatforms, numSuites,
+                                     numChunks)
+    unittest_suites = branch_config['unittest_suites']
+    SUITES = {}
+    for i in range(numTalosSuites):
+        SUITES['talos-%i' % i] = {
+            'enable_by_default': True,
+            'suites': ['--activeTests', 'tp5:ts:tsvg', '--mozAfterPaint'],
+            'options': ({}, ['linux', 'macosx', 'win32']),
+        }
+
+    PLATFORMS = {}
+    ACTIVE_UNITTEST_PLATFORMS = {}
+    for platform in platformNames(numPlatforms):
+        os_type = osType(platform)
+        if os_type not in SLAVE_PLATFORMS:
+            # Mobile talos runs on devices, which we don't bother with
+            continue
+        slave_platforms = SLAVE_PLATFORMS[os_type]
+        platform_config = {
+            'slave_platforms': slave_platforms,
+            'env_name': TALOS_ENVS[os_type],
+            'stage_product': 'firefox',
+        }
+        branch_pf = branch_config['platforms'][platform]
+        branch_pf.update({
+            'enable_opt_unittests': True,
+            'enable_debug_unittests': True,
+            'slave_platforms': slave_platforms,
+        })
+        for slave_platform in slave_platforms:
+            platform_config[slave_platform] = {
+                'name': 'Rev4 %s %s' % (slave_platform.capitalize(),
+                                        platform),
+                'slaves': makeSlaves('talos-%s' % slave_platform, 20),
+            }
+            branch_pf[slave_platform] = {
+                'opt_unittest_suites': unittest_suites[:],
+                'debug_unittest_suites': unittest_suites[:],
+            }
+        PLATFORMS[platform] = platform_config
+        ACTIVE_UNITTEST_PLATFORMS[platform] = platform_config
+
+    all_slave_platforms = []
+    for slave_platforms in SLAVE_PLATFORMS.values():
+        all_slave_platforms.extend(slave_platforms)
+    for suite in SUITES:
+        branch_config['%s_tests' % suite] = (1, True, {},
+                                             all_slave_platforms)
+
+    branch_config.update({
+        'branch_name': name.capitalize(),
+        'build_branch': name,
+        'mobile_branch_name': 'Mobile-%s' % name,
+        'mobile_tinderbox_tree': 'Mobile-%s' % name,
+        'support_url_base': 'http://build.mozilla.org/talos',
+        'talos_command': ['python', 'run_tests.py', '--noisy'],
+        'fetch_symbols': True,
+        'mozharness_repo': 'http://hg.mozilla.org/build/mozharness',
+    })
+    return branch_config, PLATFORMS, SUITES, ACTIVE_UNITTEST_PLATFORMS
+
+
+def makeSpiderMonkeyConfig(branch, numPlatforms=6, numVariants=4):
+    """Returns (project name, project config) for generateProjectObjects"""
+    branchconfig = makeBranchConfig(branch, numPlatforms, 0, 0)
+    variants = ['variant-%i' % i for i in range(numVariants)]
+    platforms = {}
+    for platform in platformNames(numPlatforms):
+        pf = branchconfig['platforms'][platform]
+        platforms[platform] = {
+            'base_name': '%s_%%(branch)s' % platform,
+            'slaves': pf['slaves'],
+            'env': pf['env'],
+        }
+        for key in ('use_mock', 'mock_target', 'mock_packages',
+                    'mock_copyin_files'):
+            if key in pf:
+                platforms[platform][key] = pf[key]
+    branchconfig.update({
+        'base_mirror_urls': ['http://hg-internal.dmz.scl3.mozilla.com'],
+        'base_bundle_urls': ['http://ftp.mozilla.org/pub/mozilla.org/firefox/bundles'],
+    })
+    config = {
+        'branch': branch,
+        'repo_path': 'projects/%s' % branch,
+        'hgurl': 'http://hg.mozilla.org/',
+        'branchconfig': branchconfig,
+        'scripts_repo': 'http://hg.mozilla.org/build/tools',
+        'variants': dict((p, variants) for p in platforms),
+        'platforms': platforms,
+        'idle_slaves': 3,
+    }
+    return 'spidermonkey_%s' % branch, config
+
+
+def makeReleaseConfig(branch, numPlatforms=6, numSuites=10, numChunks=3):
+    """Returns (releaseConfig, branchConfig) for
+    generateReleaseBranchObjects"""
+    branchConfig = makeBranchConfig(branch, numPlatforms, numSuites,
+                                    numChunks)
+    branchConfig['buildbotcustom_repo_path'] = 'build/buildbotcustom'
+    platforms = [p for p in platformNames(numPlatforms)
+                 if osType(p) != 'android']
+    version = '20.0'
+    releaseConfig = {
+        'productName': 'firefox',
+        'appName': 'browser',
+        'version': version,
+        'appVersion': version,
+        'milestone': version,
+        'buildNumber': 1,
+        'baseTag': 'FIREFOX_20_0',
+        'sourceRepositories': {
+            'mozilla': {
+                'name': branch,
+                'path': 'releases/%s' % branch,
+                'revision': 'abcdef123456',
+                'relbranch': None,
+                'bumpFiles': {
+                    'browser/config/version.txt': {
+                        'version': version,
+                        'nextVersion': version,
+                    },
+                },
+            },
+        },
+        'l10nRepoPath': 'releases/l10n/%s' % branch,
+        'l10nRepoClonePath': 'releases/l10n/%s' % branch,
+        'l10nRevisionFile': 'l10n-changesets_%s' % branch,
+        'l10nChunks': numChunks,
+        'l10nPlatforms': platforms,
+        'enUSPlatforms': platforms,
+        'notifyPlatforms': platforms,
+        'talosTestPlatforms': platforms,
+        'unittestPlatforms': platforms,
+        'xulrunnerPlatforms': [],
+        'mock_platforms': [p for p in platforms if osType(p).startswith('linux')],
+        'enableUnittests': True,
+        'enable_repo_setup': False,
+        'partnersRepoPath': 'build/partner-repacks',
+        'doPartnerRepacks': False,
+        'partnerRepackPlatforms': platforms,
+        'userRepoRoot': 'users/stage-ffxbld',
+        'hgUsername': 'stage-ffxbld',
+        'hgSshKey': '~cltbld/.ssh/ffxbld_dsa',
+        'stagingServer': 'stage.mozilla.org',
+        'ftpServer': 'ftp.mozilla.org',
+        'bouncerServer': 'download.mozilla.org',
+        'ausServerUrl': 'https://aus3.mozilla.org',
+        'ausHost': 'aus3-staging.mozilla.org',
+        'ausUser': 'ffxbld',
+        'ausSshKey': 'auspush',
+        'releaseNotesUrl': None,
+        'testOlderPartials': False,
+        'patcherConfig': 'mozRelease-branch-patcher2.cfg',
+        'majorUpdateToVersion': None,
+        'majorUpdateBuildNumber': None,
+        'majorUpdateVerifyConfigs': {},
+        'verifyConfigs': dict((p, 'moz20-firefox-%s.cfg' % p)
+                              for p in platforms),
+        'partialUpdates': {
+            '19.0.2': {'appVersion': '19.0.2', 'buildNumber': 1,
+                       'baseTag': 'FIREFOX_19_0_2'},
+        },
+        'releaseTemplates': 'release_templates',
+        'mozilla_dir': '',
+        'single_locale_options': {},
+        'tuxedoConfig': 'firefox-tuxedo.ini',
+        'tuxedoServerUrl': 'https://bounceradmin.mozilla.com/api',
+        'extraBouncerPlatforms': (),
+        'releaseChannel': 'release',
+        'snippetSchema': 2,
+        'usePrettyNames': True,
+        'autoGenerateChecksums': False,
+        'enableSigningAtBuildTime': True,
+        'enablePartialMarsAtBuildTime': True,
+        'mozconfigs': dict((p, 'browser/config/mozconfigs/%s/release' % p)
+                           for p in platforms),
+        'AllRecipients': ['release@example.com'],
+        'ImportantRecipients': ['release-drivers@example.com'],
+        'AVVendorsRecipients': [],
+    }
+    return releaseConfig, branchConfig
+
+
+def makeSecrets():
+    """Returns secrets with a signing server for each kind of signing"""
+    servers = [('signing%i.example.com:9120' % i, 'user', 'pass')
+               for i in range(3)]
+    return {
+        'dep-signing': servers,
+        'nightly-signing': servers,
+        'release-signing': servers,
+        'mac-release-signing': servers,
+    }
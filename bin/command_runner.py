@@ -0,0 +1,387 @@
+#!/usr/bin/env python
+"""
+command_runner.py [options] /path/to/queuedir
+
+Runs the commands added to a command queuedir by QueuedCommandHandler and
+postrun.py.
+
+Each queue item is a JSON list of arguments.  Up to --concurrency commands are
+run at once, each in its own process.  A command's type is the name of the
+script it runs (e.g. postrun.py); --type-limit caps how many commands of one
+type can run at once.
+
+Items are read from the queuedir as soon as they show up, and are held here
+until they can run.  Pending commands are run in order of priority, and then
+age.  --priority gives commands matching a regular expression a higher
+priority, e.g. --priority try=10 runs commands for try builders first.  A
+command that is identical to one that is already pending or running is
+dropped.
+
+Failed commands are requeued with exponential backoff, starting at
+--retry-time seconds and doubling for each failure up to --max-retry-time.
+
+If --stats-file is given, a JSON summary of what we're doing is written there
+every --stats-interval seconds.
+"""
+import os
+import re
+import time
+import subprocess
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+import logging
+log = logging.getLogger(__name__)
+
+from mozilla_buildtools.queuedir import QueueDir
+
+
+def commandType(cmd):
+    """Returns the name of the script cmd runs"""
+    for arg in cmd:
+        if arg.endswith('.py') or arg.endswith('.sh'):
+            return os.path.basename(arg)
+    return os.path.basename(cmd[0])
+
+
+def itemTime(item_id):
+    """Returns when item_id was added to the queuedir, based on its name, or
+    None if we can't tell"""
+    m = re.match(r"^(\d+(?:\.\d+)?)-", item_id)
+    if m:
+        return float(m.group(1))
+    return None
+
+
+class Job(object):
+    def __init__(self, cmd, item_id, priority=0, added=None):
+        self.cmd = cmd
+        self.item_id = item_id
+        self.priority = priority
+        self.key = json.dumps(cmd)
+        self.type = commandType(cmd)
+        self.seen = time.time()
+        self.added = added or itemTime(item_id) or self.seen
+        self.started = None
+        self.proc = None
+        self.log = None
+
+    def sortkey(self):
+        return (-self.priority, self.added)
+
+    def start(self, log_fp):
+        devnull = open(os.devnull, 'r')
+        try:
+            log_fp.write("Running %s\n" % self.cmd)
+            log_fp.flush()
+            try:
+                self.proc = subprocess.Popen(self.cmd, close_fds=True,
+                                             stdin=devnull, stdout=log_fp,
+                                             stderr=log_fp)
+            except OSError:
+                # The job gets requeued; don't leak its log
+                log_fp.close()
+                raise
+        finally:
+            devnull.close()
+        self.log = log_fp
+        self.started = time.time()
+
+    def check(self):
+        """Returns the command's exit code if it has finished, or None"""
+        result = self.proc.poll()
+        if result is not None:
+            self.log.write("\nResult: %s, Elapsed: %1.1f seconds\n" %
+                           (result, time.time() - self.started))
+            self.log.close()
+        return result
+
+    def kill(self):
+        if self.proc.poll() is None:
+            self.proc.kill()
+            self.proc.wait()
+        self.log.close()
+
+
+class CommandRunner(object):
+    def __init__(self, options):
+        self.q = QueueDir('commands', options.queuedir)
+        self.concurrency = options.concurrency
+        self.type_limits = options.type_limits
+        self.priorities = options.priorities
+        self.retry_time = options.retry_time
+        self.max_retry_time = options.max_retry_time
+        self.max_retries = options.max_retries
+        self.max_time = options.max_time
+        self.stats_file = options.stats_file
+        self.stats_interval = options.stats_interval
+
+        # Jobs we've taken from the queuedir but haven't started
+        self.pending = []
+        self.active = []
+        # Commands of pending and active jobs, for finding duplicates
+        self.commands = set()
+        # command -> number of times it has failed
+        self.failures = {}
+
+        self.stats = {
+            'started': time.time(),
+            'completed': 0,
+            'failed': 0,
+            'duplicates': 0,
+            'invalid': 0,
+        }
+        # (finish time, queue age) of recent jobs, for throughput and age
+        # stats
+        self.finished = []
+        self.last_stats = 0
+
+    def getPriority(self, cmd):
+        """Returns the highest priority matching cmd"""
+        s = " ".join(cmd)
+        retval = 0
+        for regex, priority in self.priorities:
+            if priority > retval and regex.search(s):
+                retval = priority
+        return retval
+
+    def readQueue(self):
+        """Takes all the available items from the queuedir"""
+        n = 0
+        while True:
+            item = self.q.pop()
+            if not item:
+                break
+            item_id, fp = item
+            try:
+                try:
+                    cmd = json.load(fp)
+                except ValueError:
+                    # Couldn't parse it as json
+                    # There's no hope!
+                    self.q.log(item_id, "Couldn't load json; murdering")
+                    self.q.murder(item_id)
+                    self.stats['invalid'] += 1
+                    continue
+            finally:
+                fp.close()
+
+            job = Job(cmd, item_id, self.getPriority(cmd))
+            if job.key in self.commands:
+                log.info("%s is a duplicate; removing", item_id)
+                self.q.log(item_id, "Duplicate of a pending command; removing")
+                self.q.remove(item_id)
+                self.stats['duplicates'] += 1
+                continue
+            self.pending.append(job)
+            self.commands.add(job.key)
+            n += 1
+        if n:
+            self.pending.sort(key=lambda j: j.sortkey())
+        return n
+
+    def runningOfType(self, t):
+        return len([j for j in self.active if j.type == t])
+
+    def startJobs(self):
+        """Starts as many pending jobs as our limits allow, in priority
+        order"""
+        for job in self.pending[:]:
+            if len(self.active) >= self.concurrency:
+                break
+            limit = self.type_limits.get(job.type)
+            if limit is not None and self.runningOfType(job.type) >= limit:
+                continue
+            self.pending.remove(job)
+            log.info("starting %s (priority %i): %s", job.item_id,
+                     job.priority, job.cmd)
+            try:
+                job.start(self.q.getlog(job.item_id))
+            except OSError:
+                log.exception("couldn't start %s", job.item_id)
+                self.commands.discard(job.key)
+                self.requeue(job)
+                continue
+            self.active.append(job)
+
+    def requeue(self, job):
+        failures = self.failures.get(job.key, 0)
+        delay = min(self.retry_time * (2 ** failures), self.max_retry_time)
+        self.failures[job.key] = failures + 1
+        log.warn("%s failed; requeuing in %i seconds", job.item_id, delay)
+        self.q.requeue(job.item_id, delay, self.max_retries)
+
+    def monitor(self):
+        """Checks up on our running jobs"""
+        now = time.time()
+        for job in self.active[:]:
+            self.q.touch(job.item_id)
+            if self.max_time and now - job.started > self.max_time:
+                log.warn("%s has run for too long; killing", job.item_id)
+                job.kill()
+                result = -1
+            else:
+                result = job.check()
+            if result is None:
+                continue
+            self.active.remove(job)
+            self.commands.discard(job.key)
+            self.finished.append((now, job.started - job.added))
+            if result == 0:
+                self.stats['completed'] += 1
+                self.failures.pop(job.key, None)
+                self.q.remove(job.item_id)
+            else:
+                self.stats['failed'] += 1
+                self.requeue(job)
+
+        # Let the queuedir know we're still holding on to these
+        for job in self.pending:
+            self.q.touch(job.item_id)
+
+    def getStats(self):
+        now = time.time()
+        # Only keep the last hour of finished jobs
+        self.finished = [f for f in self.finished if f[0] > now - 3600]
+        window = min(now - self.stats['started'], 3600)
+
+        retval = dict(self.stats)
+        retval['time'] = now
+        retval['running'] = len(self.active)
+        retval['pending'] = len(self.pending)
+        retval['running_by_type'] = {}
+        for job in self.active:
+            retval['running_by_type'][job.type] = \
+                retval['running_by_type'].get(job.type, 0) + 1
+        retval['jobs_per_minute'] = len(self.finished) / (window / 60.0) \
+            if window > 0 else 0
+        if self.finished:
+            ages = [f[1] for f in self.finished]
+            retval['mean_queue_age'] = sum(ages) / len(ages)
+            retval['max_queue_age'] = max(ages)
+        else:
+            retval['mean_queue_age'] = retval['max_queue_age'] = 0
+        if self.pending:
+            retval['oldest_pending_age'] = \
+                now - min(j.added for j in self.pending)
+        else:
+            retval['oldest_pending_age'] = 0
+        return retval
+
+    def writeStats(self):
+        now = time.time()
+        if not self.stats_file or now - self.last_stats < self.stats_interval:
+            return
+        self.last_stats = now
+        tmp_file = self.stats_file + '.tmp'
+        try:
+            f = open(tmp_file, 'w')
+            try:
+                json.dump(self.getStats(), f, indent=2, sort_keys=True)
+            finally:
+                f.close()
+            os.rename(tmp_file, self.stats_file)
+        except (IOError, OSError):
+            log.exception("couldn't write stats to %s", self.stats_file)
+
+    def loop(self):
+        """
+        Main processing loop. Read new items from the queue and run them!
+        """
+        while True:
+            self.monitor()
+            self.readQueue()
+            self.startJobs()
+            self.writeStats()
+
+            if self.active or self.pending:
+                # Don't wait for very long, since we have to check up on
+                # our children
+                self.q.wait(1)
+            else:
+                self.q.wait(self.stats_interval)
+
+    def shutdown(self):
+        for job in self.active:
+            log.info("killing %s", job.item_id)
+            job.kill()
+
+
+def parseLimits(values, option):
+    """Parses a list of name=int strings into a dictionary"""
+    retval = {}
+    for v in values:
+        try:
+            name, limit = v.rsplit("=", 1)
+            retval[name] = int(limit)
+        except ValueError:
+            raise ValueError("invalid %s: %s" % (option, v))
+    return retval
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(
+        concurrency=1,
+        type_limits=[],
+        priorities=[],
+        retry_time=60,
+        max_retry_time=3600,
+        max_retries=5,
+        max_time=3600,
+        stats_file=None,
+        stats_interval=60,
+        loglevel=logging.INFO,
+    )
+    parser.add_option("-j", "--concurrency", dest="concurrency", type="int",
+                      help="number of commands to run at once")
+    parser.add_option("--type-limit", dest="type_limits", action="append",
+                      help="script=N; run at most N commands running script "
+                      "at once")
+    parser.add_option("--priority", dest="priorities", action="append",
+                      help="regex=N; commands matching regex get priority N")
+    parser.add_option("-r", "--retry-time", dest="retry_time", type="int",
+                      help="seconds to wait before retrying a failed command")
+    parser.add_option("--max-retry-time", dest="max_retry_time", type="int",
+                      help="longest time to wait before retrying a command")
+    parser.add_option("-m", "--max-retries", dest="max_retries", type="int",
+                      help="number of times to retry a command")
+    parser.add_option("-t", "--max-time", dest="max_time", type="int",
+                      help="maximum seconds a command can run for")
+    parser.add_option("--stats-file", dest="stats_file",
+                      help="write stats to this file")
+    parser.add_option("--stats-interval", dest="stats_interval", type="int",
+                      help="seconds between writing stats")
+    parser.add_option("-v", "--verbose", dest="loglevel",
+                      const=logging.DEBUG, action="store_const")
+    parser.add_option("-q", "--quiet", dest="loglevel",
+                      const=logging.WARNING, action="store_const")
+
+    options, args = parser.parse_args()
+
+    if len(args) != 1:
+        parser.error("you must specify a queuedir")
+    options.queuedir = args[0]
+
+    try:
+        options.type_limits = parseLimits(options.type_limits, "type limit")
+        priorities = parseLimits(options.priorities, "priority")
+    except ValueError, e:
+        parser.error(str(e))
+    options.priorities = [(re.compile(regex), p)
+                          for regex, p in priorities.items()]
+
+    logging.basicConfig(level=options.loglevel,
+                        format="%(asctime)s - %(message)s")
+
+    runner = CommandRunner(options)
+    try:
+        runner.loop()
+    finally:
+        runner.shutdown()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+config_diff.py [options] --baseline old.json new
+
+Shows which builders a change to a master's config adds, removes or changes.
+new is either a jobs file (see buildbotcustom/checkconfig.py), whose jobs are
+run to make the builders, or a file of builder forms saved by --save.  They
+are compared to the forms in the --baseline file, e.g.:
+
+    (with the old config checked out)
+    config_diff.py --save old.json jobs.py
+    (with the new config checked out)
+    config_diff.py --baseline old.json jobs.py
+
+The baseline only has to be made once; comparing against it again after
+more changes only runs the new config.  See buildbotcustom/configdiff.py.
+
+Exits with status 1 if any builders differ, or a job failed.
+"""
+import os
+import sys
+import time
+
+from buildbotcustom.checkconfig import loadJobsFile
+from buildbotcustom.configdiff import generateForms, saveForms, loadForms, \
+    diffForms
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(
+        processes=None,
+        baseline=None,
+        save=None,
+        verbose=False,
+    )
+    parser.add_option("-j", "--processes", dest="processes", type="int",
+                      help="number of processes to use (default: one per "
+                      "CPU)")
+    parser.add_option("-b", "--baseline", dest="baseline",
+                      help="saved builder forms to compare to")
+    parser.add_option("-s", "--save", dest="save",
+                      help="save the new builder forms to this file")
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true",
+                      help="print where each changed builder differs")
+
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("you must specify a jobs file or saved forms")
+    if not options.baseline and not options.save:
+        parser.error("nothing to do without --baseline or --save")
+
+    start = time.time()
+    # Loading the jobs file changes directory
+    if options.save:
+        options.save = os.path.abspath(options.save)
+    old = None
+    if options.baseline:
+        old = loadForms(options.baseline)
+    if args[0].endswith('.json'):
+        new, errors = loadForms(args[0]), []
+    else:
+        jobs = loadJobsFile(args[0])[0]
+        new, errors = generateForms(jobs, options.processes)
+    for e in errors:
+        print "Error: %s" % e
+    if options.save:
+        saveForms(new, options.save)
+
+    status = 0
+    if errors:
+        status = 1
+    if old is not None:
+        added, removed, changed = diffForms(old, new)
+        for name in added:
+            print "Added: %s" % name
+        for name in removed:
+            print "Removed: %s" % name
+        for name, differences in changed:
+            print "Changed: %s" % name
+            if options.verbose:
+                for d in differences:
+                    print "    %s" % d
+        print "%i builders: %i added, %i removed, %i changed in %.1fs" % (
+            len(new), len(added), len(removed), len(changed),
+            time.time() - start)
+        if added or removed or changed:
+            status = 1
+    sys.exit(status)
+
+if __name__ == '__main__':
+    main()
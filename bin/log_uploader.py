@@ -4,7 +4,6 @@
 Uploads logs from build to the given host.
 """
 import os
-import cPickle
 import gzip
 import subprocess
 from datetime import datetime
@@ -14,6 +13,7 @@ from buildbot import util
 from buildbot.status.builder import Results
 
 from buildbotcustom.process.factory import postUploadCmdPrefix
+from buildbotcustom.status.build_files import loadBuild
 
 from util.retry import retry
 
@@ -59,17 +59,7 @@ def scp(user, identity, host, files, remote_dir, port=22):
 
 def getBuild(builder_path, build_number):
     build_path = os.path.join(builder_path, build_number)
-
-    if not os.path.exists(build_path):
-        raise ValueError("Couldn't find %s" % build_path)
-
-    class FakeBuilder:
-        basedir = builder_path
-        name = os.path.basename(builder_path)
-
-    build = cPickle.load(open(build_path))
-    build.builder = FakeBuilder()
-    return build
+    return loadBuild(build_path)
 
 
 def getAuthor(build):
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+parallel_checkconfig.py [options] jobs.py
+
+Checks the builders, schedulers and so on that a master's config makes, by
+running each of the jobs in jobs.py (e.g. generateBranchObjects for each
+branch) in one of a pool of processes, and then checking their results
+together.  See buildbotcustom/checkconfig.py for what goes in jobs.py.
+
+Prints the errors and warnings found, and exits with status 1 if there were
+any errors.  --json writes the summary of every job's objects to a file.
+"""
+import sys
+import time
+
+from buildbot.util import json
+
+from buildbotcustom.checkconfig import loadJobsFile, runJobs, checkSummaries
+
+
+def main():
+    from optparse import OptionParser
+    parser = OptionParser(__doc__)
+    parser.set_defaults(
+        processes=None,
+        json=None,
+        verbose=False,
+    )
+    parser.add_option("-j", "--processes", dest="processes", type="int",
+                      help="number of processes to use (default: one per "
+                      "CPU)")
+    parser.add_option("--json", dest="json",
+                      help="write the summaries of all the jobs to this file")
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true",
+                      help="print how long each job took")
+
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("you must specify a jobs file")
+
+    start = time.time()
+    jobs, slaves = loadJobsFile(args[0])
+    summaries = runJobs(jobs, options.processes)
+    errors, warnings = checkSummaries(summaries, slaves)
+
+    if options.verbose:
+        for s in sorted(summaries, key=lambda s: -s['time']):
+            print "%-40s %5i builders %8.2fs" % (s['name'], len(s['builders']),
+                                                 s['time'])
+    for w in warnings:
+        print "Warning: %s" % w
+    for e in errors:
+        print "Error: %s" % e
+    print "%i jobs, %i builders, %i schedulers: %i errors in %.1fs" % (
+        len(summaries), sum(len(s['builders']) for s in summaries),
+        sum(len(s['schedulers']) for s in summaries), len(errors),
+        time.time() - start)
+
+    if options.json:
+        f = open(options.json, 'w')
+        json.dump(summaries, f, indent=2, sort_keys=True)
+        f.close()
+
+    if errors:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
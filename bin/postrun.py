@@ -26,7 +26,6 @@ command queue entries.
 import os
 import sys
 import re
-import cPickle as pickle
 from datetime import datetime
 try:
     import simplejson as json
@@ -38,6 +37,7 @@ log = logging.getLogger(__name__)
 
 import sqlalchemy as sa
 import buildbotcustom.status.db.model as model
+from buildbotcustom.status.build_files import loadBuild, loadBuildSummary
 from mozilla_buildtools.queuedir import QueueDir
 
 from util.commands import get_output
@@ -137,19 +137,10 @@ class PostRunner(object):
         return retval
 
     def getBuild(self, build_path):
+        # None of our tasks look at the step logs themselves; log_uploader.py
+        # loads the full build when it needs them.
         log.info("Loading build pickle")
-        if not os.path.exists(build_path):
-            raise ValueError("Couldn't find %s" % build_path)
-
-        builder_path = os.path.dirname(build_path)
-
-        class FakeBuilder:
-            basedir = builder_path
-            name = os.path.basename(builder_path)
-
-        build = pickle.load(open(build_path))
-        build.builder = FakeBuilder()
-        return build
+        return loadBuild(build_path, logs=False)
 
     def getBuildInfo(self, build):
         """
@@ -193,10 +184,14 @@ class PostRunner(object):
         return retval
 
     def writePulseMessage(self, options, build, build_id):
-        builder_name = build.builder.name
+        self.writePulseMessageFromDict(options, build.builder.name,
+                                       build.number, build.asDict(), build_id)
+
+    def writePulseMessageFromDict(self, options, builder_name, build_number,
+                                  build_dict, build_id):
         msg = {
-            'event': 'build.%s.%s.log_uploaded' % (builder_name, build.number),
-            'payload': {"build": build.asDict()},
+            'event': 'build.%s.%s.log_uploaded' % (builder_name, build_number),
+            'payload': {"build": build_dict},
             'master_name': options.master_name,
             'master_incarnation': options.master_incarnation,
             'id': build_id,
@@ -283,7 +278,35 @@ class PostRunner(object):
                 retval[i] = submitted_at[0]
         return retval
 
+    def publishSummary(self, options, build_path, summary, request_ids):
+        """Writes the pulse message using the JSON build summary written at
+        build finish time instead of the build pickle"""
+        build_dict = summary['build']
+        props = {
+            'log_url': options.log_url,
+            'statusdb_id': options.statusdb_id,
+            'request_ids': [int(i) for i in request_ids],
+            'request_times': self.getRequestTimes(request_ids),
+        }
+        properties = [p for p in build_dict.get('properties', [])
+                      if p[0] not in props]
+        for name, value in sorted(props.items()):
+            properties.append([name, value, 'postrun.py'])
+        build_dict['properties'] = properties
+
+        builder_name = os.path.basename(os.path.dirname(build_path))
+        self.writePulseMessageFromDict(options, builder_name,
+                                       summary['number'], build_dict,
+                                       options.statusdb_id)
+
     def processBuild(self, options, build_path, request_ids):
+        if options.log_url and options.statusdb_id:
+            summary = loadBuildSummary(build_path)
+            if summary is not None:
+                log.info("publishing to pulse from build summary")
+                self.publishSummary(options, build_path, summary, request_ids)
+                return
+
         build = self.getBuild(build_path)
         info = self.getBuildInfo(build)
         if not options.log_url:
@@ -7,26 +7,17 @@ import subprocess
 import sys
 import os
 import re
-import cPickle
 from email.message import Message
 from email.utils import formatdate
 
 from buildbot.status.builder import SUCCESS, WARNINGS, FAILURE, EXCEPTION, RETRY
 
+from buildbotcustom.status.build_files import loadBuild
 
-def getBuild(builder_path, build_number):
-    build_path = os.path.join(builder_path, build_number)
-
-    if not os.path.exists(build_path):
-        raise ValueError("Couldn't find %s" % build_path)
 
-    class FakeBuilder:
-        basedir = builder_path
-        name = os.path.basename(builder_path)
-
-    build = cPickle.load(open(build_path))
-    build.builder = FakeBuilder()
-    return build
+def getBuild(builder_path, build_number, logs=True):
+    build_path = os.path.join(builder_path, build_number)
+    return loadBuild(build_path, logs=logs)
 
 
 def uploadLog(args):
@@ -196,7 +187,9 @@ if __name__ == '__main__':
     )
 
     builder_path, build_number = args[-2:]
-    build = getBuild(builder_path, build_number)
+    # Only test runs include the summary logs in the message
+    is_test = 'test' in os.path.basename(os.path.normpath(builder_path))
+    build = getBuild(builder_path, build_number, logs=is_test)
 
     # check the commit message for syntax regarding email prefs
     match = re.search("try: ", build.source.changes[-1].comments)
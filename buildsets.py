@@ -0,0 +1,110 @@
+# Helpers for schedulers that create lots of buildsets at once
+"""
+buildbot's db connector creates buildsets one at a time, with an INSERT per
+buildset, per property and per build request.  Schedulers that fan out into
+many buildsets (MultiScheduler, the l10n schedulers) can use
+create_buildsets instead, which inserts the properties and build requests for
+all the buildsets with a single executemany() each.  MySQLdb turns these into
+multi-row inserts.
+"""
+from twisted.python import log
+
+from buildbot.util import json
+
+
+def sourcestamp_key(ss):
+    """Returns a key identifying what ss would be stored as in the
+    sourcestamps table"""
+    changeids = tuple(sorted(c.number for c in ss.changes))
+    return (ss.branch, ss.revision, ss.patch, ss.project, ss.repository,
+            changeids)
+
+
+def get_sourcestampids(db, t, sourcestamps):
+    """Returns a list of sourcestamp ids for sourcestamps, creating only one
+    sourcestamp for identical stamps"""
+    ssids = {}
+    retval = []
+    for ss in sourcestamps:
+        key = sourcestamp_key(ss)
+        if key not in ssids:
+            ssids[key] = db.get_sourcestampid(ss, t)
+        retval.append(ssids[key])
+    return retval
+
+
+def create_buildsets(db, t, buildsets, now=None):
+    """Creates buildsets and their build requests.  buildsets is a list of
+    (ssid, reason, properties, builderNames) tuples.  Returns the list of new
+    buildset ids, in the same order.
+
+    This does the same as calling db.create_buildset for each buildset, and
+    sends the same notifications."""
+    #### NOTE: called in a thread!
+    if not buildsets:
+        return []
+    if now is None:
+        now = db._getCurrentTime()
+
+    bsids = []
+    props_rows = []
+    request_rows = []
+    for ssid, reason, properties, builderNames in buildsets:
+        # We need each buildset's id, so these have to be inserted one at a
+        # time
+        t.execute(db.quoteq("INSERT INTO buildsets"
+                            " (external_idstring, reason,"
+                            "  sourcestampid, submitted_at)"
+                            " VALUES (?,?,?,?)"),
+                  (None, reason, ssid, now))
+        bsid = t.lastrowid
+        bsids.append(bsid)
+        for propname, propvalue in properties.properties.items():
+            props_rows.append((bsid, propname, json.dumps(propvalue)))
+        for bn in builderNames:
+            request_rows.append((bsid, bn, now))
+
+    if props_rows:
+        t.executemany(db.quoteq("INSERT INTO buildset_properties"
+                                " (buildsetid, property_name, property_value)"
+                                " VALUES (?,?,?)"), props_rows)
+    brids = []
+    if request_rows:
+        t.executemany(db.quoteq("INSERT INTO buildrequests"
+                                " (buildsetid, buildername, submitted_at)"
+                                " VALUES (?,?,?)"), request_rows)
+        q = db.quoteq("SELECT id FROM buildrequests WHERE buildsetid IN %s" %
+                      db.parmlist(len(bsids)))
+        t.execute(q, tuple(bsids))
+        brids = [brid for (brid,) in t.fetchall()]
+
+    for bsid in bsids:
+        db.notify("add-buildset", bsid)
+    db.notify("add-buildrequest", *brids)
+    log.msg("created %i buildsets with %i build requests" %
+            (len(bsids), len(brids)))
+    return bsids
+
+
+class BulkBuildsetMixin:
+    """Adds create_buildsets to a scheduler, the bulk version of
+    create_buildset"""
+
+    def create_buildsets(self, buildsets, t):
+        """buildsets is a list of (ssid, reason, props, builderNames) tuples.
+        props and builderNames can be None, in which case the scheduler's
+        properties and builderNames are used, as with create_buildset.
+        Returns the list of new buildset ids."""
+        db = self.parent.db
+        filled = []
+        for ssid, reason, props, builderNames in buildsets:
+            if props is None:
+                props = self.properties
+            if builderNames is None:
+                builderNames = self.builderNames
+            filled.append((ssid, reason, props, builderNames))
+        bsids = create_buildsets(db, t, filled)
+        # notify downstream schedulers so they can watch for them to complete
+        for bsid in bsids:
+            self.parent.publish_buildset(self.name, bsid, t)
+        return bsids
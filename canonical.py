@@ -0,0 +1,147 @@
+# Describing config objects in a way that doesn't depend on the process
+"""
+Both reconfig (misc.reusesObjects) and the config diff tool (configdiff.py)
+need to tell whether objects made in different processes, or different
+reconfigs, are the same.  They do that by comparing canonical forms: plain
+lists, dicts, strings and numbers made by canonicalForm.  Keeping one
+description means the two always agree about what counts as unchanged.
+"""
+import hashlib
+import re
+import types
+
+from buildbot.process.factory import BuildFactory
+from buildbot.util import json
+
+# Matches the addresses in reprs like <foo.Bar object at 0xdeadbeef>, which
+# are different every time
+_addressRe = re.compile(r' at 0x[0-9a-fA-F]+')
+
+
+class UnstableForm(Exception):
+    """Raised by canonicalForm with a strict FormMemo for objects that don't
+    have a form that stays the same between processes"""
+    pass
+
+
+def _qualifiedName(obj):
+    return '%s.%s' % (getattr(obj, '__module__', None), obj.__name__)
+
+
+def _codeForm(code, memo):
+    # The bytecode itself isn't readable, so it is only hashed; the
+    # constants and names that it uses are shown
+    return {
+        'code': code.co_name,
+        'bytecode': hashlib.sha1(code.co_code).hexdigest(),
+        'consts': canonicalForm(code.co_consts, memo),
+        'names': list(code.co_names),
+    }
+
+
+class FormMemo(object):
+    """Remembers the forms of the objects passed to canonicalForm, so that
+    objects that are used in many places (like the code of the functions
+    that are made for every builder) are only described once.
+
+    If `strict` is set, objects that are found inside themselves, or whose
+    repr includes an address, raise UnstableForm instead of being described
+    as well as they can be."""
+    def __init__(self, strict=False):
+        self.strict = strict
+        # id to (object, form); the object is kept so that its id isn't
+        # reused
+        self.forms = {}
+        # The same for factories' steps
+        self.steps = {}
+        # The ids of the objects being described
+        self.active = set()
+        # How many times an object was found inside itself.  Forms of
+        # objects with cycles depend on where they were reached from, so
+        # they aren't remembered.
+        self.cycles = 0
+
+
+def canonicalForm(obj, memo=None):
+    """Returns a description of obj made of lists, dicts with string keys,
+    strings and numbers, that is the same for equal objects in different
+    processes.  Containers, functions and plain instances are described by
+    their contents; anything else by its repr.  memo is a FormMemo."""
+    if memo is None:
+        memo = FormMemo()
+    if obj is None or isinstance(obj, (bool, int, long, float)):
+        return obj
+    if isinstance(obj, str):
+        # So that forms can be saved as json whatever the encoding
+        return obj.decode('utf-8', 'replace')
+    if isinstance(obj, unicode):
+        return obj
+    if isinstance(obj, (type, types.ClassType)):
+        return '<class %s>' % _qualifiedName(obj)
+    if isinstance(obj, types.ModuleType):
+        return '<module %s>' % obj.__name__
+
+    if id(obj) in memo.forms:
+        return memo.forms[id(obj)][1]
+    if id(obj) in memo.active:
+        if memo.strict:
+            raise UnstableForm(obj)
+        memo.cycles += 1
+        return '<cycle>'
+    memo.active.add(id(obj))
+    cycles = memo.cycles
+    if isinstance(obj, types.CodeType):
+        form = _codeForm(obj, memo)
+    elif isinstance(obj, dict):
+        form = {}
+        for k, v in obj.items():
+            k = canonicalForm(k, memo)
+            if not isinstance(k, unicode):
+                k = json.dumps(k, sort_keys=True)
+            form[k] = canonicalForm(v, memo)
+    elif isinstance(obj, (list, tuple)):
+        form = [canonicalForm(v, memo) for v in obj]
+    elif isinstance(obj, (set, frozenset)):
+        form = sorted((canonicalForm(v, memo) for v in obj),
+                      key=lambda f: json.dumps(f, sort_keys=True))
+    elif isinstance(obj, types.FunctionType):
+        form = {
+            'function': _qualifiedName(obj),
+            'code': canonicalForm(obj.func_code, memo),
+            'defaults': canonicalForm(obj.func_defaults, memo),
+            'closure': canonicalForm([c.cell_contents for c in
+                                      obj.func_closure or []], memo),
+        }
+    elif isinstance(obj, types.MethodType):
+        form = {
+            'method': obj.__name__,
+            'function': canonicalForm(obj.im_func, memo),
+            'self': canonicalForm(obj.im_self, memo),
+        }
+    elif isinstance(obj, BuildFactory):
+        # A factory used by one of its own steps, e.g. through a bound
+        # method; its steps are described by configdiff.builderForm
+        attributes = obj.__dict__.copy()
+        attributes.pop('steps', None)
+        form = {
+            'class': _qualifiedName(obj.__class__),
+            'attributes': canonicalForm(attributes, memo),
+        }
+    elif isinstance(obj, types.InstanceType) or \
+            (hasattr(obj, '__dict__') and
+             type(obj).__repr__ is object.__repr__):
+        # e.g. WithProperties or a lock; describe it by its class and
+        # attributes
+        form = {
+            'class': _qualifiedName(obj.__class__),
+            'attributes': canonicalForm(obj.__dict__, memo),
+        }
+    else:
+        r = repr(obj)
+        if memo.strict and _addressRe.search(r):
+            raise UnstableForm(obj)
+        form = _addressRe.sub('', r).decode('utf-8', 'replace')
+    memo.active.discard(id(obj))
+    if memo.cycles == cycles:
+        memo.forms[id(obj)] = (obj, form)
+    return form
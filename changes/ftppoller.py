@@ -6,7 +6,7 @@ from twisted.internet.task import LoopingCall
 from twisted.web.client import getPage
 
 from buildbot.changes import base, changes
-from buildbotcustom.l10n import ParseLocalesFile
+from buildbotcustom.l10n import localesCache
 
 
 class FtpPollerBase(base.ChangeSource):
@@ -165,16 +165,18 @@ class LocalesFtpPoller(FtpPollerBase):
             log.msg("Not polling LocalesFtpPoller because last poll is still working (%s)" % (str(self.working)))
         else:
             self.working = self.working + 1
-            d = self._get_page(self.localesFile)
+            # The locales file is shared with the l10n schedulers, and only
+            # refetched every few minutes
+            d = localesCache.getLocales(self.localesFile,
+                                        timeout=self.timeout)
             d.addCallback(self._get_locales)
             for url in self.ftpURLs:
                 d.addCallback(self._get_ftp, url)
                 d.addCallback(self._process_changes, url)
             d.addBoth(self._finished)
 
-    def _get_locales(self, pageContents):
-        """parse the locales file and filter by platform"""
-        parsedLocales = ParseLocalesFile(pageContents)
+    def _get_locales(self, parsedLocales):
+        """filter the parsed locales file by platform"""
         return [re.compile(re.escape("%s/" % l)) for l in parsedLocales if len(parsedLocales[l]) == 0 or self.sl_platform_map[self.platform] in parsedLocales[l]]
 
     def searchAllStrings(self, pageContents, locales):
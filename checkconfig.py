@@ -0,0 +1,235 @@
+# Checking the objects that a master's config generates, in parallel
+"""
+A production master.cfg calls generateBranchObjects and friends for dozens
+of branches, projects and releases, and `buildbot checkconfig` runs them all
+one after another in one process.  Since each of those calls only depends
+on its own config, they can be run in separate processes instead, with each
+one sending back a small summary of what it made (builder names, builddirs,
+slaves, scheduler names and the builders they use, and locks).  The checks
+that buildbot makes across the whole config, like builder names and
+builddirs being unique, are then done on the summaries.
+
+The calls to check are given as jobs, which are tuples of (name, function,
+args, kwargs).  The worker processes are forked after the jobs are made, so
+they don't need to be picklable; only the summaries are sent back.
+
+A jobs file is a python file that sets JOBS to a list of jobs, and
+optionally SLAVES to the names of all the slaves that builders can use.  It
+is run from its own directory, like master.cfg, e.g.:
+
+    from buildbotcustom.misc import generateBranchObjects
+    import config
+    JOBS = [(name, generateBranchObjects, (config.BRANCHES[name], name), {})
+            for name in config.ACTIVE_BRANCHES]
+    SLAVES = config.ALL_SLAVES
+"""
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+
+from buildbot import locks
+from buildbot.util import safeTranslate
+
+# The jobs that the worker processes run, by index, and the function that
+# summarizes their objects.  Set before they are forked.
+_jobs = []
+_summarize = None
+
+
+def loadJobsFile(path):
+    """Runs the jobs file at path, and returns its JOBS and SLAVES (or None
+    if it doesn't set SLAVES)"""
+    path = os.path.abspath(path)
+    os.chdir(os.path.dirname(path))
+    sys.path.insert(0, os.path.dirname(path))
+    namespace = {'__file__': path}
+    execfile(path, namespace)
+    return namespace['JOBS'], namespace.get('SLAVES')
+
+
+def describeLock(lock):
+    """Returns the name of a lock (or lock access), and a description of it
+    that is the same in every process"""
+    if isinstance(lock, locks.LockAccess):
+        lock = lock.lockid
+    return lock.name, '%s(%s, %s, %s)' % (
+        lock.__class__.__name__, lock.name, lock.maxCount,
+        getattr(lock, 'maxCountForSlave', None))
+
+
+def summarizeObjects(objects):
+    """Returns a summary of a dict of build objects that can be sent to
+    another process, along with a list of errors with them.  These are the
+    checks that buildbot's master does on builders and schedulers that can
+    be done within one set of objects."""
+    errors = []
+    builders = []
+    lockObjects = {}
+    for b in objects.get('builders', []):
+        if type(b) is not dict:
+            errors.append("builder %r is not a dict" % (b,))
+            continue
+        name = b.get('name')
+        if not name or 'factory' not in b:
+            errors.append("builder %r needs a name and a factory" % name)
+            continue
+        if name.startswith('_'):
+            errors.append("builder names must not start with an "
+                          "underscore: %s" % name)
+        slavenames = list(b.get('slavenames', []))
+        if 'slavename' in b:
+            slavenames.append(b['slavename'])
+        if not slavenames:
+            errors.append("builder %s has no slaves" % name)
+        builddir = b.get('builddir', safeTranslate(name))
+
+        builderLocks = list(b.get('locks', []))
+        for s in b['factory'].steps:
+            builderLocks.extend(s[1].get('locks', []))
+        for l in builderLocks:
+            lockName, desc = describeLock(l)
+            lock = getattr(l, 'lockid', l)
+            other = lockObjects.setdefault(lockName, lock)
+            if other is not lock:
+                errors.append("Two different locks (%s and %s) share the "
+                              "name %s" % (lock, other, lockName))
+
+        builders.append({
+            'name': name,
+            'builddir': builddir,
+            'slavebuilddir': b.get('slavebuilddir', builddir),
+            'slavenames': slavenames,
+            'category': b.get('category'),
+        })
+
+    schedulers = []
+    for s in objects.get('schedulers', []):
+        schedulers.append({
+            'name': s.name,
+            'builderNames': list(s.listBuilderNames()),
+        })
+
+    summary = {
+        'builders': builders,
+        'schedulers': schedulers,
+        'locks': dict(describeLock(l) for l in lockObjects.values()),
+        'change_source': len(objects.get('change_source', [])),
+        'status': len(objects.get('status', [])),
+    }
+    return summary, errors
+
+
+def runJob(job, summarize=summarizeObjects):
+    """Runs job, and returns the summary of the objects it made, as made by
+    summarize.  Its 'errors' are the problems with them, or the exception it
+    raised."""
+    name, func, args, kwargs = job
+    start = time.time()
+    try:
+        objects = func(*args, **kwargs)
+        summary, errors = summarize(objects)
+    except Exception:
+        summary = summarize({})[0]
+        errors = ["%s failed:\n%s" % (name, traceback.format_exc())]
+    summary['name'] = name
+    summary['errors'] = errors
+    summary['time'] = time.time() - start
+    return summary
+
+
+def _runJobNumber(i):
+    return runJob(_jobs[i], _summarize)
+
+
+def runJobs(jobs, processes=None, summarize=summarizeObjects):
+    """Runs jobs in a pool of processes (as many as there are CPUs by
+    default), and returns their summaries, in the same order.  With
+    processes=1, they are all run in this process instead.  summarize is
+    called with each job's objects, and returns (summary, errors); see
+    summarizeObjects."""
+    if processes == 1:
+        return [runJob(job, summarize) for job in jobs]
+
+    global _jobs, _summarize
+    _jobs = jobs
+    _summarize = summarize
+    pool = multiprocessing.Pool(processes)
+    try:
+        # One at a time, so that jobs are spread out as workers free up
+        return pool.map(_runJobNumber, range(len(jobs)), chunksize=1)
+    finally:
+        pool.terminate()
+        _jobs = []
+        _summarize = None
+
+
+def checkSummaries(summaries, slavenames=None):
+    """Returns (errors, warnings) for the jobs' summaries, taken together.
+    These are the checks that buildbot's master does across the whole
+    config: builder names, builddirs and scheduler names must be unique,
+    schedulers can only use builders that exist, and locks with the same
+    name must be the same lock.  If slavenames is given, builders must only
+    use those slaves."""
+    errors = []
+    warnings = []
+    for s in summaries:
+        errors.extend("%s: %s" % (s['name'], e) for e in s['errors'])
+
+    builders = {}
+    builddirs = {}
+    schedulers = {}
+    lockDescs = {}
+    slaves = None
+    if slavenames is not None:
+        slaves = set(slavenames)
+    for s in summaries:
+        for b in s['builders']:
+            if b['name'] in builders:
+                errors.append("duplicate builder name %s (in %s and %s)" % (
+                    b['name'], builders[b['name']], s['name']))
+            else:
+                builders[b['name']] = s['name']
+            if b['builddir'] in builddirs:
+                errors.append("builder %s (in %s) reuses builddir %s "
+                              "(from %s)" % (b['name'], s['name'],
+                                             b['builddir'],
+                                             builddirs[b['builddir']]))
+            else:
+                builddirs[b['builddir']] = s['name']
+            if slaves is not None:
+                for n in b['slavenames']:
+                    if n not in slaves:
+                        errors.append("builder %s (in %s) uses undefined "
+                                      "slave %s" % (b['name'], s['name'], n))
+
+        for name, desc in s['locks'].items():
+            other = lockDescs.setdefault(name, (desc, s['name']))
+            if other[0] != desc:
+                errors.append("Two different locks (%s in %s and %s in %s) "
+                              "share the name %s" % (desc, s['name'],
+                                                     other[0], other[1],
+                                                     name))
+
+    unscheduled = set(builders)
+    for s in summaries:
+        for sched in s['schedulers']:
+            if sched['name'] in schedulers:
+                errors.append("Schedulers must have unique names, but '%s' "
+                              "(in %s and %s) was a duplicate" % (
+                                  sched['name'], schedulers[sched['name']],
+                                  s['name']))
+            else:
+                schedulers[sched['name']] = s['name']
+            for b in sched['builderNames']:
+                if b not in builders:
+                    errors.append("scheduler %s (in %s) uses unknown "
+                                  "builder %s" % (sched['name'], s['name'],
+                                                  b))
+                unscheduled.discard(b)
+
+    if unscheduled:
+        warnings.append("some Builders have no Schedulers to drive them: %s"
+                        % ', '.join(sorted(unscheduled)))
+    return errors, warnings
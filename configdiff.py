@@ -0,0 +1,210 @@
+# Comparing the builders that two versions of a master's config make
+"""
+A change to a branch's config, or to the factories, can change any of the
+thousands of builders that generateBranchObjects and friends make, and it's
+hard to tell which from the change itself.  This module turns each builder
+into a canonical form: plain lists, dicts and strings describing its
+factory's steps and their arguments, its properties, slaves, nextSlave,
+category and everything else in the builder's dict.  Forms of the same
+builder from different processes (or different days) are equal if nothing
+about the builder changed, so the builders that two versions of the config
+make can be compared by their forms.
+
+Each form is stored along with a hash of it.  Forms are saved to a file, so
+the baseline version only has to be generated once; later versions are
+compared against it by hash, and only the builders that changed are compared
+in detail.
+
+The builders are made by running jobs, as in checkconfig.py.
+"""
+import hashlib
+
+from buildbot.process.factory import BuildFactory
+from buildbot.util import json
+
+from buildbotcustom.canonical import canonicalForm, FormMemo
+from buildbotcustom.checkconfig import runJobs
+
+
+def _stepForm(step, memo):
+    if id(step) not in memo.steps:
+        memo.steps[id(step)] = (step, {
+            'class': canonicalForm(step[0], memo),
+            'args': canonicalForm(step[1], memo),
+        })
+    return memo.steps[id(step)][1]
+
+
+def builderForm(builder, memo=None):
+    """Returns the canonical form of a builder dict.  Its factory is
+    described by its class and its steps, each of which is described by its
+    class and arguments.  Pass the same FormMemo for all of a config's
+    builders, so that the steps and arguments that factories share (see
+    process.factory.shareStepFactories) are only described once, and share
+    their forms."""
+    if memo is None:
+        memo = FormMemo()
+    form = {}
+    for k, v in builder.items():
+        if k == 'factory':
+            continue
+        form[k] = canonicalForm(v, memo)
+    factory = builder.get('factory')
+    if isinstance(factory, BuildFactory):
+        form['factory'] = {
+            'class': canonicalForm(factory.__class__),
+            'steps': [_stepForm(step, memo) for step in factory.steps],
+        }
+    else:
+        form['factory'] = canonicalForm(factory, memo)
+    return form
+
+
+def formHash(form, memo=None):
+    """Returns a hash of a canonical form.  Each list and dict in it is
+    hashed separately, and memo maps their ids to their hashes, so that
+    forms that share parts (like the forms of builders that share steps) can
+    be hashed without hashing those parts again."""
+    if memo is None:
+        memo = {}
+    return _formHash(form, memo)[1:]
+
+
+def _formHash(form, memo):
+    # Hashes start with '#', so they can't be mistaken for scalars
+    if not isinstance(form, (dict, list)):
+        return json.dumps(form)
+    if id(form) in memo:
+        return memo[id(form)][1]
+    if isinstance(form, dict):
+        parts = ['dict %i' % len(form)]
+        for k in sorted(form):
+            parts.append(json.dumps(k))
+            parts.append(_formHash(form[k], memo))
+    else:
+        parts = ['list %i' % len(form)]
+        parts.extend(_formHash(v, memo) for v in form)
+    h = '#' + hashlib.sha1('\n'.join(parts)).hexdigest()
+    memo[id(form)] = (form, h)
+    return h
+
+
+def summarizeBuilders(objects):
+    """Summarizes a dict of build objects by the hashes and forms of its
+    builders, for runJobs"""
+    builders = []
+    forms = FormMemo()
+    hashes = {}
+    for b in objects.get('builders', []):
+        form = builderForm(b, forms)
+        builders.append({
+            'name': b['name'],
+            'hash': formHash(form, hashes),
+            'form': form,
+        })
+    return {'builders': builders}, []
+
+
+def generateForms(jobs, processes=None):
+    """Runs jobs (see checkconfig.py), and returns (forms, errors).  forms
+    is a dict mapping each builder's name to {'hash': ..., 'form': ...}, and
+    errors lists the jobs that failed, and builders that more than one job
+    made."""
+    forms = {}
+    errors = []
+    owners = {}
+    for s in runJobs(jobs, processes, summarize=summarizeBuilders):
+        errors.extend("%s: %s" % (s['name'], e) for e in s['errors'])
+        for b in s['builders']:
+            if b['name'] in owners:
+                errors.append("duplicate builder name %s (in %s and %s)" % (
+                    b['name'], owners[b['name']], s['name']))
+                continue
+            owners[b['name']] = s['name']
+            forms[b['name']] = {'hash': b['hash'], 'form': b['form']}
+    return forms, errors
+
+
+def saveForms(forms, path):
+    """Saves builder forms to path.  Each distinct step is only saved once,
+    and builders refer to their steps by hash."""
+    steps = {}
+    memo = {}
+    builders = {}
+    for name, f in forms.items():
+        form = f['form']
+        if isinstance(form['factory'], dict) and 'steps' in form['factory']:
+            hashes = []
+            for step in form['factory']['steps']:
+                h = formHash(step, memo)
+                steps[h] = step
+                hashes.append(h)
+            form = dict(form)
+            form['factory'] = dict(form['factory'], steps=hashes)
+        builders[name] = {'hash': f['hash'], 'form': form}
+    f = open(path, 'w')
+    try:
+        json.dump({'steps': steps, 'builders': builders}, f, sort_keys=True)
+    finally:
+        f.close()
+
+
+def loadForms(path):
+    """Returns the builder forms saved to path by saveForms"""
+    f = open(path)
+    try:
+        saved = json.load(f)
+    finally:
+        f.close()
+    steps = saved['steps']
+    forms = {}
+    for name, f in saved['builders'].items():
+        form = f['form']
+        if isinstance(form['factory'], dict) and 'steps' in form['factory']:
+            form['factory']['steps'] = [steps[h] for h in
+                                        form['factory']['steps']]
+        forms[name] = {'hash': f['hash'], 'form': form}
+    return forms
+
+
+def formDifferences(old, new, path=''):
+    """Returns a list of the places where two canonical forms differ, like
+    "factory.steps[3].args.command" """
+    if isinstance(old, dict) and isinstance(new, dict):
+        diffs = []
+        for k in sorted(set(old) | set(new)):
+            p = k
+            if path:
+                p = '%s.%s' % (path, k)
+            if k not in old:
+                diffs.append('%s added' % p)
+            elif k not in new:
+                diffs.append('%s removed' % p)
+            else:
+                diffs.extend(formDifferences(old[k], new[k], p))
+        return diffs
+    if isinstance(old, list) and isinstance(new, list):
+        diffs = []
+        for i, (o, n) in enumerate(zip(old, new)):
+            diffs.extend(formDifferences(o, n, '%s[%i]' % (path, i)))
+        if len(old) != len(new):
+            diffs.append('%s length %i -> %i' % (path, len(old), len(new)))
+        return diffs
+    if old != new:
+        return [path]
+    return []
+
+
+def diffForms(old, new):
+    """Compares two dicts of builder forms, as returned by generateForms or
+    loadForms.  Returns (added, removed, changed): the sorted names of the
+    builders only in new, and only in old, and a sorted list of (name,
+    differences) for the builders whose forms differ."""
+    added = sorted(n for n in new if n not in old)
+    removed = sorted(n for n in old if n not in new)
+    changed = []
+    for name in sorted(n for n in new if n in old):
+        if old[name]['hash'] != new[name]['hash']:
+            changed.append((name, formDifferences(old[name]['form'],
+                                                  new[name]['form'])))
+    return added, removed, changed
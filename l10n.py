@@ -37,7 +37,10 @@
 #
 # ***** END LICENSE BLOCK *****
 
-from twisted.python import log
+import re
+import time
+
+from twisted.python import log, failure
 from twisted.internet import defer
 from twisted.web.client import getPage
 from buildbot.scheduler import Dependent, Triggerable, Nightly
@@ -45,6 +48,8 @@ from buildbot.sourcestamp import SourceStamp
 from buildbot.process import properties
 from buildbot.status.builder import SUCCESS, WARNINGS
 
+from buildbotcustom.buildsets import BulkBuildsetMixin
+
 
 def ParseLocalesFile(data):
     """
@@ -70,7 +75,79 @@ def ParseLocalesFile(data):
     return locales
 
 
-class L10nMixin(object):
+def copyLocales(locales):
+    return dict((locale, list(platforms))
+                for locale, platforms in locales.items())
+
+
+class LocalesCache:
+    """Caches parsed locales files by URL, so that the schedulers for all the
+    platforms of a nightly only fetch the file once.
+
+    Files at an explicit changeset never change, so they're kept until
+    there are more than maxEntries files.  Anything else (branch heads, tags)
+    is refetched after `ttl` seconds.  Lookups for a file that is already
+    being fetched wait for that fetch to finish."""
+
+    def __init__(self, ttl=300, maxEntries=100):
+        self.ttl = ttl
+        self.maxEntries = maxEntries
+        # url -> (time fetched, or None if it never expires, locales)
+        self.locales = {}
+        # url -> [Deferred] of the lookups waiting for it
+        self.fetching = {}
+        self.fetches = 0
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        for url, (fetched, locales) in self.locales.items():
+            if fetched is not None and fetched < cutoff:
+                del self.locales[url]
+        if len(self.locales) > self.maxEntries:
+            self.locales.clear()
+
+    def getLocales(self, url, immutable=False, timeout=5 * 60):
+        """Returns a Deferred that fires with the locales in the locales
+        file at url, as returned by ParseLocalesFile.  immutable says whether
+        the file at url can ever change."""
+        self.expire()
+        if url in self.locales:
+            return defer.succeed(copyLocales(self.locales[url][1]))
+
+        d = defer.Deferred()
+        if url in self.fetching:
+            log.msg("LocalesCache:: Waiting for %s" % url)
+            self.fetching[url].append(d)
+        else:
+            self.fetching[url] = [d]
+            self._fetch(url, immutable, timeout)
+        return d
+
+    def _fetch(self, url, immutable, timeout):
+        self.fetches += 1
+        d = getPage(url, timeout=timeout)
+        d.addCallback(self._gotData, url, immutable)
+        d.addBoth(self._fetched, url)
+
+    def _gotData(self, data, url, immutable):
+        locales = ParseLocalesFile(data)
+        if immutable:
+            self.locales[url] = (None, locales)
+        else:
+            self.locales[url] = (time.time(), locales)
+        return locales
+
+    def _fetched(self, res, url):
+        for d in self.fetching.pop(url):
+            if isinstance(res, failure.Failure):
+                d.errback(res)
+            else:
+                d.callback(copyLocales(res))
+
+localesCache = LocalesCache()
+
+
+class L10nMixin(BulkBuildsetMixin, object):
     """
     This class helps any of the L10n custom made schedulers
     to submit BuildSets as specified per list of locales, or either a
@@ -79,6 +156,8 @@ class L10nMixin(object):
     For each locale, there will be a build property 'locale' set to the
     inidividual locale to be built for that BuildSet.
     """
+    # Shared by all the l10n schedulers
+    localesCache = localesCache
 
     def __init__(self, platform, repo='http://hg.mozilla.org/', branch=None,
                  baseTag='default', localesFile="browser/locales/all-locales",
@@ -122,6 +201,7 @@ class L10nMixin(object):
         """
         log.msg("L10nMixin:: loaded locales' list")
         db = self.parent.db
+        locale_props = []
         for locale in locales:
             # Ignore en-US. It appears in locales files but we do not repack
             # it.
@@ -141,11 +221,16 @@ class L10nMixin(object):
             props.setProperty("en_revision", self.baseTag, "L10nMixin")
             props.setProperty("l10n_revision", self.baseTag, "L10nMixin")
             log.msg('Submitted ' + locale + ' locale')
-            # let's submit the BuildSet for this locale
-            # Create a sourcestamp
-            ss = SourceStamp(branch=self.branch)
-            ssid = db.get_sourcestampid(ss, t)
-            self.create_buildset(ssid, reason, t, props=props)
+            locale_props.append(props)
+
+        if not locale_props:
+            return
+        # let's submit the BuildSets for all the locales, which share a
+        # sourcestamp
+        ss = SourceStamp(branch=self.branch)
+        ssid = db.get_sourcestampid(ss, t)
+        self.create_buildsets(
+            [(ssid, reason, props, None) for props in locale_props], t)
 
     def getLocales(self, revision=None):
         """
@@ -162,13 +247,14 @@ class L10nMixin(object):
             localePage = self.localesURL % {'revision':
                                             revision or self.baseTag}
             log.msg("L10nMixin:: Getting locales from: " + localePage)
-            # we expect that getPage will return the output of "all-locales"
+            # we expect the page to be the output of "all-locales"
             # or "shipped-locales" or any file that contains a locale per line
             # in the begining of the line e.g. "en-GB" or "ja linux win32"
-            # getPage returns a defered that will return a string
-            d = getPage(localePage, timeout=5 * 60)
-            d.addCallback(lambda data: ParseLocalesFile(data))
-            return d
+            # Files at a changeset can be cached for good
+            immutable = bool(revision and
+                             re.match(r'^[0-9a-f]{12,40}$', revision))
+            return self.localesCache.getLocales(localePage, immutable,
+                                                timeout=5 * 60)
 
     def createL10nBuilds(self, revision=None, reason=None, set_props=None):
         """
@@ -5,6 +5,7 @@ try:
 except:
     import simplejson as json
 import collections
+import hashlib
 import random
 import re
 import sys
@@ -20,6 +21,8 @@ from buildbot.steps.shell import WithProperties
 from buildbot.status.builder import WARNINGS, FAILURE, EXCEPTION, RETRY
 from buildbot.process.buildstep import regex_log_evaluator
 
+from buildbotcustom.reloader import reloadIfChanged
+import buildbotcustom.canonical
 import buildbotcustom.common
 import buildbotcustom.changes.hgpoller
 import buildbotcustom.process.factory
@@ -33,25 +36,28 @@ import buildbotcustom.status.log_handlers
 import buildbotcustom.misc_scheduler
 import build.paths
 import mozilla_buildtools.queuedir
-reload(buildbotcustom.common)
-reload(buildbotcustom.changes.hgpoller)
-reload(buildbotcustom.process.factory)
-reload(buildbotcustom.log)
-reload(buildbotcustom.l10n)
-reload(buildbotcustom.scheduler)
-reload(buildbotcustom.status.mail)
-reload(buildbotcustom.status.generators)
-reload(buildbotcustom.status.log_handlers)
-reload(buildbotcustom.misc_scheduler)
-reload(build.paths)
-reload(mozilla_buildtools.queuedir)
-
+reloadIfChanged(buildbotcustom.canonical)
+reloadIfChanged(buildbotcustom.common)
+reloadIfChanged(buildbotcustom.changes.hgpoller)
+reloadIfChanged(buildbotcustom.process.factory)
+reloadIfChanged(buildbotcustom.log)
+reloadIfChanged(buildbotcustom.l10n)
+reloadIfChanged(buildbotcustom.scheduler)
+reloadIfChanged(buildbotcustom.status.mail)
+reloadIfChanged(buildbotcustom.status.generators)
+reloadIfChanged(buildbotcustom.status.log_handlers)
+reloadIfChanged(buildbotcustom.misc_scheduler)
+reloadIfChanged(build.paths)
+reloadIfChanged(mozilla_buildtools.queuedir)
+
+from buildbotcustom.canonical import canonicalForm, FormMemo, UnstableForm
 from buildbotcustom.common import normalizeName
 from buildbotcustom.changes.hgpoller import HgPoller, HgAllLocalesPoller
 from buildbotcustom.process.factory import NightlyBuildFactory, \
     NightlyRepackFactory, UnittestPackagedBuildFactory, TalosFactory, \
     TryBuildFactory, ScriptFactory, SigningScriptFactory, rc_eval_func
-from buildbotcustom.process.factory import RemoteUnittestFactory
+from buildbotcustom.process.factory import RemoteUnittestFactory, \
+    shareStepFactories, clearSharedSteps
 from buildbotcustom.scheduler import MultiScheduler, BuilderChooserScheduler, \
     PersistentScheduler, makePropertiesScheduler, SpecificNightly
 from buildbotcustom.l10n import TriggerableL10n
@@ -61,6 +67,10 @@ from buildbotcustom.env import MozillaEnvironments
 from buildbotcustom.misc_scheduler import tryChooser, buildIDSchedFunc, \
     buildUIDSchedFunc, lastGoodFunc, lastRevFunc
 
+# process.factory is only reloaded if it has changed, so start sharing steps
+# afresh for this reconfig
+clearSharedSteps()
+
 # This file contains misc. helper function that don't make sense to put in
 # other files. For example, functions that are called in a master.cfg
 
@@ -370,14 +380,41 @@ def _nextOldTegra(builder, available_slaves):
 nomergeBuilders = []
 
 
-def mergeRequests(builder, req1, req2):
-    if builder.name in nomergeBuilders:
-        return False
-    if 'Self-serve' in req1.reason or 'Self-serve' in req2.reason:
+def getMergeKey(req):
+    """Returns a key for req such that two requests can be merged if and only
+    if their keys are equal, or None if req can't be merged with anything.
+    This is what SourceStamp.canBeMergedWith checks, plus our own rules.
+
+    buildbot calls mergeRequests to compare the request it is about to start
+    with each of the other pending requests, again every time it starts a
+    build, so the key is only worked out once for each request."""
+    # Look in __dict__ so that class attributes (or mocks) don't count
+    if '_mergeKey' in req.__dict__:
+        return req._mergeKey
+
+    ss = req.source
+    if 'Self-serve' in req.reason:
         # A build was explicitly requested on this revision, so don't coalesce
         # it
+        key = None
+    elif ss.changes:
+        # Builds of changes are merged whatever their revision
+        key = (ss.repository, ss.branch, ss.project, True, None)
+    elif ss.patch:
+        # you can't merge patched builds with anything
+        key = None
+    else:
+        # Otherwise both have to be building the same revision
+        key = (ss.repository, ss.branch, ss.project, False, ss.revision)
+    req._mergeKey = key
+    return key
+
+
+def mergeRequests(builder, req1, req2):
+    if builder.name in nomergeBuilders:
         return False
-    return req1.canBeMergedWith(req2)
+    key = getMergeKey(req1)
+    return key is not None and key == getMergeKey(req2)
 
 
 def mergeBuildObjects(d1, d2):
@@ -389,6 +426,139 @@ def mergeBuildObjects(d1, d2):
 
     return retval
 
+# Objects made by the functions decorated with reusesObjects, by (function
+# name, branch or project name), and the keys of the ones that have been
+# generated or reused since the last reconfig.  master.cfg reloads this
+# module on every reconfig, so make sure that doesn't throw them away.
+try:
+    _generatedObjects
+except NameError:
+    _generatedObjects = {}
+    _usedKeys = set()
+
+# The version of the code that generated the objects, worked out once after
+# each reload (which is once per reconfig)
+_codeVersion = None
+
+
+def codeVersion():
+    """Returns a hash of the paths, sizes and modification times of the
+    source files of buildbotcustom and the tools modules that this module
+    reloads.  Objects made by an older version of the code aren't reused."""
+    global _codeVersion
+    if _codeVersion is not None:
+        return _codeVersion
+    files = []
+    topdir = os.path.dirname(os.path.abspath(__file__))
+    for dirpath, dirnames, filenames in os.walk(topdir):
+        files.extend(os.path.join(dirpath, f) for f in filenames
+                     if f.endswith('.py'))
+    for m in (build.paths, mozilla_buildtools.queuedir):
+        files.append(os.path.abspath(m.__file__).replace('.pyc', '.py'))
+    h = hashlib.sha1()
+    for f in sorted(files):
+        try:
+            st = os.stat(f)
+            h.update('%s %i %i\n' % (f, st.st_size, st.st_mtime))
+        except OSError:
+            h.update('%s missing\n' % f)
+    _codeVersion = h.hexdigest()
+    return _codeVersion
+
+
+def configFingerprint(*args):
+    """Returns a hash of args, which are the arguments to one of the
+    generate*Objects functions, that is the same for equal configs in
+    different reconfigs.  Returns None if one of them has no such hash (for
+    example, an object whose repr includes its address)."""
+    try:
+        form = canonicalForm(args, FormMemo(strict=True))
+    except UnstableForm:
+        return None
+    return hashlib.sha1(json.dumps(form, sort_keys=True)).hexdigest()
+
+
+def reusesObjects(nameArg):
+    """Decorates a function that returns a dict of build objects (builders,
+    schedulers, change sources and status objects) for a branch or project,
+    whose name is its argument number nameArg.  If it is called with the same
+    arguments, and the same code, as it was called with last time for that
+    name in this reconfig or the previous one, it returns the same objects
+    instead of making new ones.  buildbot then sees that those are unchanged
+    without comparing them attribute by attribute, and leaves them alone.
+
+    The names that the function adds to nomergeBuilders are remembered and
+    added again when its objects are reused.  The factories of the builders
+    it makes share their steps with all the others (see shareSteps)."""
+    def decorator(func):
+        argNames = func.func_code.co_varnames[:func.func_code.co_argcount]
+
+        def wrapper(*args, **kwargs):
+            callArgs = dict(zip(argNames, args))
+            callArgs.update(kwargs)
+            name = callArgs[argNames[nameArg]]
+            key = (func.__name__, name)
+            fingerprint = configFingerprint(codeVersion(), callArgs)
+
+            _usedKeys.add(key)
+            cached = _generatedObjects.get(key)
+            if fingerprint is not None and cached and \
+                    cached[0] == fingerprint:
+                log.msg("%s: reusing objects for %s" % (func.__name__, name))
+                objects, nomerge = cached[1:]
+                nomergeBuilders.extend(nomerge)
+                # Callers are free to add to the lists they get back
+                return copyBuildObjects(objects)
+
+            before = len(nomergeBuilders)
+            objects = func(*args, **kwargs)
+            shareSteps(objects.get('builders', []))
+            if fingerprint is None:
+                _generatedObjects.pop(key, None)
+            else:
+                _generatedObjects[key] = (fingerprint,
+                                          copyBuildObjects(objects),
+                                          nomergeBuilders[before:])
+            return objects
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        wrapper.uncached = func
+        return wrapper
+    return decorator
+
+
+def shareSteps(builders):
+    """Makes the factories of builders share their steps, and the arguments
+    to them, with the other factories made in this reconfig that have equal
+    ones.  Many builders (for each platform, suite, and so on) have mostly
+    the same steps, which otherwise take up a lot of the master's memory."""
+    shareStepFactories([b['factory'] for b in builders])
+
+
+def copyBuildObjects(objects):
+    """Returns a copy of a dict of build objects, with copies of its lists"""
+    return dict((k, list(v)) for k, v in objects.items())
+
+
+def clearReusedObjects():
+    """Forgets the objects that reusesObjects has kept, so that everything is
+    made from scratch in the next reconfig"""
+    _generatedObjects.clear()
+    _usedKeys.clear()
+
+
+def forgetUnusedObjects():
+    """Forgets the objects that reusesObjects has kept for branches and
+    projects that haven't been generated since the last call.  buildbot has
+    stopped those, so they mustn't be handed back if the branch returns, and
+    there's no point keeping them in memory.  This is called whenever this
+    module is loaded, which is once per reconfig."""
+    for key in set(_generatedObjects) - _usedKeys:
+        del _generatedObjects[key]
+    _usedKeys.clear()
+
+forgetUnusedObjects()
+
 
 def makeMHFactory(config, pf, **kwargs):
     factory_class = ScriptFactory
@@ -644,6 +814,7 @@ def generateMozharnessTalosBuilder(platform, mozharness_repo, script_path,
     )
 
 
+@reusesObjects(1)
 def generateBranchObjects(config, name, secrets=None):
     """name is the name of branch which is usually the last part of the path
        to the repository. For example, 'mozilla-central', 'mozilla-aurora', or
@@ -1761,6 +1932,7 @@ def generateBranchObjects(config, name, secrets=None):
     return branchObjects
 
 
+@reusesObjects(0)
 def generateTalosBranchObjects(branch, branch_config, PLATFORMS, SUITES,
                                ACTIVE_UNITTEST_PLATFORMS, factory_class=TalosFactory):
     branchObjects = {'schedulers': [], 'builders': [], 'status': [],
@@ -2668,6 +2840,7 @@ def generateDXRObjects(config, SLAVES):
     }
 
 
+@reusesObjects(0)
 def generateProjectObjects(project, config, SLAVES):
     builders = []
     schedulers = []
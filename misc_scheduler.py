@@ -4,48 +4,163 @@
 #   Lukas Blakk <lsblakk@mozilla.com>
 import re
 import time
-from twisted.python import log
+from twisted.python import log, failure
 from twisted.internet import defer
 from twisted.web.client import getPage
 
 from buildbot.sourcestamp import SourceStamp
+from buildbot.changes.changes import Change
 
+from buildbotcustom.reloader import reloadIfChanged
 import buildbotcustom.try_parser
-reload(buildbotcustom.try_parser)
+reloadIfChanged(buildbotcustom.try_parser)
 
-from buildbotcustom.try_parser import TryParser
+from buildbotcustom.try_parser import TryParserIndex
 from buildbotcustom.common import genBuildID, genBuildUID, incrementBuildID
 
 from buildbot.process.properties import Properties
 from buildbot.util import json
+from buildbot.db.connector import str_or_none
 
 
-def tryChooser(s, all_changes):
+class PushlogCache:
+    """Caches the pushes returned by a pushlog's json-pushes, so that the
+    changesets of a push can be looked up with a single request.
+
+    Pushes are kept for `ttl` seconds, and requests give up after `timeout`
+    seconds.  Lookups of a revision that is already being fetched share that
+    request.  A lookup of another revision that comes in while a request is
+    in progress waits for that one request to finish, since the revision is
+    probably part of the push being fetched; if it isn't, it is fetched
+    straight away, alongside any others that were waiting."""
+
+    def __init__(self, baseURL, ttl=3600, timeout=30):
+        self.baseURL = baseURL.rstrip("/")
+        self.ttl = ttl
+        self.timeout = timeout
+        # revision -> (time fetched, push)
+        self.pushes = {}
+        # revision being fetched -> [(revision, Deferred)] of the lookups
+        # waiting for it
+        self.fetching = {}
+        self.fetches = 0
+
+    def expire(self):
+        cutoff = time.time() - self.ttl
+        for rev, (fetched, push) in self.pushes.items():
+            if fetched < cutoff:
+                del self.pushes[rev]
+
+    def getPush(self, revision):
+        """Returns a Deferred that fires with the push (the json-pushes entry)
+        containing revision, or None if the pushlog doesn't know about it"""
+        return self._getPush(revision, wait=True)
+
+    def _getPush(self, revision, wait):
+        self.expire()
+        if revision in self.pushes:
+            return defer.succeed(self.pushes[revision][1])
+
+        d = defer.Deferred()
+        if revision in self.fetching:
+            self.fetching[revision].append((revision, d))
+        elif self.fetching and wait:
+            self.fetching.values()[0].append((revision, d))
+        else:
+            self.fetching[revision] = [(revision, d)]
+            self._fetch(revision)
+        return d
+
+    def _fetch(self, revision):
+        url = "%s/json-pushes?full=1&changeset=%s" % (self.baseURL, revision)
+        log.msg("Fetching %s" % url)
+        self.fetches += 1
+        d = getPage(str(url), timeout=self.timeout)
+        d.addCallback(self._gotData, revision)
+        d.addBoth(self._fetched, revision)
+
+    def _gotData(self, data, revision):
+        pushes = json.loads(data)
+        now = time.time()
+        retval = None
+        for pushid, push in pushes.items():
+            for change in push['changesets']:
+                self.pushes[change['node']] = (now, push)
+                if change['node'].startswith(revision):
+                    retval = push
+        if retval is not None:
+            # Remember the revision we were asked about too, in case it was
+            # a short one
+            self.pushes[revision] = (now, retval)
+        return retval
+
+    def _fetched(self, res, revision):
+        for rev, d in self.fetching.pop(revision):
+            if rev == revision:
+                if isinstance(res, failure.Failure):
+                    d.errback(res)
+                else:
+                    d.callback(res)
+            else:
+                # This was waiting in case rev was part of the same push.
+                # If it wasn't, don't make it wait for another one.
+                self._getPush(rev, wait=False).chainDeferred(d)
+
+
+TRY_PUSHLOG_URL = "http://hg.mozilla.org/try"
+
+
+def makeTryChooser(pushlogBaseURL=TRY_PUSHLOG_URL, ttl=3600, timeout=30):
+    """Returns a chooserFunc for BuilderChooserScheduler that picks builders
+    based on the try syntax in the changes' comments, or in the comments of
+    their push on the pushlog at pushlogBaseURL"""
+    cache = PushlogCache(pushlogBaseURL, ttl, timeout)
+
+    def chooser(s, all_changes):
+        return tryChooser(s, all_changes, cache)
+    chooser.pushlogCache = cache
+    return chooser
+
+
+def getTryParserIndex(s):
+    """Returns the TryParserIndex for scheduler s, creating it the first time.
+    Schedulers are recreated when their builders change, so the index lives
+    on the scheduler itself."""
+    # Look in __dict__ so that a class attribute (or a mock) doesn't count
+    index = s.__dict__.get('_tryParserIndex')
+    if index is None:
+        index = TryParserIndex(s.builderNames, s.prettyNames,
+                               s.unittestPrettyNames, s.unittestSuites,
+                               s.talosSuites, s.buildbotBranch)
+        s._tryParserIndex = index
+    return index
+
+
+def tryChooser(s, all_changes, pushlogCache=None):
     log.msg("Looking at changes: %s" % all_changes)
+    if pushlogCache is None:
+        pushlogCache = _defaultPushlogCache
 
     buildersPerChange = {}
 
     dl = []
 
-    def getJSON(data):
-        push = json.loads(data)
+    def getComments(push):
         log.msg("Looking at the push json data for try comments")
-        for p in push:
-            pd = push[p]
-            changes = pd['changesets']
-            for change in reversed(changes):
-                match = re.search("try:", change['desc'])
-                if match:
-                    return change['desc'].encode("utf8", "replace")
+        if not push:
+            return None
+        changes = push['changesets']
+        for change in reversed(changes):
+            match = re.search("try:", change['desc'])
+            if match:
+                return change['desc'].encode("utf8", "replace")
 
     def parseData(comments, c):
         if not comments:
             # still need to parse a comment string to get the default set
             log.msg("No comments, passing empty string which will result in default set")
             comments = ""
-        customBuilders = TryParser(
-            comments, s.builderNames, s.prettyNames, s.unittestPrettyNames,
-            s.unittestSuites, s.talosSuites, s.buildbotBranch)
+        customBuilders = getTryParserIndex(s).parse(comments)
         buildersPerChange[c] = customBuilders
 
     def parseDataError(failure, c):
@@ -64,10 +179,10 @@ def tryChooser(s, all_changes):
             if match:
                 log.msg("Found try message in the change comments, ignoring push comments")
                 d = defer.succeed(c.comments)
-            # otherwise getPage from hg.m.o
+            # otherwise look at the push on hg.m.o
             else:
-                d = getPage(str("http://hg.mozilla.org/try/json-pushes?full=1&changeset=%s" % c.revision))
-                d.addCallback(getJSON)
+                d = pushlogCache.getPush(c.revision)
+                d.addCallback(getComments)
         except:
             log.msg("Error in all_changes loop: sending default try set")
             d = defer.succeed("")
@@ -78,6 +193,8 @@ def tryChooser(s, all_changes):
     d.addCallback(lambda res: buildersPerChange)
     return d
 
+_defaultPushlogCache = PushlogCache(TRY_PUSHLOG_URL)
+
 
 def buildIDSchedFunc(sched, t, ssid):
     """Generates a unique buildid for this change.
@@ -106,6 +223,28 @@ def buildIDSchedFunc(sched, t, ssid):
     return props
 
 
+def buildIDSchedFuncBatch(sched, t, ssids):
+    """Generates a unique buildid for each of ssids, the same as calling
+    buildIDSchedFunc for each of them, but only reading and writing the
+    scheduler's state once."""
+    state = sched.get_state(t)
+    lastid = state.get('last_buildid', '19700101000000')
+    nowid = genBuildID()
+
+    retval = []
+    for ssid in ssids:
+        newid = str(max(int(nowid), int(incrementBuildID(lastid))))
+        props = Properties()
+        props.setProperty('buildid', newid, 'buildIDSchedFunc')
+        retval.append(props)
+        lastid = newid
+
+    state['last_buildid'] = lastid
+    sched.set_state(t, state)
+    return retval
+buildIDSchedFunc.batch = buildIDSchedFuncBatch
+
+
 def buildUIDSchedFunc(sched, t, ssid):
     """Return a Properties instance with 'builduid' set to a randomly generated
     id."""
@@ -113,52 +252,473 @@ def buildUIDSchedFunc(sched, t, ssid):
     props.setProperty('builduid', genBuildUID(), 'buildUIDSchedFunc')
     return props
 
-# A version of changeEventGenerator that can be used within a db connector
-# thread.  Copied from buildbot/db/connector.py.
 
+def cacheablePropFunc(scope, ttl=None):
+    """Decorator for propfuncs whose results can be reused by
+    makePropertiesScheduler's schedulers.
+
+    scope is one of 'transaction' (the same properties for every buildset
+    created in a transaction), 'sourcestamp' (the same properties for every
+    buildset of a sourcestamp) or 'ttl' (the same properties for every
+    buildset).  If ttl is set, results are only reused for that many seconds.
+
+    buildIDSchedFunc and buildUIDSchedFunc must never be cached, since each
+    buildset needs its own ids."""
+    assert scope in ('transaction', 'sourcestamp', 'ttl')
+    assert scope != 'ttl' or ttl is not None
 
+    def decorator(func):
+        func.cacheScope = scope
+        func.cacheTTL = ttl
+        return func
+    return decorator
+
+# How many changes changeEventGeneratorInTransaction loads at once
+CHANGE_PAGE_SIZE = 50
+
+
+def _notContains(dbconn, column, text):
+    """Returns an SQL condition (and its arguments) that is true when column
+    doesn't contain text, case sensitively"""
+    if 'sqlite' in dbconn._spec.dbapiName:
+        return "%s NOT GLOB ?" % column, ["*%s*" % text]
+    else:
+        return "%s NOT LIKE BINARY ?" % column, ["%%%s%%" % text]
+
+
+def _loadChanges(dbconn, t, changeids):
+    """Loads the changes numbered changeids, with a query per table rather
+    than per change.  Returns a list of Change objects in the same order as
+    changeids."""
+    parms = dbconn.parmlist(len(changeids))
+    t.execute(dbconn.quoteq("""SELECT changeid, author, comments, is_dir,
+                branch, revision, revlink, when_timestamp, category,
+                repository, project
+            FROM changes WHERE changeid IN %s""" % parms), tuple(changeids))
+    changes = {}
+    for (changeid, who, comments, isdir, branch, revision, revlink, when,
+         category, repository, project) in t.fetchall():
+        changes[changeid] = Change(
+            who=who, files=[], comments=comments, isdir=isdir, links=[],
+            revision=str_or_none(revision), when=when,
+            branch=str_or_none(branch), category=category, revlink=revlink,
+            repository=repository, project=project)
+        changes[changeid].number = changeid
+
+    t.execute(dbconn.quoteq("SELECT changeid, link FROM change_links "
+                            "WHERE changeid IN %s" % parms), tuple(changeids))
+    for changeid, link in t.fetchall():
+        changes[changeid].links.append(link)
+
+    t.execute(dbconn.quoteq("SELECT changeid, filename FROM change_files "
+                            "WHERE changeid IN %s" % parms), tuple(changeids))
+    for changeid, filename in t.fetchall():
+        changes[changeid].files.append(filename)
+
+    t.execute(dbconn.quoteq("""SELECT changeid, property_name, property_value
+                FROM change_properties WHERE changeid IN %s""" % parms),
+              tuple(changeids))
+    for changeid, key, valuepair in t.fetchall():
+        value, source = json.loads(valuepair)
+        changes[changeid].properties.setProperty(str(key), value, source)
+
+    retval = []
+    for changeid in changeids:
+        if changeid in changes:
+            c = changes[changeid]
+            c.links.sort()
+            c.files.sort()
+            retval.append(c)
+    return retval
+
+
+# A version of changeEventGenerator that can be used within a db connector
+# thread.  Based on the one in buildbot/db/connector.py, but pages through the
+# changes CHANGE_PAGE_SIZE at a time, so callers that only look at the first
+# few changes don't load the whole branch history.
+#
+# If skipDontBuild is set, changes with DONTBUILD in their comments are
+# skipped.  If requireRevlink is set, changes without a revlink (i.e. ones
+# that didn't come from a poller) are skipped.
 def changeEventGeneratorInTransaction(dbconn, t, branches=[],
-                                      categories=[], committers=[], minTime=0):
-    q = "SELECT changeid FROM changes"
+                                      categories=[], committers=[], minTime=0,
+                                      skipDontBuild=False,
+                                      requireRevlink=False):
+    pieces = []
     args = []
-    if branches or categories or committers:
-        q += " WHERE "
-        pieces = []
-        if branches:
-            pieces.append("branch IN %s" % dbconn.parmlist(len(branches)))
-            args.extend(list(branches))
-        if categories:
-            pieces.append("category IN %s" % dbconn.parmlist(len(categories)))
-            args.extend(list(categories))
-        if committers:
-            pieces.append("author IN %s" % dbconn.parmlist(len(committers)))
-            args.extend(list(committers))
-        if minTime:
-            pieces.append("when_timestamp > %d" % minTime)
-        q += " AND ".join(pieces)
-    q += " ORDER BY changeid DESC"
-    t.execute(q, tuple(args))
-    for (changeid,) in t.fetchall():
-        yield dbconn._txn_getChangeNumberedNow(t, changeid)
+    if branches:
+        pieces.append("branch IN %s" % dbconn.parmlist(len(branches)))
+        args.extend(list(branches))
+    if categories:
+        pieces.append("category IN %s" % dbconn.parmlist(len(categories)))
+        args.extend(list(categories))
+    if committers:
+        pieces.append("author IN %s" % dbconn.parmlist(len(committers)))
+        args.extend(list(committers))
+    if minTime:
+        pieces.append("when_timestamp > %d" % minTime)
+    if skipDontBuild:
+        cond, cond_args = _notContains(dbconn, "comments", "DONTBUILD")
+        pieces.append(cond)
+        args.extend(cond_args)
+    if requireRevlink:
+        pieces.append("revlink IS NOT NULL AND revlink != ''")
+
+    last_changeid = None
+    while True:
+        q = "SELECT changeid FROM changes"
+        page_pieces = pieces[:]
+        page_args = args[:]
+        if last_changeid is not None:
+            page_pieces.append("changeid < ?")
+            page_args.append(last_changeid)
+        if page_pieces:
+            q += " WHERE " + " AND ".join(page_pieces)
+        q += " ORDER BY changeid DESC LIMIT %i" % CHANGE_PAGE_SIZE
+        t.execute(dbconn.quoteq(q), tuple(page_args))
+        changeids = [changeid for (changeid,) in t.fetchall()]
+        if not changeids:
+            return
+        for c in _loadChanges(dbconn, t, changeids):
+            yield c
+        if len(changeids) < CHANGE_PAGE_SIZE:
+            return
+        last_changeid = changeids[-1]
 
 
 def lastChange(db, t, branch):
     """Returns the revision for the last changeset on the given branch"""
     #### NOTE: called in a thread!
-    for c in changeEventGeneratorInTransaction(db, t, branches=[branch]):
-        # Ignore DONTBUILD changes
-        if c.comments and "DONTBUILD" in c.comments:
-            continue
-        # Ignore changes which didn't come from the poller
-        if not c.revlink:
-            continue
+    # Ignore DONTBUILD changes, and changes which didn't come from the poller
+    for c in changeEventGeneratorInTransaction(db, t, branches=[branch],
+                                               skipDontBuild=True,
+                                               requireRevlink=True):
         return c
     return None
 
 
+# The green_builds table records, for each (branch, revision, buildername),
+# the latest buildset and completion time of a successful build request.  It
+# is kept up to date incrementally from the buildrequests table by
+# updateGreenBuilds, so that lastGoodRev doesn't need to join and scan a day's
+# worth of build requests every time a nightly fires.
+#
+# The tables (and an index on buildrequests.complete_at, which buildbot's
+# schema doesn't have) are created by upgradeSchedulerTables, outside of any
+# scheduler's transaction.  Until then, lastGoodRev looks through history.
+#
+# Each entry is (name, table the index is on or None for a table, statement)
+GREEN_BUILDS_SCHEMA = [
+    ('green_builds', None, """CREATE TABLE green_builds (
+        `branch` VARCHAR(256) NOT NULL,
+        `revision` VARCHAR(256) NOT NULL,
+        `buildername` VARCHAR(256) NOT NULL,
+        `buildsetid` INTEGER NOT NULL,
+        `complete_at` INTEGER NOT NULL
+    )"""),
+    ('green_builds_key', 'green_builds',
+     "CREATE UNIQUE INDEX green_builds_key ON green_builds "
+     "(`branch`(60), `revision`(40), `buildername`(150))"),
+    ('green_builds_branch_complete_at', 'green_builds',
+     "CREATE INDEX green_builds_branch_complete_at ON "
+     "green_builds (`branch`(100), `complete_at`)"),
+    ('green_builds_complete_at', 'green_builds',
+     "CREATE INDEX green_builds_complete_at ON green_builds (`complete_at`)"),
+    # A single row, with id 1, inserted once the table has been filled in
+    ('green_builds_state', None, """CREATE TABLE green_builds_state (
+        `id` INTEGER NOT NULL PRIMARY KEY,
+        `covered_since` INTEGER NOT NULL,
+        `watermark` INTEGER NOT NULL
+    )"""),
+    ('buildrequests_complete_at', 'buildrequests',
+     "CREATE INDEX buildrequests_complete_at ON buildrequests "
+     "(`complete_at`)"),
+]
+
+# Build requests completed this long before our watermark are looked at again,
+# in case their transactions committed late
+GREEN_BUILDS_OVERLAP = 300
+# Green builds completed this long before the start of a lookup are removed
+# from the table
+GREEN_BUILDS_MAX_AGE = 7 * 24 * 3600
+# upgradeSchedulerTables fills in the green_builds table from this far back,
+# this many seconds' worth of build requests at a time
+GREEN_BUILDS_BACKFILL = GREEN_BUILDS_MAX_AGE
+GREEN_BUILDS_BACKFILL_STEP = 3600
+
+
+def _isSqlite(db):
+    return 'sqlite' in db._spec.dbapiName
+
+
+def _schemaObjectExists(db, t, name, table):
+    """Returns whether the table called name exists, or if table is given,
+    whether the index called name on table exists"""
+    if _isSqlite(db):
+        t.execute(db.quoteq("SELECT name FROM sqlite_master "
+                            "WHERE type=? AND name=?"),
+                  (table and 'index' or 'table', name))
+    elif table:
+        t.execute(db.quoteq("SHOW INDEX FROM %s WHERE Key_name = ?" % table),
+                  (name,))
+    else:
+        t.execute(db.quoteq("SHOW TABLES LIKE ?"), (name,))
+    return bool(t.fetchall())
+
+
+def _tableExists(db, t, name):
+    return _schemaObjectExists(db, t, name, None)
+
+
+def _createSchema(db, schema):
+    """Creates the tables and indexes in schema (see GREEN_BUILDS_SCHEMA) that
+    don't exist yet.  db is a DBConnector; each one is created in its own
+    transaction, since on MySQL they commit the transaction anyway.  Another
+    master creating one at the same time isn't an error."""
+    for name, table, q in schema:
+        if _isSqlite(db):
+            # sqlite doesn't support index prefix lengths
+            q = re.sub(r"(`\w+`)\(\d+\)", r"\1", q)
+        exists = lambda t: _schemaObjectExists(db, t, name, table)
+        if db.runInteractionNow(exists):
+            continue
+        try:
+            db.runInteractionNow(lambda t: t.execute(q))
+            log.msg("created %s" % name)
+        except Exception:
+            if not db.runInteractionNow(exists):
+                raise
+            log.msg("%s was created by someone else" % name)
+
+
+def _insertIgnore(db):
+    if _isSqlite(db):
+        return "INSERT OR IGNORE"
+    return "INSERT IGNORE"
+
+
+def _greatest(db):
+    # sqlite's MAX() with more than one argument is MySQL's GREATEST()
+    if _isSqlite(db):
+        return "MAX"
+    return "GREATEST"
+
+
+def _fetchGreenBuilds(db, t, since, until=None):
+    """Returns a dictionary of (branch, revision, buildername) to (buildsetid,
+    complete_at) for the latest successful build requests completed since
+    `since`, from the buildrequests table"""
+    q = """SELECT branch, revision, buildername, buildsets.id,
+                buildrequests.complete_at
+            FROM sourcestamps, buildsets, buildrequests
+            WHERE
+                buildsets.sourcestampid = sourcestamps.id AND
+                buildrequests.buildsetid = buildsets.id AND
+                buildrequests.complete = 1 AND
+                buildrequests.results IN (0,1) AND
+                sourcestamps.revision IS NOT NULL AND
+                sourcestamps.branch IS NOT NULL AND
+                buildrequests.complete_at >= ?"""
+    args = (since,)
+    if until is not None:
+        q += " AND buildrequests.complete_at < ?"
+        args += (until,)
+    t.execute(db.quoteq(q), args)
+
+    retval = {}
+    for branch, revision, name, bsid, complete_at in t.fetchall():
+        key = (branch, revision, name)
+        if key in retval:
+            old_bsid, old_complete_at = retval[key]
+            bsid = max(bsid, old_bsid)
+            complete_at = max(complete_at, old_complete_at)
+        retval[key] = (bsid, complete_at)
+    return retval
+
+
+def _storeGreenBuilds(db, t, builds):
+    """Merges builds, as returned by _fetchGreenBuilds, into the green_builds
+    table"""
+    insert = """INSERT INTO green_builds
+        (branch, revision, buildername, buildsetid, complete_at)
+        VALUES (?, ?, ?, ?, ?)"""
+    if _isSqlite(db):
+        # The database is locked for the whole transaction, so this can't
+        # race with anyone else
+        insert = insert.replace("INSERT", "INSERT OR IGNORE", 1)
+        update = db.quoteq("""UPDATE green_builds
+            SET buildsetid = MAX(buildsetid, ?),
+                complete_at = MAX(complete_at, ?)
+            WHERE branch = ? AND revision = ? AND buildername = ?""")
+    else:
+        insert += """ ON DUPLICATE KEY UPDATE
+            buildsetid = GREATEST(buildsetid, VALUES(buildsetid)),
+            complete_at = GREATEST(complete_at, VALUES(complete_at))"""
+        update = None
+    insert = db.quoteq(insert)
+    for (branch, revision, name), (bsid, complete_at) in builds.iteritems():
+        t.execute(insert, (branch, revision, name, bsid, complete_at))
+        if update and t.rowcount == 0:
+            t.execute(update, (bsid, complete_at, branch, revision, name))
+
+
+def backfillGreenBuilds(db, since, now=None, step=GREEN_BUILDS_BACKFILL_STEP):
+    """Fills in the green_builds table from the build requests completed
+    since `since`, `step` seconds' worth at a time, each in its own
+    transaction.  db is a DBConnector.  Does nothing if the table has already
+    been filled in."""
+    if now is None:
+        now = int(time.time())
+    since = int(since)
+    def filledIn(t):
+        t.execute("SELECT id FROM green_builds_state")
+        return bool(t.fetchall())
+    if db.runInteractionNow(filledIn):
+        return
+
+    def store(t, start, end):
+        _storeGreenBuilds(db, t, _fetchGreenBuilds(db, t, start, end))
+    for start in range(since, now, step):
+        db.runInteractionNow(store, start, min(start + step, now))
+    # Build requests completed since now are picked up by updateGreenBuilds
+    db.runInteractionNow(lambda t: t.execute(db.quoteq(
+        "%s INTO green_builds_state (id, covered_since, watermark) "
+        "VALUES (1, ?, ?)" % _insertIgnore(db)), (since, now)))
+
+
+def upgradeSchedulerTables(db, now=None):
+    """Creates the tables that lastGoodRev and getLastBuiltRevision keep up
+    to date, and fills them in from history.  db is a DBConnector.
+
+    This is run by bin/upgrade_scheduler_tables.py rather than by the
+    schedulers, since creating tables and indexes commits the current
+    transaction on MySQL, and filling them in can take a while.  Each step is
+    its own transaction, so it is safe to run while masters are using the
+    database, and to run again."""
+    if now is None:
+        now = int(time.time())
+    _createSchema(db, GREEN_BUILDS_SCHEMA)
+    _createSchema(db, LAST_BUILT_SCHEMA)
+    backfillGreenBuilds(db, now - GREEN_BUILDS_BACKFILL, now)
+    backfillLastBuiltRevisions(db, now)
+
+
+def updateGreenBuilds(db, t, since, now=None):
+    """Brings the green_builds table up to date with the buildrequests table.
+    The table will cover build requests completed since `since` at least.
+    Returns False if the table hasn't been set up by upgradeSchedulerTables
+    yet."""
+    #### NOTE: called in a thread!
+    if now is None:
+        now = int(time.time())
+    since = int(since)
+
+    if not _tableExists(db, t, 'green_builds_state'):
+        return False
+    t.execute("SELECT covered_since, watermark FROM green_builds_state "
+              "WHERE id = 1")
+    row = t.fetchone()
+    if row is None:
+        return False
+
+    covered_since, watermark = row
+    if since < covered_since:
+        # Fill in older history
+        _storeGreenBuilds(db, t, _fetchGreenBuilds(db, t, since,
+                                                   covered_since))
+        covered_since = since
+
+    _storeGreenBuilds(db, t, _fetchGreenBuilds(
+        db, t, watermark - GREEN_BUILDS_OVERLAP))
+
+    # Forget about builds that are well before anything we're being asked
+    # about
+    cutoff = since - GREEN_BUILDS_MAX_AGE
+    if covered_since < cutoff:
+        t.execute(db.quoteq("DELETE FROM green_builds WHERE complete_at < ?"),
+                  (cutoff,))
+        covered_since = cutoff
+
+    t.execute(db.quoteq("UPDATE green_builds_state "
+                        "SET covered_since = ?, watermark = %s(watermark, ?) "
+                        "WHERE id = 1" % _greatest(db)),
+              (covered_since, now))
+    return True
+
+
+def checkGreenBuilds(db, t, since, rebuild=False):
+    """Compares the green_builds table with what the buildrequests table says
+    about build requests completed since `since`.  Returns a list of (key,
+    expected, actual) tuples for the entries that differ, where key is
+    (branch, revision, buildername) and expected and actual are (buildsetid,
+    complete_at) or None.  Returns None if the table hasn't been set up.
+
+    If rebuild is set, the entries since `since` are rebuilt from the
+    buildrequests table."""
+    #### NOTE: called in a thread!
+    if not updateGreenBuilds(db, t, since):
+        log.msg("checkGreenBuilds: green_builds hasn't been set up")
+        return None
+
+    expected = _fetchGreenBuilds(db, t, since)
+    t.execute(db.quoteq("""SELECT branch, revision, buildername, buildsetid,
+                complete_at FROM green_builds WHERE complete_at >= ?"""),
+              (since,))
+    actual = {}
+    for branch, revision, name, bsid, complete_at in t.fetchall():
+        actual[(branch, revision, name)] = (bsid, complete_at)
+
+    retval = []
+    for key in sorted(set(expected.keys()) | set(actual.keys())):
+        if expected.get(key) != actual.get(key):
+            retval.append((key, expected.get(key), actual.get(key)))
+
+    if retval:
+        log.msg("checkGreenBuilds: %i entries differ" % len(retval))
+    if rebuild:
+        log.msg("checkGreenBuilds: rebuilding green_builds since %s" % since)
+        t.execute(db.quoteq("DELETE FROM green_builds WHERE complete_at >= ?"),
+                  (since,))
+        _storeGreenBuilds(db, t, expected)
+    return retval
+
+
 def lastGoodRev(db, t, branch, builderNames, starttime, endtime):
     """Returns the revision for the latest green build among builders.  If no
     revision is all green, None is returned."""
+    if not updateGreenBuilds(db, t, starttime):
+        log.msg("lastGoodRev: green_builds hasn't been set up; looking "
+                "through history")
+        return lastGoodRevFromHistory(db, t, branch, builderNames,
+                                      starttime, endtime)
+
+    # A revision is good once every builder has a green build for it.  The
+    # latest good revision is the one that got its last green build in the
+    # latest buildset.
+    q = db.quoteq("""SELECT revision, MIN(buildsetid) FROM green_builds
+            WHERE
+                branch = ? AND
+                buildername IN %s AND
+                complete_at >= ? AND
+                complete_at <= ?
+            GROUP BY revision
+            HAVING COUNT(DISTINCT buildername) = ?
+            ORDER BY MIN(buildsetid) DESC
+            LIMIT 1
+        """ % db.parmlist(len(builderNames)))
+    t.execute(q, (branch,) + tuple(builderNames) +
+              (starttime, endtime, len(set(builderNames))))
+    row = t.fetchone()
+    if row:
+        log.msg("lastGood: ss %s good for everyone!" % ((branch, row[0]),))
+        return row[0]
+    return None
+
+
+def lastGoodRevFromHistory(db, t, branch, builderNames, starttime, endtime):
+    """Returns the revision for the latest green build among builders by
+    looking through the buildrequests table.  If no revision is all green,
+    None is returned."""
 
     # Get a list of branch, revision, buildername tuples from builds on
     # `branch` that completed successfully or with warnings within [starttime,
@@ -224,8 +784,205 @@ def getLatestRev(db, t, branch, r1, r2):
     return t.fetchone()[0]
 
 
+# The last_built_revisions table records, for each builder and branch, the
+# latest change that a buildset for that builder was built from.  It is kept
+# up to date from the buildsets table by updateLastBuiltRevisions, which only
+# looks at buildsets submitted since it last ran (buildbot indexes
+# buildsets.submitted_at).  Like green_builds, it is set up by
+# upgradeSchedulerTables; until then getLastBuiltRevision looks through
+# history.
+LAST_BUILT_SCHEMA = [
+    ('last_built_revisions', None, """CREATE TABLE last_built_revisions (
+        `buildername` VARCHAR(256) NOT NULL,
+        `branch` VARCHAR(256) NOT NULL,
+        `revision` VARCHAR(256) NOT NULL,
+        `when_timestamp` INTEGER NOT NULL
+    )"""),
+    ('last_built_revisions_builder_branch', 'last_built_revisions',
+     "CREATE UNIQUE INDEX last_built_revisions_builder_branch ON "
+     "last_built_revisions (`branch`(100), `buildername`(150))"),
+    # A single row, with id 1, inserted once the table has been filled in
+    ('last_built_revisions_state', None,
+     """CREATE TABLE last_built_revisions_state (
+        `id` INTEGER NOT NULL PRIMARY KEY,
+        `watermark` INTEGER NOT NULL
+    )"""),
+]
+
+# Buildsets submitted this long before our watermark are looked at again, in
+# case their transactions committed late
+LAST_BUILT_OVERLAP = 300
+# upgradeSchedulerTables fills in the last_built_revisions table this many
+# buildsets at a time
+LAST_BUILT_BACKFILL_BATCH = 1000
+
+
+def _prefixRange(prefix):
+    """Returns (lower, upper) such that lower <= s < upper for all strings s
+    starting with prefix"""
+    return prefix, prefix[:-1] + unichr(ord(prefix[-1]) + 1)
+
+
+def _changesForRevisions(db, t, revisions):
+    """Returns a dictionary of revision to a list of (branch, revision,
+    when_timestamp) for the changes whose revision starts with it.  Forced
+    builds can have just the short revision in their sourcestamp; full
+    revisions are looked up together."""
+    retval = dict((r, []) for r in revisions)
+    full = [r for r in revisions if len(r) >= 40]
+    for i in range(0, len(full), 100):
+        chunk = full[i:i + 100]
+        t.execute(db.quoteq("""SELECT branch, revision, when_timestamp
+                    FROM changes
+                    WHERE revision IN %s AND branch IS NOT NULL""" %
+                            db.parmlist(len(chunk))), tuple(chunk))
+        for row in t.fetchall():
+            retval[row[1]].append(row)
+
+    for revision in revisions:
+        if len(revision) >= 40:
+            continue
+        lower, upper = _prefixRange(revision)
+        t.execute(db.quoteq("""SELECT branch, revision, when_timestamp
+                    FROM changes
+                    WHERE revision >= ? AND revision < ? AND
+                        branch IS NOT NULL"""), (lower, upper))
+        retval[revision] = t.fetchall()
+    return retval
+
+
+def _storeBuiltRevisions(db, t, where, args):
+    """Merges the revisions built by the buildsets matching `where` (a
+    condition on buildsets) into the last_built_revisions table"""
+    t.execute(db.quoteq("""SELECT sourcestamps.revision,
+                buildrequests.buildername
+            FROM buildsets, sourcestamps, buildrequests
+            WHERE
+                %s AND
+                buildsets.sourcestampid = sourcestamps.id AND
+                buildrequests.buildsetid = buildsets.id""" % where), args)
+    builders = {}
+    for revision, name in t.fetchall():
+        if revision:
+            builders.setdefault(revision, set()).add(name)
+
+    # (buildername, branch) -> (when_timestamp, revision)
+    latest = {}
+    changes = _changesForRevisions(db, t, builders.keys())
+    for revision, names in builders.iteritems():
+        for branch, full_revision, when in changes[revision]:
+            for name in names:
+                key = (name, branch)
+                if key not in latest or latest[key] < (when, full_revision):
+                    latest[key] = (when, full_revision)
+
+    insert = """INSERT INTO last_built_revisions
+        (buildername, branch, revision, when_timestamp)
+        VALUES (?, ?, ?, ?)"""
+    if _isSqlite(db):
+        # The database is locked for the whole transaction, so this can't
+        # race with anyone else
+        insert = insert.replace("INSERT", "INSERT OR IGNORE", 1)
+        update = db.quoteq("""UPDATE last_built_revisions
+            SET revision = ?, when_timestamp = ?
+            WHERE buildername = ? AND branch = ? AND when_timestamp <= ?""")
+    else:
+        # revision has to be set first, while when_timestamp is the old one
+        insert += """ ON DUPLICATE KEY UPDATE
+            revision = IF(VALUES(when_timestamp) >= when_timestamp,
+                          VALUES(revision), revision),
+            when_timestamp = GREATEST(when_timestamp,
+                                      VALUES(when_timestamp))"""
+        update = None
+    insert = db.quoteq(insert)
+    for (name, branch), (when, revision) in latest.iteritems():
+        t.execute(insert, (name, branch, revision, when))
+        if update and t.rowcount == 0:
+            t.execute(update, (revision, when, name, branch, when))
+
+
+def backfillLastBuiltRevisions(db, now=None,
+                               batch=LAST_BUILT_BACKFILL_BATCH):
+    """Fills in the last_built_revisions table from all the buildsets, `batch`
+    buildsets at a time, each in its own transaction.  db is a DBConnector.
+    Does nothing if the table has already been filled in."""
+    if now is None:
+        now = int(time.time())
+
+    def filledIn(t):
+        t.execute("SELECT id FROM last_built_revisions_state")
+        return bool(t.fetchall())
+    if db.runInteractionNow(filledIn):
+        return
+
+    def storeBatch(t, after):
+        t.execute(db.quoteq("SELECT id FROM buildsets WHERE id > ? "
+                            "ORDER BY id LIMIT %i" % batch), (after,))
+        ids = [row[0] for row in t.fetchall()]
+        if not ids:
+            return None
+        _storeBuiltRevisions(db, t, "buildsets.id > ? AND buildsets.id <= ?",
+                             (after, ids[-1]))
+        return ids[-1]
+    after = 0
+    while after is not None:
+        after = db.runInteractionNow(storeBatch, after)
+    # Buildsets submitted since now are picked up by
+    # updateLastBuiltRevisions
+    db.runInteractionNow(lambda t: t.execute(db.quoteq(
+        "%s INTO last_built_revisions_state (id, watermark) VALUES (1, ?)"
+        % _insertIgnore(db)), (now,)))
+
+
+def updateLastBuiltRevisions(db, t, now=None):
+    """Brings the last_built_revisions table up to date with the buildsets
+    table, looking at the buildsets submitted since it last ran.  Returns
+    False if the table hasn't been set up by upgradeSchedulerTables yet.
+
+    Changes are matched to buildsets when the buildsets are first seen, so a
+    change that shows up after its revision has been built isn't
+    recorded."""
+    #### NOTE: called in a thread!
+    if now is None:
+        now = int(time.time())
+    if not _tableExists(db, t, 'last_built_revisions_state'):
+        return False
+    t.execute("SELECT watermark FROM last_built_revisions_state WHERE id = 1")
+    row = t.fetchone()
+    if row is None:
+        return False
+
+    _storeBuiltRevisions(db, t, "buildsets.submitted_at >= ?",
+                         (row[0] - LAST_BUILT_OVERLAP,))
+    t.execute(db.quoteq("UPDATE last_built_revisions_state "
+                        "SET watermark = %s(watermark, ?) WHERE id = 1"
+                        % _greatest(db)), (now,))
+    return True
+
+
 def getLastBuiltRevision(db, t, branch, builderNames):
     """Returns the latest revision that was built on builderNames"""
+    if not updateLastBuiltRevisions(db, t):
+        log.msg("getLastBuiltRevision: last_built_revisions hasn't been set "
+                "up; looking through history")
+        return getLastBuiltRevisionFromHistory(db, t, branch, builderNames)
+
+    t.execute(db.quoteq("""SELECT revision FROM last_built_revisions
+            WHERE
+                branch = ? AND
+                buildername IN %s
+            ORDER BY when_timestamp DESC
+            LIMIT 1""" % db.parmlist(len(builderNames))),
+        (branch,) + tuple(builderNames))
+    result = t.fetchone()
+    if result:
+        return result[0]
+    return None
+
+
+def getLastBuiltRevisionFromHistory(db, t, branch, builderNames):
+    """Returns the latest revision that was built on builderNames, by looking
+    through all the changes and buildsets"""
     # Utility function to handle concatenation differently depending on what
     # database we're talking to. mysql uses the CONCAT() function whereas
     # sqlite uses the || operator.
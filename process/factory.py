@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 
+import gc
 import os.path
 import re
 import urllib
@@ -15,7 +16,9 @@ from buildbot.steps.transfer import FileDownload, JSONPropertiesDownload, JSONSt
 from buildbot.steps.dummy import Dummy
 from buildbot import locks
 from buildbot.status.builder import worst_status
+from buildbot.util import ComparableMixin
 
+from buildbotcustom.reloader import reloadIfChanged
 import buildbotcustom.common
 import buildbotcustom.status.errors
 import buildbotcustom.steps.base
@@ -33,21 +36,21 @@ import buildbotcustom.misc_scheduler
 import build.paths
 import release.info
 import release.paths
-reload(buildbotcustom.status.errors)
-reload(buildbotcustom.steps.base)
-reload(buildbotcustom.steps.misc)
-reload(buildbotcustom.steps.release)
-reload(buildbotcustom.steps.source)
-reload(buildbotcustom.steps.test)
-reload(buildbotcustom.steps.updates)
-reload(buildbotcustom.steps.talos)
-reload(buildbotcustom.steps.unittest)
-reload(buildbotcustom.steps.signing)
-reload(buildbotcustom.steps.mock)
-reload(buildbotcustom.env)
-reload(build.paths)
-reload(release.info)
-reload(release.paths)
+reloadIfChanged(buildbotcustom.status.errors)
+reloadIfChanged(buildbotcustom.steps.base)
+reloadIfChanged(buildbotcustom.steps.misc)
+reloadIfChanged(buildbotcustom.steps.release)
+reloadIfChanged(buildbotcustom.steps.source)
+reloadIfChanged(buildbotcustom.steps.test)
+reloadIfChanged(buildbotcustom.steps.updates)
+reloadIfChanged(buildbotcustom.steps.talos)
+reloadIfChanged(buildbotcustom.steps.unittest)
+reloadIfChanged(buildbotcustom.steps.signing)
+reloadIfChanged(buildbotcustom.steps.mock)
+reloadIfChanged(buildbotcustom.env)
+reloadIfChanged(build.paths)
+reloadIfChanged(release.info)
+reloadIfChanged(release.paths)
 
 from buildbotcustom.status.errors import purge_error, global_errors, \
     upload_errors, talos_hgweb_errors, tegra_errors
@@ -90,6 +93,101 @@ SIGNING_SERVER_CERT = os.path.join(
     os.path.dirname(build.paths.__file__),
     '../../../release/signing/host.cert')
 
+# Step factories, and the values in their arguments, that are shared between
+# all the factories that use them.  See shareStepFactories.  misc empties
+# this at the start of each reconfig.
+_sharedStepValues = {}
+
+
+# Values that are left as they are
+_unsharedTypes = (unicode, int, long, float, bool, type(None))
+
+
+def _shareValue(value, memo):
+    """Returns a value equal to value that is kept in _sharedStepValues.
+    Lists, tuples and dicts with equal contents, and ComparableMixins (like
+    WithProperties and lock accesses) of the same class with equal
+    attributes, all get the same object.  Strings are interned.  Anything
+    else is only ever the same as itself.
+
+    memo holds the results for the values seen so far, by id.  Values can't
+    change while it's in use."""
+    t = type(value)
+    if t is str:
+        return intern(value)
+    if t in _unsharedTypes:
+        return value
+    if id(value) in memo:
+        return memo[id(value)][1]
+
+    # The keys of containers are the ids of the (shared) values in them.
+    # This is called for an awful lot of strings, so they're dealt with
+    # here rather than in another call.  Subclasses (OrderedDicts,
+    # namedtuples...) are left alone.
+    if t is list or t is tuple:
+        shared = t([intern(v) if type(v) is str else
+                    v if type(v) in _unsharedTypes else
+                    _shareValue(v, memo) for v in value])
+        key = (t,) + tuple(map(id, shared))
+    elif t is dict:
+        shared = dict([(intern(k) if type(k) is str else
+                        _shareValue(k, memo),
+                        intern(v) if type(v) is str else
+                        v if type(v) in _unsharedTypes else
+                        _shareValue(v, memo))
+                       for k, v in value.iteritems()])
+        key = (dict,) + tuple(sorted([(id(k), id(v))
+                                      for k, v in shared.iteritems()]))
+    elif isinstance(value, ComparableMixin):
+        # Not everything that matters is always in compare_attrs (e.g.
+        # WithProperties' lambda_subs), so look at all of its attributes
+        key = (value.__class__, id(_shareValue(value.__dict__, memo)))
+        shared = value
+    else:
+        key = (id, id(value))
+        shared = value
+    # Everything in the keys has to stay in here for as long as they do, so
+    # that their ids aren't reused
+    shared = _sharedStepValues.setdefault(key, shared)
+    # Likewise for value, while memo is in use
+    memo[id(value)] = (value, shared)
+    return shared
+
+
+def shareStepFactories(factories):
+    """Replaces the step factories of each of factories, which are (step
+    class, arguments) tuples, with ones shared with other factories that
+    have a step of the same class with equal arguments.  Equal values inside
+    the arguments (command lists, environments, and so on) are shared too.
+
+    This is meant to be called once the factories have had all of their
+    steps added, usually by the functions in misc that make builders.  From
+    then on, the arguments of their steps mustn't be modified (buildbot
+    copies them before making each step)."""
+    memo = {}
+    # This makes lots of small objects that last until we're done, which the
+    # garbage collector would otherwise keep looking at along with
+    # everything else the master has.  There can't be any cycles in them.
+    gcEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        for factory in factories:
+            steps = []
+            for stepClass, kwargs in factory.steps:
+                shared = _shareValue(kwargs, memo)
+                steps.append(_sharedStepValues.setdefault(
+                    ('step', stepClass, id(shared)), (stepClass, shared)))
+            factory.steps = steps
+    finally:
+        if gcEnabled:
+            gc.enable()
+
+
+def clearSharedSteps():
+    """Forgets the steps shared so far.  Factories that already share them
+    keep doing so."""
+    _sharedStepValues.clear()
+
 
 class DummyFactory(BuildFactory):
     def __init__(self, delay=5, triggers=None):
@@ -298,31 +396,35 @@ class RequestSortingBuildFactory(BuildFactory):
           use the greatest of these property values
         * Otherwise use the request's submission time
     """
-    def newBuild(self, requests):
-        def sortkey(request):
-            # Ignore any buildids if we're rebuilding
-            # Catch things like "The web-page 'rebuild' ...", or self-serve
-            # messages, "Rebuilt by ..."
-            if 'rebuil' in request.reason.lower():
-                return int(genBuildID(request.submittedAt))
-
-            buildids = []
-
-            props = [request.properties] + [
-                c.properties for c in request.source.changes]
-
-            for p in props:
-                try:
-                    buildids.append(int(p['buildid']))
-                except:
-                    pass
-
-            if buildids:
-                return max(buildids)
-            return int(genBuildID(request.submittedAt))
+    # How many build requests to remember sort keys for
+    sortKeyCacheSize = 1000
+
+    def getSortKey(self, request):
+        """Returns the key to sort request by.  Build requests don't change
+        once they're submitted, so the key is remembered by request id for
+        the next time the request is looked at."""
+        brid = getattr(request, 'id', None)
+        if brid is None:
+            return requestSortKey(request)
+
+        # Our subclasses don't call our __init__
+        cache = self.__dict__.get('_sortkeys')
+        if cache is None:
+            cache = self._sortkeys = {}
+        if brid not in cache:
+            if len(cache) >= self.sortKeyCacheSize:
+                cache.clear()
+            cache[brid] = requestSortKey(request)
+        return cache[brid]
 
+    def newBuild(self, requests):
         try:
-            sorted_requests = sorted(requests, key=sortkey)
+            # Sort on (key, position) so the requests themselves are never
+            # compared, and equal keys keep their order
+            keyed = [(self.getSortKey(r), i, r)
+                     for i, r in enumerate(requests)]
+            keyed.sort()
+            sorted_requests = [r for (key, i, r) in keyed]
             return BuildFactory.newBuild(self, sorted_requests)
         except:
             # Something blew up!
@@ -332,6 +434,30 @@ class RequestSortingBuildFactory(BuildFactory):
             return BuildFactory.newBuild(self, requests)
 
 
+def requestSortKey(request):
+    """Returns the key RequestSortingBuildFactory sorts request by"""
+    # Ignore any buildids if we're rebuilding
+    # Catch things like "The web-page 'rebuild' ...", or self-serve
+    # messages, "Rebuilt by ..."
+    if 'rebuil' in request.reason.lower():
+        return int(genBuildID(request.submittedAt))
+
+    buildids = []
+
+    props = [request.properties] + [
+        c.properties for c in request.source.changes]
+
+    for p in props:
+        try:
+            buildids.append(int(p['buildid']))
+        except:
+            pass
+
+    if buildids:
+        return max(buildids)
+    return int(genBuildID(request.submittedAt))
+
+
 class MockMixin(object):
     warnOnFailure = True
     warnOnWarnings = True
@@ -12,23 +12,24 @@ from buildbot.steps.trigger import Trigger
 from buildbot.status.builder import Results
 from buildbot.process.factory import BuildFactory
 
+from buildbotcustom.reloader import reloadIfChanged
 import release.platforms
 import release.paths
 import buildbotcustom.changes.ftppoller
 import buildbotcustom.common
 import build.paths
 import release.info
-reload(release.platforms)
-reload(release.paths)
-reload(buildbotcustom.changes.ftppoller)
-reload(build.paths)
-reload(release.info)
+reloadIfChanged(release.platforms)
+reloadIfChanged(release.paths)
+reloadIfChanged(buildbotcustom.changes.ftppoller)
+reloadIfChanged(build.paths)
+reloadIfChanged(release.info)
 
 from buildbotcustom.status.mail import ChangeNotifier
 from buildbotcustom.misc import get_l10n_repositories, \
     generateTestBuilderNames, generateTestBuilder, _nextFastSlave, \
     changeContainsProduct, nomergeBuilders, changeContainsProperties, \
-    changeBaseTagContainsScriptRepoRevision
+    changeBaseTagContainsScriptRepoRevision, shareSteps
 from buildbotcustom.common import normalizeName
 from buildbotcustom.process.factory import StagingRepositorySetupFactory, \
     ScriptFactory, SingleSourceFactory, ReleaseBuildFactory, \
@@ -1960,6 +1961,8 @@ def generateReleaseBranchObjects(releaseConfig, branchConfig,
         if 'product' not in props:
             props['product'] = releaseConfig['productName']
 
+    shareSteps(builders)
+
     return {
         "builders": builders,
         "status": status,
@@ -0,0 +1,230 @@
+"""Reloads modules on reconfig only if they have changed.
+
+Modules that master.cfg uses, and the modules they use, have always called
+reload() on the modules they import, so that a reconfig picks up changes to
+them.  But that means that every reconfig (and checkconfig) runs all of them
+again, including the very large process.factory, and some more than once.
+
+reloadIfChanged(module) is a drop-in replacement for reload(module) in the
+body of a module.  It only reloads module if its source file has changed
+since it was last loaded, or if one of the modules it depends on has been
+(or needs to be) reloaded since then, because module would otherwise keep
+using things from the old version of that one.  A module depends on the
+modules it calls reloadIfChanged for, and on the modules in its own package
+(e.g. buildbotcustom) that it imports, even if it only imports names from
+them; those are reloaded first if they need to be.
+
+This module must never be reloaded itself, since it keeps track of when
+everything else was loaded.
+"""
+import dis
+import imp
+import itertools
+import marshal
+import os
+import struct
+import sys
+
+from twisted.python import log
+
+# Module name to _Loaded
+_modules = {}
+
+# Counts loads, so that we know which modules were loaded after which
+_loadCounter = itertools.count()
+
+# Source path to (source stamp, names of the modules it imports)
+_imports = {}
+
+
+class _Loaded(object):
+    """What we know about a loaded module"""
+    def __init__(self, stamp):
+        # What its source file looked like when it was loaded
+        self.stamp = stamp
+        # The names of the modules that it calls reloadIfChanged for
+        self.deps = set()
+        # When it was loaded, compared to other modules
+        self.loadedAt = None
+
+
+def sourceStamp(module):
+    """Returns the path, modification time and size of module's source file,
+    or None if it doesn't have one"""
+    path = getattr(module, '__file__', None)
+    if not path:
+        return None
+    if path.endswith(('.pyc', '.pyo')):
+        path = path[:-1]
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (path, st.st_mtime, st.st_size)
+
+
+def _moduleCode(path, stamp):
+    """Returns the code object for the source file at path, from its .pyc
+    file if that is up to date"""
+    try:
+        f = open(path + 'c', 'rb')
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        if data[:4] == imp.get_magic() and \
+                struct.unpack('<I', data[4:8])[0] == int(stamp[1]):
+            return marshal.loads(data[8:])
+    except (IOError, EOFError, ValueError, TypeError, struct.error):
+        pass
+    f = open(path, 'rU')
+    try:
+        return compile(f.read() + '\n', path, 'exec')
+    finally:
+        f.close()
+
+
+def _importStatements(code):
+    """Yields (name, fromlist, level) for each import statement in code,
+    including those in the functions and classes it defines"""
+    consts = []
+    ops = code.co_code
+    i = 0
+    while i < len(ops):
+        op = ord(ops[i])
+        if op >= dis.HAVE_ARGUMENT:
+            arg = ord(ops[i + 1]) + ord(ops[i + 2]) * 256
+            i += 3
+        else:
+            arg = None
+            i += 1
+        if op == dis.opmap['LOAD_CONST']:
+            consts.append(code.co_consts[arg])
+        elif op == dis.opmap['IMPORT_NAME'] and len(consts) >= 2:
+            yield code.co_names[arg], consts[-1], consts[-2]
+        else:
+            consts = []
+    for c in code.co_consts:
+        if isinstance(c, type(code)):
+            for statement in _importStatements(c):
+                yield statement
+
+
+def importedModules(module):
+    """Returns the names of the modules that module imports, or imports
+    names from, that are in the same top level package as module.  Packages
+    themselves, and this module, are left out."""
+    stamp = sourceStamp(module)
+    if stamp is None:
+        return set()
+    path = stamp[0]
+    if path in _imports and _imports[path][0] == stamp:
+        return _imports[path][1]
+
+    name = module.__name__
+    top = name.split('.')[0]
+    if hasattr(module, '__path__'):
+        package = name
+    else:
+        package = name.rpartition('.')[0]
+    found = set()
+    for imported, fromlist, level in _importStatements(
+            _moduleCode(path, stamp)):
+        candidates = []
+        if level < 0 and package:
+            # An implicit relative import
+            candidates.append('%s.%s' % (package, imported))
+        candidates.append(imported)
+        for c in candidates:
+            if c in sys.modules:
+                found.add(c)
+                for n in fromlist or ():
+                    found.add('%s.%s' % (c, n))
+                break
+    imported = set()
+    for n in found:
+        m = sys.modules.get(n)
+        if m is not None and n != name and n != __name__ and \
+                n.split('.')[0] == top and not hasattr(m, '__path__'):
+            imported.add(n)
+    _imports[path] = (stamp, imported)
+    return imported
+
+
+def _dependencies(name):
+    deps = set(importedModules(sys.modules[name]))
+    loaded = _modules.get(name)
+    if loaded is not None:
+        deps.update(loaded.deps)
+    return deps
+
+
+def isStale(name, checked=None):
+    """Returns True if the module called name has to be reloaded"""
+    if checked is None:
+        checked = {}
+    if name in checked:
+        return checked[name]
+    loaded = _modules.get(name)
+    module = sys.modules.get(name)
+    if loaded is None or loaded.loadedAt is None or module is None:
+        # We don't know when (or whether) it was loaded
+        return True
+    # Guard against modules that depend on each other
+    checked[name] = False
+
+    stale = sourceStamp(module) != loaded.stamp
+    for dep in _dependencies(name):
+        if stale:
+            break
+        depLoaded = _modules.get(dep)
+        stale = depLoaded is None or depLoaded.loadedAt is None or \
+            depLoaded.loadedAt > loaded.loadedAt or isStale(dep, checked)
+    checked[name] = stale
+    return stale
+
+
+def _reload(module, reloading):
+    """Reloads module if it is stale, after reloading the stale modules it
+    imports from"""
+    name = module.__name__
+    if name in reloading or not isStale(name):
+        return module
+    reloading.add(name)
+    for dep in sorted(importedModules(module)):
+        _reload(sys.modules[dep], reloading)
+
+    loaded = _modules[name] = _Loaded(sourceStamp(module))
+    try:
+        module = reload(module)
+    except:
+        del _modules[name]
+        raise
+    loaded.loadedAt = _loadCounter.next()
+    return module
+
+
+def reloadIfChanged(module):
+    """Reloads module if it has changed since it was last loaded, and
+    returns it.  See the module docstring."""
+    name = module.__name__
+    module = _reload(module, set())
+
+    # The module calling us is being loaded; make sure that it will be
+    # reloaded if module is
+    caller = sys._getframe(1).f_globals.get('__name__')
+    if caller in sys.modules:
+        loaded = _modules.get(caller)
+        if loaded is None:
+            loaded = _modules[caller] = _Loaded(None)
+        loaded.stamp = sourceStamp(sys.modules[caller])
+        loaded.deps.add(name)
+        loaded.loadedAt = _loadCounter.next()
+    return module
+
+
+def forgetModules():
+    """Forgets about every module, so that they all get reloaded the next
+    time they're passed to reloadIfChanged"""
+    log.msg("reloader: forgetting %i modules" % len(_modules))
+    _modules.clear()
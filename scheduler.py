@@ -18,14 +18,18 @@ from buildbot.status.builder import SUCCESS, WARNINGS
 
 from buildbot.util import now
 
+from buildbotcustom.buildsets import BulkBuildsetMixin, get_sourcestampids
+
+from buildbotcustom.reloader import reloadIfChanged
 import util.tuxedo
-reload(util.tuxedo)
+reloadIfChanged(util.tuxedo)
 from util.tuxedo import get_release_uptake
 
 import time
+import weakref
 
 
-class MultiScheduler(Scheduler):
+class MultiScheduler(Scheduler, BulkBuildsetMixin):
     """Trigger N (default three) build requests based upon the same change request"""
     def __init__(self, numberOfBuildsToTrigger=3, **kwargs):
         self.numberOfBuildsToTrigger = numberOfBuildsToTrigger
@@ -36,18 +40,19 @@ class MultiScheduler(Scheduler):
     def _add_build_and_remove_changes(self, t, important, unimportant):
         all_changes = sorted(important + unimportant, key=lambda c: c.number)
         db = self.parent.db
+        if self.treeStableTimer is None:
+            # each *important* Change gets a separate build.  Unimportant
+            # builds get ignored.
+            sourcestamps = [SourceStamp(changes=[c]) for c in important]
+        else:
+            sourcestamps = [SourceStamp(changes=all_changes)]
+        # The N builds of a change share its sourcestamp
+        ssids = get_sourcestampids(db, t, sourcestamps)
+        buildsets = []
         for i in range(self.numberOfBuildsToTrigger):
-            if self.treeStableTimer is None:
-                # each *important* Change gets a separate build.  Unimportant
-                # builds get ignored.
-                for c in important:
-                    ss = SourceStamp(changes=[c])
-                    ssid = db.get_sourcestampid(ss, t)
-                    self.create_buildset(ssid, "scheduler", t)
-            else:
-                ss = SourceStamp(changes=all_changes)
-                ssid = db.get_sourcestampid(ss, t)
-                self.create_buildset(ssid, "scheduler", t)
+            for ssid in ssids:
+                buildsets.append((ssid, "scheduler", None, None))
+        self.create_buildsets(buildsets, t)
 
         # and finally retire the changes from scheduler_changes
         changeids = [c.number for c in all_changes]
@@ -111,20 +116,47 @@ class PersistentScheduler(BaseScheduler):
             # Try again later
             return (self.lastCheck + self.pollInterval + 1)
 
+        d = self.parent.db.runInteraction(self._run)
+        return d
+
+    def get_pending_counts(self, t):
+        """Returns a dictionary of builder name to the number of pending
+        build requests for each of builderNames"""
+        #### NOTE: called in a thread!
+        if not self.builderNames:
+            return {}
         db = self.parent.db
+        # "pending" means unclaimed and incomplete, as in
+        # get_pending_brids_for_builder
+        q = db.quoteq("""SELECT buildername, COUNT(*) FROM buildrequests
+                WHERE
+                    buildername IN %s AND
+                    complete = 0 AND
+                    claimed_at = 0
+                GROUP BY buildername""" %
+                      db.parmlist(len(self.builderNames)))
+        t.execute(q, tuple(self.builderNames))
+        counts = dict((b, 0) for b in self.builderNames)
+        for builderName, n in t.fetchall():
+            counts[builderName] = n
+        return counts
+
+    def _run(self, t):
+        counts = self.get_pending_counts(t)
         to_create = []
         for builderName in self.builderNames:
-            n = len(db.get_pending_brids_for_builder(builderName))
-            num_to_create = self.numPending - n
+            num_to_create = self.numPending - counts[builderName]
             if num_to_create <= 0:
                 continue
             to_create.append((builderName, num_to_create))
-
-        d = db.runInteraction(lambda t: self.create_builds(to_create, t))
-        return d
+        return self.create_builds(to_create, t)
 
     def create_builds(self, to_create, t):
         db = self.parent.db
+        if to_create:
+            log.msg("%s: creating %i buildsets for %i builders" % (
+                self.name, sum(count for b, count in to_create),
+                len(to_create)))
         for builderName, count in to_create:
             ss = self.ssFunc(builderName)
             ssid = db.get_sourcestampid(ss, t)
@@ -214,25 +246,26 @@ class BuilderChooserScheduler(MultiScheduler):
                 return
 
             db = self.parent.db
+            if self.treeStableTimer is None:
+                # each Change gets a separate build
+                changes = [c for c in all_changes if c in buildersPerChange]
+                ssids = get_sourcestampids(
+                    db, t, [SourceStamp(changes=[c]) for c in changes])
+                requests = [(ssid, buildersPerChange[c])
+                            for ssid, c in zip(ssids, changes)]
+            else:
+                # Grab all builders
+                builderNames = set()
+                for names in buildersPerChange.values():
+                    builderNames.update(names)
+                builderNames = list(builderNames)
+                ss = SourceStamp(changes=all_changes)
+                requests = [(db.get_sourcestampid(ss, t), builderNames)]
+            buildsets = []
             for i in range(self.numberOfBuildsToTrigger):
-                if self.treeStableTimer is None:
-                    # each Change gets a separate build
-                    for c in all_changes:
-                        if c not in buildersPerChange:
-                            continue
-                        ss = SourceStamp(changes=[c])
-                        ssid = db.get_sourcestampid(ss, t)
-                        self.create_buildset(ssid, "scheduler", t, builderNames=buildersPerChange[c])
-                else:
-                    # Grab all builders
-                    builderNames = set()
-                    for names in buildersPerChange.values():
-                        builderNames.update(names)
-                    builderNames = list(builderNames)
-                    ss = SourceStamp(changes=all_changes)
-                    ssid = db.get_sourcestampid(ss, t)
-                    self.create_buildset(
-                        ssid, "scheduler", t, builderNames=builderNames)
+                for ssid, builderNames in requests:
+                    buildsets.append((ssid, "scheduler", None, builderNames))
+            self.create_buildsets(buildsets, t)
 
             # and finally retire the changes from scheduler_changes
             changeids = [c.number for c in all_changes]
@@ -357,6 +390,29 @@ class TriggerBouncerCheck(Triggerable):
         return None  # eat the failure
 
 
+# The running AggregatingSchedulers, and the db connectors that pass retired
+# build requests on to them.  Connectors have no way to unsubscribe, so each
+# one is subscribed to once, rather than holding on to every scheduler that
+# has ever run.  They outlive reloads of this module, like the subscriptions.
+try:
+    _aggregatingSchedulers
+except NameError:
+    _aggregatingSchedulers = set()
+    _retiredSubscriptions = weakref.WeakSet()
+
+
+def _subscribeToRetired(db):
+    if db in _retiredSubscriptions:
+        return
+
+    def retired(category, *brids):
+        for s in list(_aggregatingSchedulers):
+            if s.parent.db is db:
+                s.buildRequestsRetired(category, *brids)
+    db.subscribe_to("retire-buildrequest", retired)
+    _retiredSubscriptions.add(db)
+
+
 class AggregatingScheduler(BaseScheduler, Triggerable):
     """This scheduler waits until at least one build of each of
     `upstreamBuilders` completes with a result in `okResults`. Once this
@@ -364,13 +420,20 @@ class AggregatingScheduler(BaseScheduler, Triggerable):
     Use trigger() method to reset its state.
 
     `okResults` should be a tuple of acceptable result codes, and defaults to
-    (SUCCESS,WARNINGS)."""
+    (SUCCESS,WARNINGS).
+
+    Completed build requests are picked up as the database reports them
+    being retired.  Every `reconcileInterval` seconds, the buildrequests table
+    is also checked for upstream builds that finished since the last check,
+    which catches builds finished by other masters."""
 
     compare_attrs = ('name', 'branch', 'builderNames', 'properties',
-                     'upstreamBuilders', 'okResults', 'enable_service')
+                     'upstreamBuilders', 'okResults', 'enable_service',
+                     'reconcileInterval')
 
     def __init__(self, name, branch, builderNames, upstreamBuilders,
-                 okResults=(SUCCESS, WARNINGS), properties={}):
+                 okResults=(SUCCESS, WARNINGS), properties={},
+                 reconcileInterval=300):
         BaseScheduler.__init__(self, name, builderNames, properties)
         self.branch = branch
         self.lock = defer.DeferredLock()
@@ -378,6 +441,11 @@ class AggregatingScheduler(BaseScheduler, Triggerable):
         self.upstreamBuilders = upstreamBuilders
         self.reason = "AggregatingScheduler(%s)" % name
         self.okResults = okResults
+        self.reconcileInterval = reconcileInterval
+        # Build requests we've been told were retired, but haven't looked at
+        # yet
+        self.retiredBrids = []
+        self.nextReconcile = 0
         self.log_prefix = '%s(%s) <id=%s>' % (self.__class__.__name__, name,
                                               id(self))
 
@@ -393,14 +461,28 @@ class AggregatingScheduler(BaseScheduler, Triggerable):
             "upstreamBuilders": self.upstreamBuilders,
             "remainingBuilders": self.upstreamBuilders,
             "lastCheck": now(),
+            # [brid, complete_at] of builds that were counted as they were
+            # retired, and so should be skipped by findNewBuilds
+            "seenBuilds": [],
         }
 
     def startService(self):
         if not self.enable_service:
             return
         self.parent.db.runInteractionNow(self._startService)
+        _subscribeToRetired(self.parent.db)
+        _aggregatingSchedulers.add(self)
         BaseScheduler.startService(self)
 
+    def stopService(self):
+        _aggregatingSchedulers.discard(self)
+        self.retiredBrids = []
+        return BaseScheduler.stopService(self)
+
+    def buildRequestsRetired(self, category, *brids):
+        self.retiredBrids.extend(brids)
+        self.parent.trigger()
+
     def _startService(self, t):
         state = self.get_state(t)
         old_state = state.copy()
@@ -418,6 +500,7 @@ class AggregatingScheduler(BaseScheduler, Triggerable):
                b not in state['remainingBuilders']:
                 state['remainingBuilders'].append(b)
         state['upstreamBuilders'] = self.upstreamBuilders
+        state.setdefault('seenBuilds', [])
         log.msg('%s: reloaded' % self.log_prefix)
         if old_state != state:
             log.msg('%s: old state: %s' % (self.log_prefix, old_state))
@@ -442,11 +525,36 @@ class AggregatingScheduler(BaseScheduler, Triggerable):
             return
 
         if self.lock.locked:
-            return
+            return self.nextReconcile
+
+        reconcile = now() >= self.nextReconcile
+        if not self.retiredBrids and not reconcile:
+            # Nothing to do until our next check
+            return self.nextReconcile
+
+        brids, self.retiredBrids = self.retiredBrids, []
+        if reconcile:
+            self.nextReconcile = now() + self.reconcileInterval
+
+        def release(res):
+            self.lock.release()
+            return res
+
+        def failed(f):
+            # Try again next time
+            self.retiredBrids = brids + self.retiredBrids
+            if reconcile:
+                self.nextReconcile = now() + self.reconcileInterval
+            log.msg('%s: failed to check for new builds' % self.log_prefix)
+            log.err(f)
 
         d = self.lock.acquire()
-        d.addCallback(lambda _: self.parent.db.runInteraction(self._run))
-        d.addBoth(lambda _: self.lock.release())
+        d.addCallback(lambda _: self.parent.db.runInteraction(self._run,
+                                                              brids,
+                                                              reconcile))
+        d.addBoth(release)
+        d.addErrback(failed)
+        d.addCallback(lambda _: self.nextReconcile)
         return d
 
     def findNewBuilds(self, db, t, lastCheck):
@@ -470,21 +578,65 @@ class AggregatingScheduler(BaseScheduler, Triggerable):
                                                  lastCheck))
         return newBuilds
 
-    def _run(self, t):
+    def findRetiredBuilds(self, db, t, brids):
+        """Returns the builds in brids that are from upstreamBuilders and
+        completed with a result in okResults"""
+        retval = []
+        brids = list(brids)
+        while brids:
+            batch, brids = brids[:100], brids[100:]
+            q = """SELECT buildername, id, complete_at FROM
+                   buildrequests WHERE
+                   id IN %s AND
+                   buildername IN %s AND
+                   buildrequests.complete = 1 AND
+                   buildrequests.results IN %s
+                """ % (
+                db.parmlist(len(batch)),
+                db.parmlist(len(self.upstreamBuilders)),
+                db.parmlist(len(self.okResults)),
+            )
+            t.execute(db.quoteq(q), tuple(batch) +
+                      tuple(self.upstreamBuilders) + tuple(self.okResults))
+            retval.extend(t.fetchall())
+        if retval:
+            log.msg('%s: retired builds: %s' % (self.log_prefix, retval))
+        return retval
+
+    def _run(self, t, brids=(), reconcile=True):
         db = self.parent.db
         state = self.get_state(t)
-        # Check for new builds completed since lastCheck
         lastCheck = state['lastCheck']
         remainingBuilders = state['remainingBuilders']
-
-        newBuilds = self.findNewBuilds(db, t, lastCheck)
-
-        for builder, brid, complete_at in newBuilds:
-            state['lastCheck'] = max(state['lastCheck'], complete_at)
-            if builder in remainingBuilders:
-                remainingBuilders.remove(builder)
+        seenBuilds = state.get('seenBuilds', [])
+        seenBrids = set(brid for brid, complete_at in seenBuilds)
+
+        if brids:
+            for builder, brid, complete_at in self.findRetiredBuilds(db, t,
+                                                                     brids):
+                # Builds completed before lastCheck have already been picked
+                # up by findNewBuilds
+                if complete_at <= lastCheck or brid in seenBrids:
+                    continue
+                seenBuilds.append([brid, complete_at])
+                seenBrids.add(brid)
+                if builder in remainingBuilders:
+                    remainingBuilders.remove(builder)
+
+        if reconcile:
+            # Check for new builds completed since lastCheck
+            for builder, brid, complete_at in self.findNewBuilds(db, t,
+                                                                 lastCheck):
+                state['lastCheck'] = max(state['lastCheck'], complete_at)
+                if brid in seenBrids:
+                    continue
+                if builder in remainingBuilders:
+                    remainingBuilders.remove(builder)
+            # Builds up to lastCheck won't be returned by findNewBuilds again
+            seenBuilds = [b for b in seenBuilds if b[1] > state['lastCheck']]
 
         lastCheck = state['lastCheck']
+        state['seenBuilds'] = seenBuilds
 
         if remainingBuilders:
             state['remainingBuilders'] = remainingBuilders
@@ -502,6 +654,7 @@ class AggregatingScheduler(BaseScheduler, Triggerable):
             # Reset the list of builders we're waiting for
             state = self.get_initial_state(None)
             state['lastCheck'] = lastCheck
+            state['seenBuilds'] = seenBuilds
 
         self.set_state(t, state)
 
@@ -512,40 +665,136 @@ def makePropertiesScheduler(base_class, propfuncs, *args, **kw):
 
     Each function of propfuncs will be passed (scheduler instance, db
     transaction, sourcestamp id) and must return a Properties instance.  These
-    properties will be added to any new buildsets this scheduler creates."""
+    properties will be added to any new buildsets this scheduler creates.
+
+    Functions can say that their results can be reused by setting a
+    `cacheScope` attribute (see misc_scheduler.cacheablePropFunc):
+    'transaction' to reuse them for the rest of the transaction,
+    'sourcestamp' to reuse them for the same sourcestamp, or 'ttl' to reuse
+    them for everything.  Cached results expire after `cacheTTL` seconds, if
+    that is set.  Functions can also have a `batch` attribute, which is
+    called with (scheduler instance, db transaction, list of sourcestamp ids)
+    and returns a list of Properties, when several buildsets are created at
+    once."""
     pf = propfuncs
 
     class S(base_class):
         compare_attrs = base_class.compare_attrs + ('propfuncs',)
         propfuncs = pf
+        # How many cached propfunc results to keep
+        propfuncCacheSize = 1000
+        # (transaction, {func: (expiry, props)}) for the current transaction
+        _propfuncTxnCache = None
+        # {func or (func, ssid): (expiry, props)}
+        _propfuncCache = None
+
+        def _get_cached_props(self, func, t, ssid):
+            scope = func.cacheScope
+            if scope == 'transaction':
+                if self._propfuncTxnCache is None or \
+                        self._propfuncTxnCache[0] is not t:
+                    self._propfuncTxnCache = (t, {})
+                cache = self._propfuncTxnCache[1]
+                key = func
+            else:
+                if self._propfuncCache is None or \
+                        len(self._propfuncCache) >= self.propfuncCacheSize:
+                    self._propfuncCache = {}
+                cache = self._propfuncCache
+                if scope == 'sourcestamp':
+                    key = (func, ssid)
+                else:
+                    key = func
 
-        def create_buildset(self, ssid, reason, t, props=None, builderNames=None):
+            now = time.time()
+            if key in cache:
+                expiry, props = cache[key]
+                if expiry is None or now < expiry:
+                    return props
+
+            props = func(self, t, ssid)
+            log.msg("%s: propfunc returned %s" % (self.name, props))
+            ttl = getattr(func, 'cacheTTL', None)
+            if ttl is None:
+                cache[key] = (None, props)
+            else:
+                cache[key] = (now + ttl, props)
+            return props
+
+        def _call_propfunc(self, func, t, ssid):
+            if getattr(func, 'cacheScope', None):
+                return self._get_cached_props(func, t, ssid)
+            request_props = func(self, t, ssid)
+            log.msg("%s: propfunc returned %s" % (self.name, request_props))
+            return request_props
+
+        def _get_propfunc_props(self, func, t, ssids):
+            """Returns the properties func gives for each of ssids"""
+            if len(ssids) > 1 and getattr(func, 'batch', None):
+                retval = func.batch(self, t, ssids)
+                log.msg("%s: propfunc returned %s" %
+                        (self.name, [str(p) for p in retval]))
+                return retval
+            retval = []
+            for ssid in ssids:
+                try:
+                    retval.append(self._call_propfunc(func, t, ssid))
+                except:
+                    log.msg("Error running %s" % func)
+                    log.err()
+                    retval.append(Properties())
+            return retval
+
+        def _get_buildsets_props(self, ssids, t, props_list):
+            """Returns the properties for buildsets with the given sourcestamp
+            ids and properties"""
             # We need a fresh set of properties each time since we expect to update
             # the properties below
-            my_props = Properties()
-            if props is None:
-                my_props.updateFromProperties(self.properties)
-            else:
-                my_props.updateFromProperties(props)
+            all_props = []
+            for props in props_list:
+                my_props = Properties()
+                if props is None:
+                    my_props.updateFromProperties(self.properties)
+                else:
+                    my_props.updateFromProperties(props)
+                all_props.append(my_props)
 
             # Update with our prop functions
             try:
                 for func in propfuncs:
                     try:
-                        request_props = func(self, t, ssid)
-                        log.msg("%s: propfunc returned %s" %
-                                (self.name, request_props))
-                        my_props.updateFromProperties(request_props)
+                        request_props = self._get_propfunc_props(func, t,
+                                                                 ssids)
+                        for my_props, p in zip(all_props, request_props):
+                            my_props.updateFromProperties(p)
                     except:
                         log.msg("Error running %s" % func)
                         log.err()
             except:
                 log.msg("%s: error calculating properties" % self.name)
                 log.err()
+            return all_props
+
+        def _get_buildset_props(self, ssid, t, props=None):
+            return self._get_buildsets_props([ssid], t, [props])[0]
 
+        def create_buildset(self, ssid, reason, t, props=None, builderNames=None):
+            my_props = self._get_buildset_props(ssid, t, props)
             # Call our base class's original, with our new properties.
             return base_class.create_buildset(self, ssid, reason, t, my_props, builderNames)
 
+        if hasattr(base_class, 'create_buildsets'):
+            def create_buildsets(self, buildsets, t):
+                # Each buildset gets its own set of properties from our prop
+                # functions
+                all_props = self._get_buildsets_props(
+                    [b[0] for b in buildsets], t, [b[2] for b in buildsets])
+                with_props = []
+                for (ssid, reason, props, builderNames), my_props in \
+                        zip(buildsets, all_props):
+                    with_props.append((ssid, reason, my_props, builderNames))
+                return base_class.create_buildsets(self, with_props, t)
+
     # Copy the original class' name so that buildbot's ComparableMixin works
     S.__name__ = base_class.__name__ + "-props"
 
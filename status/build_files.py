@@ -0,0 +1,94 @@
+"""
+Helpers for post-build tools that read finished builds from disk.
+
+Build pickles contain the full status of a build, including the state of every
+step's logs.  Most of the post-build tasks (statusdb import, pulse messages)
+only need the build properties and step metadata, so loadBuild can skip the
+log state while unpickling, and a compact JSON summary of the build can be
+written next to the pickle when the build finishes.
+"""
+import os
+import cPickle
+
+from buildbot.status.builder import BuildStepStatus
+from buildbot.util import json
+
+# Named like build logs (<number>-<name>), so that buildbot prunes summaries
+# along with the old builds' logs
+SUMMARY_SUFFIX = '-summary.json'
+
+
+def _loadWithoutStepLogs(f):
+    """Unpickles a build from f, dropping the log state of its steps in the
+    same way update_from_files.py does.  The original __setstate__ is
+    restored afterwards."""
+    orig_setstate = BuildStepStatus.__dict__['__setstate__']
+
+    def buildstep_setstate(self, state):
+        state['logs'] = []
+        orig_setstate(self, state)
+
+    BuildStepStatus.__setstate__ = buildstep_setstate
+    try:
+        return cPickle.load(f)
+    finally:
+        BuildStepStatus.__setstate__ = orig_setstate
+
+
+def loadBuild(build_path, logs=True):
+    """Loads the build pickle at build_path and attaches a fake builder
+    pointing at its directory.  If logs is False, the steps' logs are not
+    loaded."""
+    if not os.path.exists(build_path):
+        raise ValueError("Couldn't find %s" % build_path)
+
+    builder_path = os.path.dirname(build_path)
+
+    class FakeBuilder:
+        basedir = builder_path
+        name = os.path.basename(builder_path)
+
+    f = open(build_path)
+    try:
+        if logs:
+            build = cPickle.load(f)
+        else:
+            build = _loadWithoutStepLogs(f)
+    finally:
+        f.close()
+    build.builder = FakeBuilder()
+    return build
+
+
+def summaryPath(build_path):
+    return build_path + SUMMARY_SUFFIX
+
+
+def writeBuildSummary(build, build_path):
+    """Writes a JSON summary of build (its asDict() output) next to the build
+    pickle at build_path"""
+    summary = {
+        'builder': build.getBuilder().getName(),
+        'number': build.getNumber(),
+        'build': build.asDict(),
+    }
+    path = summaryPath(build_path)
+    tmp_path = path + '.tmp'
+    f = open(tmp_path, 'w')
+    try:
+        json.dump(summary, f)
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+
+
+def loadBuildSummary(build_path):
+    """Returns the summary written by writeBuildSummary for the build pickle
+    at build_path, or None if there isn't a usable one"""
+    path = summaryPath(build_path)
+    if not os.path.exists(path):
+        return None
+    try:
+        return json.load(open(path))
+    except ValueError:
+        return None
@@ -10,8 +10,9 @@ from buildbot.status import base
 from buildbot.status.builder import FAILURE, HEADER
 import buildbot.scripts.checkconfig as checkconfig
 
+from buildbotcustom.reloader import reloadIfChanged
 import model
-reload(model)
+reloadIfChanged(model)
 
 
 class DBBuildStatus(base.StatusReceiver):
@@ -1,18 +1,33 @@
 import os
+import time
 import subprocess
-import tempfile
+from collections import deque
 
 from twisted.python import log as twlog
 from twisted.python import failure
-from twisted.internet import defer, reactor
+from twisted.python.threadpool import ThreadPool
+from twisted.internet import defer, reactor, threads
+from twisted.internet.threads import deferToThreadPool
 
 from buildbot.status import base
 
 
 class ThreadedLogHandler(base.StatusReceiverMultiService):
-    compare_attrs = ['categories', 'builders']
-
-    def __init__(self, categories=None, builders=None):
+    """
+    Calls handleLogs for finished builds from a thread pool of its own, so
+    that a burst of finished builds can't tie up the reactor's thread pool.
+
+    At most `concurrency` builds (default 2) are handled at once.  Up to
+    `max_queued` more (default 100) wait in a queue; when it is full, the
+    `overflow` policy decides which build is dropped: 'drop-new' (the
+    default) drops the build that just finished, 'drop-old' drops the one
+    that has been waiting longest.
+    """
+    compare_attrs = ['categories', 'builders', 'concurrency', 'max_queued',
+                     'overflow']
+
+    def __init__(self, categories=None, builders=None, concurrency=2,
+                 max_queued=100, overflow='drop-new'):
         base.StatusReceiverMultiService.__init__(self)
 
         self.categories = categories
@@ -23,8 +38,22 @@ class ThreadedLogHandler(base.StatusReceiverMultiService):
             twlog.err("Please specify only builders to ignore or categories to include")
             raise ValueError("Please specify only builders or categories")
 
+        if overflow not in ('drop-new', 'drop-old'):
+            raise ValueError("overflow must be 'drop-new' or 'drop-old'")
+
         self.watched = []
 
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.overflow = overflow
+        self.pool = ThreadPool(minthreads=0, maxthreads=concurrency,
+                               name=self.__class__.__name__)
+        # (builder, build, results, time queued)
+        self.queued = deque()
+        self.running = 0
+        self.stats = {'handled': 0, 'dropped': 0, 'total_wait': 0.0,
+                      'max_wait': 0.0}
+
     def setServiceParent(self, parent):
         base.StatusReceiverMultiService.setServiceParent(self, parent)
         self.setup()
@@ -32,6 +61,8 @@ class ThreadedLogHandler(base.StatusReceiverMultiService):
     def setup(self):
         self.master_status = self.parent.getStatus()
         self.master_status.subscribe(self)
+        if not self.pool.started or self.pool.joined:
+            self.pool.start()
 
     def disownServiceParent(self):
         self.master_status.unsubscribe(self)
@@ -40,7 +71,19 @@ class ThreadedLogHandler(base.StatusReceiverMultiService):
         return base.StatusReceiverMultiService.disownServiceParent(self)
 
     def stopService(self):
-        base.StatusReceiverMultiService.stopService(self)
+        if self.queued:
+            twlog.msg("%s: dropping %i queued builds" %
+                      (self.__class__.__name__, len(self.queued)))
+            self.queued.clear()
+        # Wait for builds we're handling.  Joining the pool's threads can take
+        # as long as the slowest handleLogs, so do it off the reactor thread
+        if self.pool.started and not self.pool.joined:
+            d = threads.deferToThread(self.pool.stop)
+        else:
+            d = defer.succeed(None)
+        d.addCallback(
+            lambda _: base.StatusReceiverMultiService.stopService(self))
+        return d
 
     def builderAdded(self, name, builder):
         # only subscribe to builders we are interested in
@@ -61,18 +104,77 @@ class ThreadedLogHandler(base.StatusReceiverMultiService):
                 builder.category not in self.categories:
             return  # ignore this build
 
-        reactor.callInThread(self.handleLogs, builder, build, results)
+        self.queueBuild(builder, build, results)
+
+    def queueBuild(self, builder, build, results):
+        if len(self.queued) >= self.max_queued:
+            if self.overflow == 'drop-old':
+                dropped = self.queued.popleft()[1]
+            else:
+                dropped = build
+            self.stats['dropped'] += 1
+            twlog.msg("%s: queue is full, dropping %s build %i" %
+                      (self.__class__.__name__,
+                       dropped.getBuilder().getName(), dropped.getNumber()))
+            if dropped is build:
+                return
+        self.queued.append((builder, build, results, time.time()))
+        self.runQueued()
+
+    def runQueued(self):
+        while self.queued and self.running < self.concurrency:
+            builder, build, results, queued = self.queued.popleft()
+            wait = time.time() - queued
+            self.stats['handled'] += 1
+            self.stats['total_wait'] += wait
+            self.stats['max_wait'] = max(self.stats['max_wait'], wait)
+            twlog.msg("%s: handling %s build %i after waiting %.2fs; "
+                      "%i builds queued" %
+                      (self.__class__.__name__, builder.getName(),
+                       build.getNumber(), wait, len(self.queued)))
+
+            self.running += 1
+            d = deferToThreadPool(reactor, self.pool, self.handleLogs,
+                                  builder, build, results)
+            d.addErrback(twlog.err)
+            d.addBoth(self._handled)
+
+    def _handled(self, _):
+        self.running -= 1
+        self.runQueued()
+
+    def getStats(self):
+        """Returns counts of handled and dropped builds, how many builds are
+        queued and running, and the average and maximum time builds spent in
+        the queue"""
+        retval = dict(self.stats)
+        retval['queued'] = len(self.queued)
+        retval['running'] = self.running
+        if self.stats['handled']:
+            retval['mean_wait'] = \
+                self.stats['total_wait'] / self.stats['handled']
+        else:
+            retval['mean_wait'] = 0.0
+        return retval
 
     def handleLogs(self, builder, build, results):
         pass
 
 
 class SubprocessLogHandler(ThreadedLogHandler):
-    compare_attrs = ['command', 'categories', 'builders']
-
-    def __init__(self, command, categories=None, builders=None):
-        ThreadedLogHandler.__init__(self, categories, builders)
+    """
+    Runs `command` with the builder's directory and the build number for
+    finished builds.  The command's output is logged as it is produced, up
+    to `max_output` bytes (default 64k); the rest is discarded.
+    """
+    compare_attrs = ThreadedLogHandler.compare_attrs + ['command',
+                                                        'max_output']
+
+    def __init__(self, command, categories=None, builders=None,
+                 max_output=64 * 1024, **kwargs):
+        ThreadedLogHandler.__init__(self, categories, builders, **kwargs)
         self.command = command
+        self.max_output = max_output
 
     def handleLogs(self, builder, build, results):
         if isinstance(self.command, str):
@@ -85,15 +187,28 @@ class SubprocessLogHandler(ThreadedLogHandler):
 
         properties = build.getProperties()
         cmd = properties.render(cmd)
-        output = tempfile.TemporaryFile()
 
         try:
             twlog.msg("Running %s" % cmd)
-            subprocess.check_call(cmd, stdout=output, stderr=subprocess.STDOUT)
-            output.seek(0)
-            twlog.msg("Log output: %s" % output.read())
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT)
+            logged = 0
+            discarded = 0
+            for line in iter(proc.stdout.readline, ''):
+                if logged < self.max_output:
+                    keep = line[:self.max_output - logged]
+                    logged += len(keep)
+                    discarded += len(line) - len(keep)
+                    twlog.msg("Log output: %s" % keep.rstrip("\n"))
+                else:
+                    discarded += len(line)
+            proc.stdout.close()
+            if discarded:
+                twlog.msg("Log output truncated; discarded %i bytes" %
+                          discarded)
+            retcode = proc.wait()
+            if retcode != 0:
+                raise subprocess.CalledProcessError(retcode, cmd)
         except:
             twlog.msg("Error running %s" % cmd)
-            output.seek(0)
-            twlog.msg("Log output: %s" % output.read())
             twlog.err()
@@ -1,10 +1,17 @@
+import time
+import smtplib
+import threading
+
 from email.message import Message
 from email.utils import formatdate
 
 from zope.interface import implements
-from twisted.internet import defer
+from twisted.internet import defer, reactor, threads
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThreadPool
 from twisted.mail.smtp import sendmail
 from twisted.python import log as twlog, failure
+from twisted.python.threadpool import ThreadPool
 
 from buildbot import interfaces
 from buildbot.status import base
@@ -20,6 +27,120 @@ class MercurialEmailLookup:
         return user
 
 
+class PooledSMTPSender(object):
+    """
+    Sends mail over persistent SMTP connections.
+
+    Up to `maxConnections` messages are sent at once, each from a thread of
+    our own thread pool.  Connections are reused for later messages, and are
+    closed once they have been idle for `idleTimeout` seconds.  Talking to
+    the server gives up after `timeout` seconds.
+    """
+
+    def __init__(self, relayhost, port=25, maxConnections=2, idleTimeout=60,
+                 smtpUser=None, smtpPassword=None, timeout=60):
+        self.relayhost = relayhost
+        self.port = port
+        self.timeout = timeout
+        self.maxConnections = maxConnections
+        self.idleTimeout = idleTimeout
+        self.smtpUser = smtpUser
+        self.smtpPassword = smtpPassword
+
+        self.pool = ThreadPool(minthreads=0, maxthreads=maxConnections,
+                               name='PooledSMTPSender')
+        # (time last used, connection)
+        self.idle = []
+        self.lock = threading.Lock()
+        self.reaper = LoopingCall(self.closeIdle)
+        self.connections_opened = 0
+
+    def start(self):
+        if not self.pool.started or self.pool.joined:
+            self.pool.start()
+        if not self.reaper.running:
+            self.reaper.start(max(self.idleTimeout / 2.0, 1), now=False)
+
+    def stop(self):
+        """Waits for the messages being sent and closes our connections.
+        That can take a while, so it's done off the reactor thread; returns a
+        Deferred that fires when it's done."""
+        if self.reaper.running:
+            self.reaper.stop()
+        return threads.deferToThread(self._stop)
+
+    def _stop(self):
+        if self.pool.started and not self.pool.joined:
+            self.pool.stop()
+        self._close(0)
+
+    def sendmail(self, fromaddr, recipients, msg):
+        """Sends msg, returning a Deferred that fires when it's done"""
+        return deferToThreadPool(reactor, self.pool, self._sendmail,
+                                 fromaddr, recipients, msg)
+
+    def closeIdle(self):
+        return deferToThreadPool(reactor, self.pool, self._close,
+                                 self.idleTimeout)
+
+    def _connect(self):
+        conn = smtplib.SMTP(self.relayhost, self.port, timeout=self.timeout)
+        if self.smtpUser:
+            conn.login(self.smtpUser, self.smtpPassword)
+        self.connections_opened += 1
+        return conn
+
+    def _getConnection(self):
+        self.lock.acquire()
+        try:
+            if self.idle:
+                return self.idle.pop()[1]
+        finally:
+            self.lock.release()
+        return self._connect()
+
+    def _releaseConnection(self, conn):
+        self.lock.acquire()
+        try:
+            self.idle.append((time.time(), conn))
+        finally:
+            self.lock.release()
+
+    def _sendmail(self, fromaddr, recipients, msg):
+        # These are called from our thread pool
+        conn = self._getConnection()
+        try:
+            try:
+                conn.sendmail(fromaddr, recipients, msg)
+            except smtplib.SMTPServerDisconnected:
+                # The server dropped our idle connection; try a new one
+                conn = self._connect()
+                conn.sendmail(fromaddr, recipients, msg)
+        except:
+            try:
+                conn.close()
+            except:
+                pass
+            raise
+        self._releaseConnection(conn)
+
+    def _close(self, maxIdle):
+        """Closes connections that have been idle for more than maxIdle
+        seconds"""
+        now = time.time()
+        self.lock.acquire()
+        try:
+            old = [c for t, c in self.idle if now - t >= maxIdle]
+            self.idle = [(t, c) for t, c in self.idle if now - t < maxIdle]
+        finally:
+            self.lock.release()
+        for conn in old:
+            try:
+                conn.quit()
+            except:
+                conn.close()
+
+
 def defaultChangeMessage(change):
     revision = change.revision
     msgdict = {"type": "plain"}
@@ -28,17 +149,32 @@ def defaultChangeMessage(change):
 
 
 class ChangeNotifier(base.StatusReceiverMultiService):
+    """
+    Sends mail about new changes.
+
+    If `smtpMaxConnections` is set, mail is sent by a PooledSMTPSender with
+    that many persistent connections, which are closed after
+    `smtpIdleTimeout` seconds of inactivity.
+
+    If `digestDelay` is set, changes to the same branch that go to the same
+    recipients within `digestDelay` seconds of the first one are sent as one
+    message, with at most `digestMaxChanges` changes per message.  The
+    message uses the subject and headers of the last change, e.g. the tip of
+    a push, and lists all the changes.
+    """
     compare_attrs = ('fromaddr', 'categories', 'branches', 'subject',
                      'relayhost', 'lookup', 'extraRecipients', 'sendToInterestedUsers',
                      'messageFormatter', 'extraHeaders', 'smtpUser', 'smtpPassword',
-                     'smtpPort', 'changeIsImportant')
+                     'smtpPort', 'changeIsImportant', 'smtpMaxConnections',
+                     'smtpIdleTimeout', 'digestDelay', 'digestMaxChanges')
 
     def __init__(self, fromaddr, categories=None, branches=None,
                  subject="Notifcation of change %(revision)s on branch %(branch)s",
                  relayhost="localhost", lookup=None, extraRecipients=None,
                  sendToInterestedUsers=True, messageFormatter=defaultChangeMessage,
                  extraHeaders=None, smtpUser=None, smtpPassword=None, smtpPort=25,
-                 changeIsImportant=None):
+                 changeIsImportant=None, smtpMaxConnections=None,
+                 smtpIdleTimeout=60, digestDelay=None, digestMaxChanges=50):
 
         base.StatusReceiverMultiService.__init__(self)
 
@@ -77,6 +213,19 @@ class ChangeNotifier(base.StatusReceiverMultiService):
         # you should either limit on branches or categories, not both
         assert not (self.branches != None and self.categories != None)
 
+        self.smtpMaxConnections = smtpMaxConnections
+        self.smtpIdleTimeout = smtpIdleTimeout
+        self.sender = None
+        if smtpMaxConnections:
+            self.sender = PooledSMTPSender(
+                relayhost, smtpPort, smtpMaxConnections, smtpIdleTimeout,
+                smtpUser, smtpPassword)
+
+        self.digestDelay = digestDelay
+        self.digestMaxChanges = digestMaxChanges
+        # (branch, To, CC) -> (recipients, [(msgdict, change)], DelayedCall)
+        self.digests = {}
+
     def setServiceParent(self, parent):
         """
         @type  parent: L{buildbot.master.BuildMaster}
@@ -87,11 +236,23 @@ class ChangeNotifier(base.StatusReceiverMultiService):
     def setup(self):
         self.master_status = self.parent.getStatus()
         self.master_status.subscribe(self)
+        if self.sender:
+            self.sender.start()
 
     def disownServiceParent(self):
         self.master_status.unsubscribe(self)
         return base.StatusReceiverMultiService.disownServiceParent(self)
 
+    def stopService(self):
+        # Send any digests we're holding on to now
+        dl = [self.sendDigest(key) for key in self.digests.keys()]
+        d = defer.DeferredList(dl)
+        if self.sender:
+            d.addCallback(lambda _: self.sender.stop())
+        d.addCallback(
+            lambda _: base.StatusReceiverMultiService.stopService(self))
+        return d
+
     def changeAdded(self, change):
         if self.branches and change.branch not in self.branches:
             return
@@ -155,10 +316,39 @@ class ChangeNotifier(base.StatusReceiverMultiService):
 
         return m
 
+    def createDigestEmail(self, entries):
+        """Returns one message covering the (msgdict, change) pairs in
+        entries"""
+        if len(entries) == 1:
+            return self.createEmail(*entries[0])
+
+        msgdict, change = entries[-1]
+        msgdict = msgdict.copy()
+        if 'subject' in msgdict:
+            subject = msgdict['subject']
+        else:
+            subject = self.subject % change.asDict()
+        msgdict['subject'] = "%s (%i changes)" % (subject, len(entries))
+
+        lines = ["", "This message covers %i changes:" % len(entries)]
+        for _, c in entries:
+            comments = (c.comments or '').strip().split("\n")[0]
+            lines.append("%s - %s: %s" % (c.revision, c.who, comments))
+        if msgdict['type'] == 'html':
+            sep = "<br>\n"
+        else:
+            sep = "\n"
+        msgdict['body'] = msgdict['body'] + sep.join(lines) + "\n"
+        return self.createEmail(msgdict, change)
+
     def buildMessage(self, change):
         msgdict = self.messageFormatter(change)
 
-        m = self.createEmail(msgdict, change)
+        if self.digestDelay:
+            # The message is created when the digest is sent
+            m = None
+        else:
+            m = self.createEmail(msgdict, change)
 
         # now, who is this message going to?
         dl = []
@@ -168,10 +358,51 @@ class ChangeNotifier(base.StatusReceiverMultiService):
             d.addCallback(recipients.append)
             dl.append(d)
         d = defer.DeferredList(dl)
-        d.addCallback(self._gotRecipients, recipients, m)
+        if m is None:
+            d.addCallback(self._gotDigestRecipients, recipients, msgdict,
+                          change)
+        else:
+            d.addCallback(self._gotRecipients, recipients, m)
         return d
 
     def _gotRecipients(self, res, rlist, m):
+        to, cc, recipients = self._getRecipients(rlist)
+        if cc is not None:
+            m['CC'] = cc
+        m['To'] = to
+        return self.sendMessage(m, recipients)
+
+    def _gotDigestRecipients(self, res, rlist, msgdict, change):
+        to, cc, recipients = self._getRecipients(rlist)
+        key = (change.branch, to, cc)
+        if key not in self.digests:
+            timer = reactor.callLater(self.digestDelay, self.sendDigest, key)
+            self.digests[key] = (recipients, [], timer)
+        entries = self.digests[key][1]
+        entries.append((msgdict, change))
+        if len(entries) >= self.digestMaxChanges:
+            return self.sendDigest(key)
+
+    def sendDigest(self, key):
+        recipients, entries, timer = self.digests.pop(key)
+        if timer.active():
+            timer.cancel()
+        try:
+            m = self.createDigestEmail(entries)
+        except:
+            twlog.err(failure.Failure(), 'creating digest for %s' % (key,))
+            return defer.succeed(None)
+        to, cc = key[1:]
+        if cc is not None:
+            m['CC'] = cc
+        m['To'] = to
+        d = self.sendMessage(m, recipients)
+        d.addErrback(twlog.err, 'sending digest for %s' % (key,))
+        return d
+
+    def _getRecipients(self, rlist):
+        """Returns the To and CC headers (CC may be None), and the list of
+        addresses to send the message to"""
         recipients = set()
 
         for r in rlist:
@@ -191,26 +422,29 @@ class ChangeNotifier(base.StatusReceiverMultiService):
         # if we're sending to interested users move the extra's to the CC
         # list so they can tell if they are also interested in the change
         # unless there are no interested users
+        cc = None
         if self.sendToInterestedUsers and len(recipients):
             extra_recips = self.extraRecipients[:]
             extra_recips.sort()
-            m['CC'] = ", ".join(extra_recips)
+            cc = ", ".join(extra_recips)
         else:
             [recipients.add(r) for r in self.extraRecipients[:]]
 
         rlist = list(recipients)
         rlist.sort()
-        m['To'] = ", ".join(rlist)
+        to = ", ".join(rlist)
 
         # The extras weren't part of the TO list so add them now
         if self.sendToInterestedUsers:
             for r in self.extraRecipients:
                 recipients.add(r)
 
-        return self.sendMessage(m, list(recipients))
+        return to, cc, list(recipients)
 
     def sendMessage(self, m, recipients):
         s = m.as_string()
         twlog.msg("sending mail (%d bytes) to" % len(s), recipients)
+        if self.sender:
+            return self.sender.sendmail(self.fromaddr, recipients, s)
         return sendmail(self.relayhost, self.fromaddr, recipients, s,
                         port=self.smtpPort)
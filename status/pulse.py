@@ -5,12 +5,15 @@ import re
 import os.path
 import time
 import traceback
+import gzip
+from cStringIO import StringIO
 
-from twisted.internet.threads import deferToThread
-from twisted.internet.defer import DeferredLock
+from twisted.internet.threads import deferToThread, deferToThreadPool
+from twisted.internet.defer import DeferredLock, DeferredList, succeed
 from twisted.internet.task import LoopingCall
 from twisted.internet import reactor
 from twisted.python import log
+from twisted.python.threadpool import ThreadPool
 
 from buildbot.status.status_push import StatusPush
 from buildbot.util import json
@@ -24,6 +27,39 @@ def hexid(obj):
     return '<%s>' % hex(id(obj))
 
 
+def _topicPatternRegex(pattern):
+    # Each word of the routing key is matched with a leading '.', so that '#'
+    # can match zero words
+    retval = []
+    for word in pattern.split('.'):
+        if word == '#':
+            retval.append(r'(?:\.[^.]+)*')
+        elif word == '*':
+            retval.append(r'\.[^.]+')
+        else:
+            retval.append(r'\.' + re.escape(word).replace(r'\*', '[^.]*'))
+    return ''.join(retval) + '$'
+
+
+def compileEventPatterns(patterns):
+    """Returns a regular expression matching routing keys that match any of
+    the given AMQP topic style patterns, or None if there aren't any.
+    Routing keys must be prefixed with '.' before matching."""
+    if not patterns:
+        return None
+    return re.compile("|".join("(?:%s)" % _topicPatternRegex(p)
+                               for p in patterns))
+
+
+def gzipData(data):
+    """Returns data compressed with gzip"""
+    buf = StringIO()
+    f = gzip.GzipFile(fileobj=buf, mode='wb')
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
 class PulseStatus(StatusPush):
     """
     Status pusher for Mozilla Pulse (an AMQP broker).
@@ -36,16 +72,61 @@ class PulseStatus(StatusPush):
 
     `send_logs`, if set, will enable sending log chunks to the message broker.
 
+    `events`, if set, is a list of patterns of routing keys to send.  Other
+    events are dropped before they're queued.  `ignoreEvents` is a list of
+    patterns of routing keys that should *NOT* be sent.  Patterns use AMQP
+    topic syntax: '*' matches exactly one word of the routing key, '#'
+    matches zero or more words.  e.g. 'build.*.*.finished' matches builds
+    finishing, 'build.#.log.#' matches all log events and 'slave.#' matches
+    all slave events.  '*' can also be used within a word, as in
+    'build.*-debug-*.#'.
+
     `heartbeat_time` (default 900) is how often we generate heartbeat events.
+
+    Events are written to the queuedir in batches.  A batch is written
+    `push_delay` seconds (default 10) after the first event is queued, or as
+    soon as `max_events` events (default 1000) are waiting.  A batch whose
+    serialized size is over `max_bytes` (default 1MB) is split across several
+    queuedir files.  If `compress` is set, each file is gzip compressed.
+
+    Serializing and writing batches happens in a dedicated worker thread;
+    `max_pending_writes` (default 2) limits how many batches can be waiting
+    for it, further events are held in our queue until it catches up.
+
+    When the service stops, queued events are written out by the worker
+    thread for at most `drain_timeout` seconds (default 30).  Whatever is
+    left after that is spilled to `recovery_file` (by default
+    pulse-recovery.json in the master's directory) as a single message in
+    queuedir format, which is written to the queuedir when we next start.
     """
 
     compare_attrs = StatusPush.compare_attrs + ['queuedir', 'ignoreBuilders',
-                                                'send_logs']
+                                                'send_logs', 'events',
+                                                'ignoreEvents', 'push_delay',
+                                                'max_events', 'max_bytes',
+                                                'compress',
+                                                'max_pending_writes',
+                                                'drain_timeout',
+                                                'recovery_file']
 
     def __init__(self, queuedir, ignoreBuilders=None, send_logs=False,
-                 heartbeat_time=900):
+                 heartbeat_time=900, push_delay=10, max_events=1000,
+                 max_bytes=1024 * 1024, compress=False, max_pending_writes=2,
+                 events=None, ignoreEvents=None, drain_timeout=30,
+                 recovery_file=None):
         self.queuedir = queuedir
         self.send_logs = send_logs
+        self.events = events
+        self.ignoreEvents = ignoreEvents
+        self._events_re = compileEventPatterns(events)
+        self._ignore_events_re = compileEventPatterns(ignoreEvents)
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.max_pending_writes = max_pending_writes
+        self.drain_timeout = drain_timeout
+        self.recovery_file = recovery_file
+        self._recovery_path = recovery_file
 
         self.ignoreBuilders = []
         if ignoreBuilders:
@@ -57,19 +138,40 @@ class PulseStatus(StatusPush):
                     self.ignoreBuilders.append(i)
         self.watched = []
 
+        # builderName -> escaped basename of the builder's directory
+        self._builder_names = {}
+
         # Set up heartbeat
         self.heartbeat_time = heartbeat_time
         self._heartbeat_loop = LoopingCall(self.heartbeat)
 
-        # Wait 10 seconds before sending our stuff
-        self.push_delay = 10
+        # Wait push_delay seconds before sending our stuff
+        self.push_delay = push_delay
         self.delayed_push = None
 
+        # Batches are serialized and written by a single worker thread
+        self._writer = ThreadPool(minthreads=1, maxthreads=1,
+                                  name='PulseStatus writer')
+        self._pending_writes = 0
+
+        self.stats = {'events': 0, 'bytes': 0, 'files': 0, 'errors': 0,
+                      'filtered': 0}
+        self._stats_start = time.time()
+        self._stats_window = (self._stats_start, 0, 0)
+
         StatusPush.__init__(self, PulseStatus.pushEvents, filter=False)
 
     def setServiceParent(self, parent):
         StatusPush.setServiceParent(self, parent)
 
+        if not self._writerRunning():
+            self._writer.start()
+
+        if self._recovery_path is None:
+            self._recovery_path = os.path.join(self.status.basedir,
+                                               'pulse-recovery.json')
+        self._replayRecoveryFile()
+
         # Start heartbeat
         # This should be done in startService, but our base class isn't
         # behaving
@@ -90,61 +192,260 @@ class PulseStatus(StatusPush):
         for w in self.watched:
             w.unsubscribe(self)
 
+        # This queues our shutdown event, and marks us as stopped
+        d = StatusPush.stopService(self)
+
         # Write out any pending events
         if self.delayed_push:
             self.delayed_push.cancel()
             self.delayed_push = None
 
+        return DeferredList([d, self._drain()])
+
+    def _writerRunning(self):
+        return self._writer.started and not self._writer.joined
+
+    def _drain(self):
+        """Writes out all our queued events from the writer thread, for up to
+        drain_timeout seconds.  Events that couldn't be written in time are
+        spilled to our recovery file.  Returns a Deferred that fires once
+        that's done."""
+        events = []
         while self.queue.nbItems() > 0:
-            self._do_push()
-        return StatusPush.stopService(self)
+            events.extend(self._popEvents())
+
+        if not self._writerRunning():
+            self._spillEvents(events)
+            return succeed(None)
+
+        log.msg("Pulse %s: draining %i events" % (hexid(self), len(events)))
+        deadline = time.time() + self.drain_timeout
+        d = deferToThreadPool(reactor, self._writer, self._drainEvents,
+                              events, deadline)
+
+        def drained(remaining):
+            self._writer.stop()
+            # Failed writes from before we started draining are put back in
+            # our queue
+            while self.queue.nbItems() > 0:
+                remaining.extend(self._popEvents())
+            self._spillEvents(remaining)
+
+        def failed(failure):
+            log.err(failure, "Pulse %s: failed to drain events" %
+                    (hexid(self),))
+            drained(events)
+        d.addCallbacks(drained, failed)
+        return d
+
+    def _drainEvents(self, events, deadline):
+        """Writes events in batches until they're all written or deadline
+        has passed.  Returns the events that weren't written.
+
+        This is called from the writer thread."""
+        while events and time.time() < deadline:
+            batch = events[:self.max_events]
+            try:
+                self._writeEvents(batch)
+            except:
+                log.err()
+                break
+            events = events[self.max_events:]
+        return events
+
+    def _spillEvents(self, events):
+        """Adds events to our recovery file"""
+        if not events:
+            return
+        if not self._recovery_path:
+            log.msg("Pulse %s: no recovery file; %i events lost" %
+                    (hexid(self), len(events)))
+            return
+        log.msg("Pulse %s: spilling %i events to %s" %
+                (hexid(self), len(events), self._recovery_path))
+        try:
+            if os.path.exists(self._recovery_path):
+                events = json.load(open(self._recovery_path)) + events
+            tmp_file = self._recovery_path + '.tmp'
+            f = open(tmp_file, 'w')
+            try:
+                json.dump(events, f)
+            finally:
+                f.close()
+            os.rename(tmp_file, self._recovery_path)
+        except:
+            log.msg("Pulse %s: failed to spill events; %i events lost" %
+                    (hexid(self), len(events)))
+            log.err()
+
+    def _replayRecoveryFile(self):
+        """Writes the events spilled to our recovery file when we were last
+        stopped to the queuedir"""
+        if not os.path.exists(self._recovery_path):
+            return
+        try:
+            events = json.load(open(self._recovery_path))
+            os.unlink(self._recovery_path)
+        except:
+            log.msg("Pulse %s: couldn't load %s" %
+                    (hexid(self), self._recovery_path))
+            log.err()
+            return
+        log.msg("Pulse %s: replaying %i events from %s" %
+                (hexid(self), len(events), self._recovery_path))
+        # Bypass our queue, these are already in their final form
+        d = deferToThreadPool(reactor, self._writer, self._writeEvents, events)
+        d.addCallbacks(self._pushed, self._spillFailed,
+                       callbackArgs=(events,), errbackArgs=(events,))
+
+    def _spillFailed(self, failure, events):
+        self.stats['errors'] += 1
+        log.err(failure)
+        self._spillEvents(events)
 
     def pushEvents(self):
         """Trigger a push"""
-        if not self.delayed_push:
+        # We're draining our queue, see stopService
+        if self.stopped:
+            return
+
+        if self.queue.nbItems() >= self.max_events:
+            # We've got a full batch already; don't wait for it
+            if self.delayed_push and \
+                    self.delayed_push.getTime() > reactor.seconds():
+                self.delayed_push.cancel()
+                self.delayed_push = None
+            if not self.delayed_push:
+                self.delayed_push = reactor.callLater(0, self._do_push)
+        elif not self.delayed_push:
             self.delayed_push = reactor.callLater(
                 self.push_delay, self._do_push)
 
-    def _do_push(self):
-        """Push some events to pulse"""
-        self.delayed_push = None
+    def _wantEvent(self, event):
+        """Returns whether event passes our events/ignoreEvents filters"""
+        key = '.' + event
+        if (self._events_re and not self._events_re.match(key)) or \
+                (self._ignore_events_re and self._ignore_events_re.match(key)):
+            self.stats['filtered'] += 1
+            return False
+        return True
+
+    def push(self, event, **objs):
+        # Filter before the base class turns objs into dicts
+        if not self._wantEvent(event):
+            return
+        return self._pushWanted(event, **objs)
 
-        # Get the events
-        events = self.queue.popChunk()
+    def _pushWanted(self, event, **objs):
+        """Pushes an event that has already passed _wantEvent"""
+        retval = StatusPush.push(self, event, **objs)
+        if self.queue.nbItems() >= self.max_events:
+            self.pushEvents()
+        return retval
 
-        # Nothing to do!
+    def _popEvents(self):
+        """Pops the next batch of events from the queue, and adds our master
+        information to them"""
+        events = self.queue.popChunk(self.max_events)
         if not events:
-            return
+            return []
 
-        # List of json-encodable messages to write to queuedir
-        to_write = []
         start = time.time()
-        count = 0
         heartbeats = 0
         for e in events:
-            count += 1
             if e['event'] == 'heartbeat':
                 heartbeats += 1
 
             e['master_name'] = self.status.botmaster.master_name
             e['master_incarnation'] = \
                 self.status.botmaster.master_incarnation
-
-            # Transform time tuples to standard pulse time format
-            to_write.append(e)
         end = time.time()
         log.msg("Pulse %s: Processed %i events (%i heartbeats) "
                 "in %.2f seconds" %
-               (hexid(self), count, heartbeats, (end - start)))
-        try:
-            self.queuedir.add(json.dumps(to_write))
-        except:
-            # Try again later?
-            self.queue.insertBackChunk(events)
-            log.err()
-
+               (hexid(self), len(events), heartbeats, (end - start)))
+        return events
+
+    def _serialize(self, events):
+        data = json.dumps(events)
+        if self.compress:
+            data = gzipData(data)
+        return data
+
+    def _writeEvents(self, events):
+        """Writes events to the queuedir, splitting them across several files
+        if they're bigger than max_bytes.  Returns the number of files and
+        bytes written.
+
+        This is called from the writer thread, so mustn't touch anything
+        other than the queuedir."""
+        data = self._serialize(events)
+        if len(data) > self.max_bytes and len(events) > 1:
+            half = len(events) // 2
+            files1, bytes1 = self._writeEvents(events[:half])
+            files2, bytes2 = self._writeEvents(events[half:])
+            return files1 + files2, bytes1 + bytes2
+        self.queuedir.add(data)
+        return 1, len(data)
+
+    def _pushed(self, result, events):
+        files, nbytes = result
+        self.stats['events'] += len(events)
+        self.stats['bytes'] += nbytes
+        self.stats['files'] += files
+
+    def _pushFailed(self, failure, events):
+        # Try again later?
+        self.stats['errors'] += 1
+        self.queue.insertBackChunk(events)
+        log.err(failure)
+
+    def _writeDone(self, _):
+        self._pending_writes -= 1
         # If we still have more stuff, send it in a bit
-        if self.queue.nbItems() > 0:
+        if self.queue.nbItems() > 0 and not self.stopped:
+            self.pushEvents()
+
+    def getStats(self):
+        """Returns our counters, the current queue depth, and the rate of
+        events and bytes written since the last call"""
+        now = time.time()
+        since, events, nbytes = self._stats_window
+        elapsed = max(now - since, 0.001)
+        retval = dict(self.stats)
+        retval['queue_depth'] = self.queue.nbItems()
+        retval['pending_writes'] = self._pending_writes
+        retval['events_per_sec'] = (self.stats['events'] - events) / elapsed
+        retval['bytes_per_sec'] = (self.stats['bytes'] - nbytes) / elapsed
+        self._stats_window = (now, self.stats['events'], self.stats['bytes'])
+        return retval
+
+    def _do_push(self):
+        """Push some events to pulse"""
+        self.delayed_push = None
+
+        # We're draining our queue, see stopService
+        if self.stopped:
+            return
+
+        # The writer is busy; we'll be called again when it catches up
+        if self._pending_writes >= self.max_pending_writes:
+            return
+
+        # Nothing to do!
+        if not self.queue.nbItems():
+            return
+
+        # Get the events
+        events = self._popEvents()
+
+        self._pending_writes += 1
+        d = deferToThreadPool(reactor, self._writer, self._writeEvents, events)
+        d.addCallbacks(self._pushed, self._pushFailed,
+                       callbackArgs=(events,), errbackArgs=(events,))
+        d.addBoth(self._writeDone)
+
+        # Start on the next batch if we've got one ready
+        if self.queue.nbItems() >= self.max_events:
             self.pushEvents()
 
     def builderAdded(self, builderName, builder):
@@ -163,6 +464,7 @@ class PulseStatus(StatusPush):
                 self.stopService()
                 if self.parent:
                     self.disownServiceParent()
+        self._builder_names.pop(builderName, None)
         self.watched.append(builder)
         return self
 
@@ -170,6 +472,15 @@ class PulseStatus(StatusPush):
         builder = self.status.getBuilder(builderName)
         return os.path.basename(builder.basedir)
 
+    def _escapedBuilderName(self, builderName):
+        """Returns the escaped name used for builderName in routing keys"""
+        try:
+            return self._builder_names[builderName]
+        except KeyError:
+            name = escape(self._translateBuilderName(builderName))
+            self._builder_names[builderName] = name
+            return name
+
     def heartbeat(self):
         """send a heartbeat event"""
         # We're called from inside a LoopingCall, so make sure we never leak an
@@ -177,6 +488,7 @@ class PulseStatus(StatusPush):
         # OH NOES!
         try:
             log.msg("Pulse %s: heartbeat" % (hexid(self),))
+            log.msg("Pulse %s: stats %s" % (hexid(self), self.getStats()))
             self.push("heartbeat")
         except:
             log.msg("Pulse %s: failed to send heartbeat" % (hexid(self),))
@@ -185,13 +497,13 @@ class PulseStatus(StatusPush):
     ### Events we publish
 
     def buildStarted(self, builderName, build):
-        builderName = escape(self._translateBuilderName(builderName))
+        builderName = self._escapedBuilderName(builderName)
         self.push("build.%s.%i.started" % (builderName, build.number),
                   build=build)
         return self
 
     def buildFinished(self, builderName, build, results):
-        builderName = escape(self._translateBuilderName(builderName))
+        builderName = self._escapedBuilderName(builderName)
         self.push("build.%s.%i.finished" % (builderName, build.number),
                   build=build, results=results)
 
@@ -207,44 +519,48 @@ class PulseStatus(StatusPush):
         self.push("change.%i.added" % change.number, change=change)
 
     def requestSubmitted(self, request):
-        builderName = escape(self._translateBuilderName(
-            request.getBuilderName()))
+        builderName = self._escapedBuilderName(request.getBuilderName())
         self.push("request.%s.submitted" % builderName, request=request)
 
     def requestCancelled(self, builder, request):
-        builderName = escape(self._translateBuilderName(builder.name))
+        builderName = self._escapedBuilderName(builder.name)
         self.push("request.%s.cancelled" % builderName, request=request)
 
     def stepStarted(self, build, step):
-        builderName = escape(self._translateBuilderName(build.builder.name))
-        self.push("build.%s.%i.step.%s.started" %
-                 (builderName, build.number, escape(step.name)),
-                  properties=build.getProperties().asList(),
-                  step=step)
+        builderName = self._escapedBuilderName(build.builder.name)
+        event = "build.%s.%i.step.%s.started" % \
+            (builderName, build.number, escape(step.name))
+        # Checked here to avoid getting the properties of unwanted events
+        if self._wantEvent(event):
+            self._pushWanted(event,
+                             properties=build.getProperties().asList(),
+                             step=step)
         # If logging is enabled, return ourself to subscribe to log events for
         # this step
         if self.send_logs:
             return self
 
     def stepFinished(self, build, step, results):
-        builderName = escape(self._translateBuilderName(build.builder.name))
-        self.push("build.%s.%i.step.%s.finished" %
-                 (builderName, build.number, escape(step.name)),
-                  properties=build.getProperties().asList(),
-                  step=step,
-                  results=results)
+        builderName = self._escapedBuilderName(build.builder.name)
+        event = "build.%s.%i.step.%s.finished" % \
+            (builderName, build.number, escape(step.name))
+        if self._wantEvent(event):
+            self._pushWanted(event,
+                             properties=build.getProperties().asList(),
+                             step=step,
+                             results=results)
 
     ### Optional logging events
 
     def logStarted(self, build, step, log):
-        builderName = escape(self._translateBuilderName(build.builder.name))
+        builderName = self._escapedBuilderName(build.builder.name)
         self.push("build.%s.%i.step.%s.log.%s.started" %
                  (builderName, build.number, escape(step.name), log.name))
         return self
 
     def logChunk(self, build, step, log, channel, text):
         # TODO: Strip out bad UTF-8 characters
-        builderName = escape(self._translateBuilderName(build.builder.name))
+        builderName = self._escapedBuilderName(build.builder.name)
         self.push("build.%s.%i.step.%s.log.%s.chunk" %
                  (builderName, build.number, escape(step.name), log.name),
                   channel=channel,
@@ -252,7 +568,7 @@ class PulseStatus(StatusPush):
                   )
 
     def logFinished(self, build, step, log):
-        builderName = escape(self._translateBuilderName(build.builder.name))
+        builderName = self._escapedBuilderName(build.builder.name)
         self.push("build.%s.%i.step.%s.log.%s.finished" %
                  (builderName, build.number, escape(step.name), log.name))
         return self
@@ -266,7 +582,7 @@ class PulseStatus(StatusPush):
         pass
 
     def builderRemoved(self, builderName):
-        pass
+        self._builder_names.pop(builderName, None)
 
     def stepETAUpdate(self, build, step, ETA, expectations):
         pass
@@ -5,20 +5,28 @@ from twisted.python import log as twlog
 from buildbot.status import base
 from buildbot.util import json
 
+from buildbotcustom.status.build_files import writeBuildSummary
+
 
 class QueuedCommandHandler(base.StatusReceiverMultiService):
     """
     Runs a command when a build finishes
+
+    If write_summary is set, a JSON summary of the build is written next to
+    the build pickle before the command is queued, so that the command can
+    avoid loading the pickle (see status/build_files.py)
     """
-    compare_attrs = ['command', 'categories', 'builders']
+    compare_attrs = ['command', 'categories', 'builders', 'write_summary']
 
-    def __init__(self, command, queuedir, categories=None, builders=None):
+    def __init__(self, command, queuedir, categories=None, builders=None,
+                 write_summary=False):
         base.StatusReceiverMultiService.__init__(self)
 
         self.command = command
         self.queuedir = queuedir
         self.categories = categories
         self.builders = builders
+        self.write_summary = write_summary
 
         # you should either limit on builders or categories, not both
         if self.builders != None and self.categories != None:
@@ -73,8 +81,13 @@ class QueuedCommandHandler(base.StatusReceiverMultiService):
         # Cap to the first 100 requests
         # If we have more than that....too bad
         requests = [str(r.id) for r in core_build.requests][:100]
-        cmd.extend([
-                   os.path.join(self.master_status.basedir,
-                                builder.basedir, str(build.number)),
-                   ] + requests)
+        build_path = os.path.join(self.master_status.basedir,
+                                  builder.basedir, str(build.number))
+        if self.write_summary:
+            try:
+                writeBuildSummary(build, build_path)
+            except Exception:
+                twlog.err(None, "Couldn't write build summary for %s" %
+                          build_path)
+        cmd.extend([build_path] + requests)
         self.queuedir.add(json.dumps(cmd))
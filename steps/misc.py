@@ -566,7 +566,9 @@ class RepackPartners(ShellCommand):
             properties = self.build.getProperties()
             if 'partner' in properties:
                 partner = properties['partner']
-                self.command.extend(['-p', partner])
+                # Don't change the command the step was made with, which
+                # other builds (and builders) use too
+                self.command = self.command + ['-p', partner]
         except:
             # No partner was specified, so repacking all partners.
             pass
@@ -4,8 +4,9 @@ from buildbot.status.builder import SUCCESS, WARNINGS, FAILURE, SKIPPED, \
     EXCEPTION
 
 from buildbotcustom.steps.base import ShellCommand
+from buildbotcustom.reloader import reloadIfChanged
 import buildbotcustom.steps.unittest
-reload(buildbotcustom.steps.unittest)
+reloadIfChanged(buildbotcustom.steps.unittest)
 from buildbotcustom.steps.unittest import emphasizeFailureText, summaryText
 
 # Wasn't able to get ShellCommandReportTimeout working; may try again
@@ -0,0 +1,103 @@
+from __future__ import with_statement
+import os
+import shutil
+from twisted.trial import unittest
+
+from buildbot.db import dbspec, connector
+from buildbot.db.schema.manager import DBSchemaManager
+from buildbot.process.properties import Properties
+from buildbot.sourcestamp import SourceStamp
+
+import mock
+
+from buildbotcustom.buildsets import create_buildsets, get_sourcestampids
+from buildbotcustom.l10n import TriggerableL10n
+
+
+class TestBuildsets(unittest.TestCase):
+    basedir = "test_buildsets"
+
+    def setUp(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        spec = dbspec.DBSpec.from_url("sqlite:///state.sqlite", self.basedir)
+        manager = DBSchemaManager(spec, self.basedir)
+        manager.upgrade()
+
+        self.dbc = connector.DBConnector(spec)
+        self.dbc.start()
+
+    def tearDown(self):
+        self.dbc.stop()
+        shutil.rmtree(self.basedir)
+
+    def dumpBuildsets(self):
+        """Returns what's in the database about our buildsets, without ids"""
+        retval = []
+        for bsid, reason, ssid in self.dbc.runQueryNow(
+                "SELECT id, reason, sourcestampid FROM buildsets ORDER BY id"):
+            props = self.dbc.runQueryNow(
+                "SELECT property_name, property_value FROM buildset_properties"
+                " WHERE buildsetid=%i ORDER BY property_name" % bsid)
+            names = self.dbc.runQueryNow(
+                "SELECT buildername FROM buildrequests"
+                " WHERE buildsetid=%i ORDER BY buildername" % bsid)
+            retval.append((reason, ssid, props, names))
+        return retval
+
+    def testSourcestampIds(self):
+        stamps = [SourceStamp(branch='b1'), SourceStamp(branch='b2'),
+                  SourceStamp(branch='b1'),
+                  SourceStamp(branch='b1', revision='r1')]
+        ssids = self.dbc.runInteractionNow(
+            lambda t: get_sourcestampids(self.dbc, t, stamps))
+        self.assertEquals(ssids[0], ssids[2])
+        self.assertEquals(len(set(ssids)), 3)
+
+    def testSameAsCreateBuildset(self):
+        ssid = self.dbc.runInteractionNow(lambda t: self.dbc.get_sourcestampid(
+            SourceStamp(branch='b1'), t))
+        buildsets = []
+        for i in range(3):
+            props = Properties()
+            props.setProperty('locale', 'l%i' % i, 'test')
+            buildsets.append((ssid, 'reason %i' % i, props, ['b1', 'b2']))
+        buildsets.append((ssid, 'no props', Properties(), []))
+
+        def create_one_at_a_time(t):
+            for ssid, reason, props, builderNames in buildsets:
+                self.dbc.create_buildset(ssid, reason, props, builderNames, t)
+        self.dbc.runInteractionNow(create_one_at_a_time)
+        expected = self.dumpBuildsets()
+        self.dbc.runQueryNow("DELETE FROM buildsets")
+        self.dbc.runQueryNow("DELETE FROM buildset_properties")
+        self.dbc.runQueryNow("DELETE FROM buildrequests")
+
+        with mock.patch.object(self.dbc, 'notify') as notify:
+            bsids = self.dbc.runInteractionNow(
+                lambda t: create_buildsets(self.dbc, t, buildsets))
+        self.assertEquals(self.dumpBuildsets(), expected)
+        self.assertEquals(len(bsids), 4)
+        self.assertEquals(notify.call_args_list[0][0],
+                          ("add-buildset", bsids[0]))
+        self.assertEquals(len(notify.call_args_list[-1][0]), 7)
+
+    def testL10nFanOut(self):
+        s = TriggerableL10n(name='l10n', builderNames=['repack'],
+                            platform='linux', branch='b1')
+        s.parent = mock.Mock()
+        s.parent.db = self.dbc
+        locales = {'en-US': [], 'de': [], 'fr': [], 'ja': ['win32'],
+                   'ja-JP-mac': ['osx']}
+        self.dbc.runInteractionNow(
+            lambda t: s._cbLoadedLocales(t, locales, 'reason', None))
+
+        buildsets = self.dumpBuildsets()
+        self.assertEquals(len(buildsets), 2)
+        # One sourcestamp for all the locales
+        self.assertEquals(len(set(b[1] for b in buildsets)), 1)
+        self.assertEquals(sorted(
+            [v for (n, v) in b[2] if n == 'locale'][0] for b in buildsets),
+            ['["de", "Scheduler"]', '["fr", "Scheduler"]'])
+        self.assertEquals(s.parent.publish_buildset.call_count, 2)
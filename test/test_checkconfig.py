@@ -0,0 +1,99 @@
+from twisted.trial import unittest
+
+from buildbot import locks
+from buildbot.process.factory import BuildFactory
+from buildbot.scheduler import Scheduler
+from buildbot.steps.shell import ShellCommand
+
+from buildbotcustom.checkconfig import runJobs, checkSummaries
+
+lock = locks.SlaveLock('clone', maxCount=1)
+otherLock = locks.SlaveLock('clone', maxCount=2)
+
+
+def generateObjects(branch, platforms, stepLock=lock, extraScheduled=[]):
+    builders = []
+    for p in platforms:
+        f = BuildFactory()
+        f.addStep(ShellCommand(command=['make'],
+                               locks=[stepLock.access('counting')]))
+        builders.append({
+            'name': '%s %s build' % (p, branch),
+            'builddir': '%s-%s' % (branch, p),
+            'slavenames': ['%s-slave' % p],
+            'factory': f,
+        })
+    builderNames = [b['name'] for b in builders] + extraScheduled
+    return {
+        'builders': builders,
+        'schedulers': [Scheduler(name=branch, branch=branch,
+                                 treeStableTimer=None,
+                                 builderNames=builderNames[1:])],
+        'status': [],
+    }
+
+
+def failingObjects(branch):
+    raise ValueError("no config for %s" % branch)
+
+
+class TestCheckConfig(unittest.TestCase):
+    def check(self, jobs, processes=1, slaves=None):
+        summaries = runJobs(jobs, processes)
+        self.assertEquals([s['name'] for s in summaries],
+                          [j[0] for j in jobs])
+        return summaries, checkSummaries(summaries, slaves)
+
+    def test_ok(self):
+        jobs = [(b, generateObjects, (b, ['linux', 'win32']), {})
+                for b in ('b1', 'b2')]
+        summaries, (errors, warnings) = self.check(jobs)
+        self.assertEquals(errors, [])
+        self.assertEquals(warnings, [
+            "some Builders have no Schedulers to drive them: "
+            "linux b1 build, linux b2 build"])
+        self.assertEquals(summaries[0]['builders'][1], {
+            'name': 'win32 b1 build',
+            'builddir': 'b1-win32',
+            'slavebuilddir': 'b1-win32',
+            'slavenames': ['win32-slave'],
+            'category': None,
+        })
+        self.assertEquals(summaries[0]['schedulers'], [
+            {'name': 'b1', 'builderNames': ['win32 b1 build']}])
+
+    def test_parallel(self):
+        jobs = [(b, generateObjects, (b, ['linux']), {})
+                for b in ('b1', 'b2', 'b3', 'b4')]
+        serial = runJobs(jobs, 1)
+        parallel = runJobs(jobs, 2)
+        for s in serial + parallel:
+            del s['time']
+        self.assertEquals(parallel, serial)
+
+    def test_errors(self):
+        jobs = [
+            ('b1', generateObjects, ('b1', ['linux']),
+             {'extraScheduled': ['nonexistent']}),
+            # Same builders and scheduler again
+            ('b1 again', generateObjects, ('b1', ['linux', 'win32']), {}),
+            ('b2', generateObjects, ('b2', ['linux']),
+             {'stepLock': otherLock}),
+            ('b3', failingObjects, ('b3',), {}),
+        ]
+        summaries, (errors, warnings) = self.check(jobs, 2,
+                                                   ['linux-slave'])
+        self.assert_(errors[0].startswith("b3: b3 failed:\nTraceback"))
+        self.assert_(errors[0].endswith("ValueError: no config for b3\n"))
+        self.assertEquals(errors[1:], [
+            "duplicate builder name linux b1 build (in b1 and b1 again)",
+            "builder linux b1 build (in b1 again) reuses builddir b1-linux "
+            "(from b1)",
+            "builder win32 b1 build (in b1 again) uses undefined slave "
+            "win32-slave",
+            "Two different locks (SlaveLock(clone, 2, {}) in b2 and "
+            "SlaveLock(clone, 1, {}) in b1) share the name clone",
+            "scheduler b1 (in b1) uses unknown builder nonexistent",
+            "Schedulers must have unique names, but 'b1' (in b1 and "
+            "b1 again) was a duplicate",
+        ])
@@ -0,0 +1,253 @@
+import os
+import re
+import imp
+import time
+import shutil
+from twisted.trial import unittest
+
+try:
+    import simplejson as json
+except ImportError:
+    import json
+
+command_runner = imp.load_source(
+    'command_runner',
+    os.path.join(os.path.dirname(__file__), '..', 'bin', 'command_runner.py'))
+
+
+class Options(object):
+    def __init__(self, queuedir, **kwargs):
+        self.queuedir = queuedir
+        self.concurrency = 1
+        self.type_limits = {}
+        self.priorities = []
+        self.retry_time = 60
+        self.max_retry_time = 3600
+        self.max_retries = 5
+        self.max_time = 3600
+        self.stats_file = None
+        self.stats_interval = 60
+        self.__dict__.update(kwargs)
+
+
+def sleepCommand(script, *args):
+    # Runs for long enough to still be running when we check; its type is
+    # script
+    return ['sh', '-c', 'exec sleep 30', script] + list(args)
+
+
+class TestCommandRunner(unittest.TestCase):
+    def setUp(self):
+        self.queuedir = os.path.abspath('commands')
+        if os.path.exists(self.queuedir):
+            shutil.rmtree(self.queuedir)
+        self.runner = None
+
+    def tearDown(self):
+        if self.runner:
+            self.runner.shutdown()
+
+    def makeRunner(self, **kwargs):
+        self.runner = command_runner.CommandRunner(
+            Options(self.queuedir, **kwargs))
+        # (item_id, delay, max_retries) of each requeue
+        self.requeued = []
+        requeue = self.runner.q.requeue
+
+        def recordRequeue(item_id, delay=None, max_retries=None):
+            self.requeued.append((item_id, delay, max_retries))
+            return requeue(item_id, delay, max_retries)
+        self.runner.q.requeue = recordRequeue
+        return self.runner
+
+    def add(self, cmd):
+        return self.runner.q.add(json.dumps(cmd))
+
+    def items(self, d):
+        return [i for i in os.listdir(os.path.join(self.queuedir, d))
+                if not i.startswith('.')]
+
+    def finishJobs(self, timeout=10):
+        end = time.time() + timeout
+        while self.runner.active and time.time() < end:
+            self.runner.monitor()
+            time.sleep(0.05)
+        self.assertEquals(self.runner.active, [])
+
+    def testPriorities(self):
+        runner = self.makeRunner(priorities=[(re.compile('try'), 10),
+                                             (re.compile('try-comm'), 5)])
+        first = self.add(['postrun.py', 'm-c'])
+        self.add(['postrun.py', 'try-comm'])
+        self.add(['postrun.py', 'm-i'])
+        self.assertEquals(runner.readQueue(), 3)
+        self.assertEquals([(j.cmd[1], j.priority) for j in runner.pending],
+                          [('try-comm', 10), ('m-c', 0), ('m-i', 0)])
+        self.assertEquals(runner.pending[1].item_id, first)
+
+    def testDuplicates(self):
+        runner = self.makeRunner()
+        self.add(sleepCommand('postrun.py', '1'))
+        self.add(sleepCommand('postrun.py', '1'))
+        self.assertEquals(runner.readQueue(), 1)
+        # Still a duplicate once it is running
+        runner.startJobs()
+        self.add(sleepCommand('postrun.py', '1'))
+        self.add(sleepCommand('postrun.py', '2'))
+        self.assertEquals(runner.readQueue(), 1)
+        self.assertEquals(runner.stats['duplicates'], 2)
+        self.assertEquals(len(self.items('cur')), 2)
+
+    def testInvalid(self):
+        runner = self.makeRunner()
+        runner.q.add('not json')
+        self.assertEquals(runner.readQueue(), 0)
+        self.assertEquals(runner.stats['invalid'], 1)
+        self.assertEquals(len(self.items('dead')), 1)
+        self.assertEquals(self.items('cur'), [])
+
+    def testLimits(self):
+        runner = self.makeRunner(concurrency=3, type_limits={'a.py': 1})
+        for i in range(3):
+            self.add(sleepCommand('a.py', str(i)))
+        self.add(sleepCommand('b.py'))
+        runner.readQueue()
+        runner.startJobs()
+        self.assertEquals(sorted(j.type for j in runner.active),
+                          ['a.py', 'b.py'])
+        self.assertEquals(len(runner.pending), 2)
+
+        # Other types can still start, up to the concurrency
+        self.add(sleepCommand('c.py'))
+        runner.readQueue()
+        runner.startJobs()
+        self.assertEquals(sorted(j.type for j in runner.active),
+                          ['a.py', 'b.py', 'c.py'])
+        runner.startJobs()
+        self.assertEquals(len(runner.active), 3)
+        self.assertEquals(runner.getStats()['running_by_type'],
+                          {'a.py': 1, 'b.py': 1, 'c.py': 1})
+
+    def testCompleted(self):
+        runner = self.makeRunner()
+        item_id = self.add(['true'])
+        runner.readQueue()
+        runner.startJobs()
+        self.finishJobs()
+        self.assertEquals(runner.stats['completed'], 1)
+        self.assertEquals(runner.commands, set())
+        self.assertEquals(self.items('cur'), [])
+        self.assertEquals(self.items('new'), [])
+        self.assertEquals(self.requeued, [])
+        log = open(os.path.join(self.queuedir, 'logs', item_id + '.log'))
+        self.assert_("Result: 0" in log.read())
+        log.close()
+
+    def testFailed(self):
+        runner = self.makeRunner(retry_time=10)
+        item_id = self.add(['false'])
+        runner.readQueue()
+        runner.startJobs()
+        self.finishJobs()
+        self.assertEquals(runner.stats['failed'], 1)
+        self.assertEquals(runner.failures, {json.dumps(['false']): 1})
+        self.assertEquals(self.requeued, [(item_id, 10, 5)])
+        # It isn't ready to run again yet
+        self.assertEquals(self.items('new'), [item_id])
+        self.assertEquals(runner.readQueue(), 0)
+
+    def testBackoff(self):
+        runner = self.makeRunner(retry_time=10, max_retry_time=50)
+        job = command_runner.Job(['false'], 'item')
+        other = command_runner.Job(['false', 'other'], 'other')
+        # Don't really requeue anything
+        runner.q.requeue = lambda *args: self.requeued.append(args)
+        for i in range(5):
+            runner.requeue(job)
+        runner.requeue(other)
+        self.assertEquals([r[1] for r in self.requeued],
+                          [10, 20, 40, 50, 50, 10])
+
+        # Success resets the backoff
+        runner.active.append(job)
+        job.started = time.time()
+        job.check = lambda: 0
+        runner.q.remove = lambda item_id: None
+        runner.q.touch = lambda item_id: None
+        runner.monitor()
+        runner.requeue(job)
+        self.assertEquals(self.requeued[-1][1], 10)
+
+    def testTooLong(self):
+        runner = self.makeRunner(max_time=60)
+        item_id = self.add(sleepCommand('a.py'))
+        runner.readQueue()
+        runner.startJobs()
+        job = runner.active[0]
+        job.started -= 61
+        runner.monitor()
+        self.assertEquals(runner.active, [])
+        self.assertNotEquals(job.proc.returncode, None)
+        self.assert_(job.log.closed)
+        self.assertEquals(runner.stats['failed'], 1)
+        self.assertEquals(self.requeued, [(item_id, 60, 5)])
+
+    def testStartError(self):
+        runner = self.makeRunner()
+        logs = []
+        getlog = runner.q.getlog
+
+        def recordLog(item_id):
+            logs.append(getlog(item_id))
+            return logs[-1]
+        runner.q.getlog = recordLog
+
+        fds = None
+        if os.path.isdir('/proc/self/fd'):
+            fds = len(os.listdir('/proc/self/fd'))
+        item_id = self.add(['/nonexistent/command'])
+        runner.readQueue()
+        runner.startJobs()
+        self.assertEquals(runner.active, [])
+        self.assertEquals(runner.commands, set())
+        self.assertEquals(self.requeued, [(item_id, 60, 5)])
+        self.assertEquals(len(logs), 1)
+        self.assert_(logs[0].closed)
+        if fds is not None:
+            self.assertEquals(len(os.listdir('/proc/self/fd')), fds)
+
+    def testStats(self):
+        stats_file = os.path.abspath('stats.json')
+        runner = self.makeRunner(stats_file=stats_file, concurrency=2,
+                                 type_limits={'a.py': 1})
+        self.add(['true'])
+        self.add(['false'])
+        runner.readQueue()
+        runner.startJobs()
+        self.finishJobs()
+        self.add(sleepCommand('a.py'))
+        self.add(sleepCommand('a.py', 'pending'))
+        runner.readQueue()
+        runner.startJobs()
+        runner.writeStats()
+
+        f = open(stats_file)
+        stats = json.load(f)
+        f.close()
+        self.assertEquals(stats['completed'], 1)
+        self.assertEquals(stats['failed'], 1)
+        self.assertEquals(stats['running'], 1)
+        self.assertEquals(stats['running_by_type'], {'a.py': 1})
+        self.assertEquals(stats['pending'], 1)
+        self.assert_(stats['oldest_pending_age'] >= 0)
+        self.assert_(stats['jobs_per_minute'] > 0)
+        self.assert_(stats['max_queue_age'] >= stats['mean_queue_age'] >= 0)
+
+        # Not written again until stats_interval has passed
+        os.unlink(stats_file)
+        runner.writeStats()
+        self.assertFalse(os.path.exists(stats_file))
+        runner.last_stats -= 60
+        runner.writeStats()
+        self.assert_(os.path.exists(stats_file))
+        self.assertFalse(os.path.exists(stats_file + '.tmp'))
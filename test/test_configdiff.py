@@ -0,0 +1,176 @@
+import os
+
+from twisted.trial import unittest
+
+from buildbot import locks
+from buildbot.process.factory import BuildFactory
+from buildbot.steps.shell import ShellCommand, WithProperties
+
+from buildbotcustom.configdiff import canonicalForm, builderForm, formHash, \
+    FormMemo, generateForms, saveForms, loadForms, formDifferences, diffForms
+from buildbotcustom.canonical import UnstableForm
+
+lock = locks.SlaveLock('clone', maxCount=1)
+
+
+class Thing(object):
+    pass
+
+
+def makeExtractFn(prop):
+    def extract(rc, stdout, stderr):
+        return {prop: stdout.strip()}
+    return extract
+
+
+def makeBuilder(name, command=['make'], slaves=['slave1', 'slave2'],
+                factory=None):
+    if factory is None:
+        factory = BuildFactory()
+        factory.addStep(ShellCommand(
+            command=command, env={'PATH': WithProperties('%(path)s')},
+            locks=[lock.access('counting')]))
+        factory.addStep(ShellCommand(command=['hg', 'id'],
+                                     extract_fn=makeExtractFn('rev')))
+    return {
+        'name': name,
+        'builddir': name,
+        'slavenames': slaves,
+        'nextSlave': lambda builder, slaves: slaves[0],
+        'factory': factory,
+        'category': 'test',
+        'properties': {'branch': 'b'},
+    }
+
+
+def generateObjects(branch, changed=None):
+    builders = [makeBuilder('%s %i' % (branch, i)) for i in range(3)]
+    if changed is not None:
+        builders[changed] = makeBuilder(builders[changed]['name'],
+                                        command=['make', '-j4'])
+    return {'builders': builders}
+
+
+class TestCanonicalForm(unittest.TestCase):
+    def test_equalObjects(self):
+        # Equal objects made separately have the same form
+        self.assertEquals(canonicalForm(makeBuilder('b')),
+                          canonicalForm(makeBuilder('b')))
+        self.assertEquals(formHash(builderForm(makeBuilder('b'))),
+                          formHash(builderForm(makeBuilder('b'))))
+
+    def test_values(self):
+        self.assertEquals(canonicalForm((1, 'a', u'b', None, {2: [3.5]})),
+                          [1, u'a', u'b', None, {u'2': [3.5]}])
+        self.assertEquals(canonicalForm(WithProperties('%s', 'p')), {
+            'class': 'buildbot.process.properties.WithProperties',
+            'attributes': {u'fmtstring': u'%s', u'args': [u'p']},
+        })
+        self.assertEquals(canonicalForm(Thing), '<class %s.Thing>' % __name__)
+        self.assertEquals(canonicalForm(set(['b', 'a'])), [u'a', u'b'])
+
+    def test_functions(self):
+        a = canonicalForm(makeExtractFn('a'))
+        self.assertEquals(a['function'], '%s.extract' % __name__)
+        self.assertEquals(a['closure'], [u'a'])
+        self.assertNotEquals(a, canonicalForm(makeExtractFn('b')))
+
+    def test_addresses(self):
+        self.assertEquals(canonicalForm(object()), u'<object object>')
+
+    def test_cycle(self):
+        t = Thing()
+        t.me = t
+        self.assertEquals(canonicalForm(t), {
+            'class': '%s.Thing' % __name__,
+            'attributes': {u'me': '<cycle>'},
+        })
+
+    def test_strict(self):
+        t = Thing()
+        t.me = t
+        for obj in (object(), t):
+            self.assertRaises(UnstableForm, canonicalForm, obj,
+                              FormMemo(strict=True))
+
+    def test_factoryInStep(self):
+        # A factory that a step refers to isn't described with its steps
+        f = BuildFactory()
+        f.addStep(ShellCommand(command=['make'], extract_fn=f.addStep))
+        form = builderForm(makeBuilder('b', factory=f))
+        extract_fn = form['factory']['steps'][0]['args']['extract_fn']
+        self.assertEquals(extract_fn['method'], 'addStep')
+        self.assertEquals(extract_fn['self'], {
+            'class': 'buildbot.process.factory.BuildFactory',
+            'attributes': {},
+        })
+
+    def test_sharedSteps(self):
+        b1 = makeBuilder('b1')
+        b2 = makeBuilder('b2', factory=b1['factory'])
+        memo = FormMemo()
+        f1 = builderForm(b1, memo)
+        f2 = builderForm(b2, memo)
+        for s1, s2 in zip(f1['factory']['steps'], f2['factory']['steps']):
+            self.assert_(s1 is s2)
+        self.assertNotEquals(formHash(f1), formHash(f2))
+
+
+class TestDiff(unittest.TestCase):
+    def test_formDifferences(self):
+        old = builderForm(makeBuilder('b'))
+        new = builderForm(makeBuilder('b', command=['make', '-j4'],
+                                      slaves=['slave1']))
+        self.assertEquals(formDifferences(old, new), [
+            'factory.steps[0].args.command length 1 -> 2',
+            'slavenames length 2 -> 1',
+        ])
+        del new['category']
+        new['mergeRequests'] = False
+        self.assertEquals(formDifferences(old, new), [
+            'category removed',
+            'factory.steps[0].args.command length 1 -> 2',
+            'mergeRequests added',
+            'slavenames length 2 -> 1',
+        ])
+
+    def test_diffForms(self):
+        jobs = [('b1', generateObjects, ('b1',), {}),
+                ('b2', generateObjects, ('b2',), {})]
+        old, errors = generateForms(jobs, 1)
+        self.assertEquals(errors, [])
+        self.assertEquals(len(old), 6)
+
+        jobs = [('b1', generateObjects, ('b1',), {'changed': 1}),
+                ('b3', generateObjects, ('b3',), {})]
+        new, errors = generateForms(jobs, 2)
+        self.assertEquals(errors, [])
+        added, removed, changed = diffForms(old, new)
+        self.assertEquals(added, ['b3 0', 'b3 1', 'b3 2'])
+        self.assertEquals(removed, ['b2 0', 'b2 1', 'b2 2'])
+        self.assertEquals(changed, [
+            ('b1 1', ['factory.steps[0].args.command length 1 -> 2'])])
+
+    def test_saveLoad(self):
+        jobs = [('b1', generateObjects, ('b1',), {})]
+        forms = generateForms(jobs, 1)[0]
+        path = os.path.abspath(self.mktemp())
+        saveForms(forms, path)
+        loaded = loadForms(path)
+        self.assertEquals(loaded, forms)
+        self.assertEquals(diffForms(loaded, forms), ([], [], []))
+        # Forms generated in another process have the same hashes
+        self.assertEquals(diffForms(loaded, generateForms(jobs, 2)[0]),
+                          ([], [], []))
+        # Changes are still found in detail
+        jobs = [('b1', generateObjects, ('b1',), {'changed': 0})]
+        self.assertEquals(diffForms(loaded, generateForms(jobs, 1)[0])[2], [
+            ('b1 0', ['factory.steps[0].args.command length 1 -> 2'])])
+
+    def test_duplicateBuilders(self):
+        jobs = [('b1', generateObjects, ('b1',), {}),
+                ('b1 again', generateObjects, ('b1',), {})]
+        forms, errors = generateForms(jobs, 1)
+        self.assertEquals(len(forms), 3)
+        self.assertEquals(errors[0],
+                          "duplicate builder name b1 0 (in b1 and b1 again)")
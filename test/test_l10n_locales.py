@@ -0,0 +1,114 @@
+import time
+
+from twisted.trial import unittest
+from twisted.internet import reactor, defer
+from twisted.web import server, resource
+
+from buildbotcustom.l10n import LocalesCache, TriggerableL10n
+
+ALL_LOCALES = """de
+fr
+ja linux win32
+ja-JP-mac osx
+"""
+
+
+class FakeHg(resource.Resource):
+    """Serves the same locales file for every path, and counts requests"""
+    isLeaf = True
+
+    def __init__(self):
+        resource.Resource.__init__(self)
+        self.requests = []
+
+    def render_GET(self, request):
+        self.requests.append(request.path)
+        if 'missing' in request.path:
+            request.setResponseCode(404)
+            return "not found"
+        return ALL_LOCALES
+
+
+class TestLocalesCache(unittest.TestCase):
+    def setUp(self):
+        self.hg = FakeHg()
+        self.port = reactor.listenTCP(0, server.Site(self.hg),
+                                      interface='127.0.0.1')
+        self.baseURL = 'http://127.0.0.1:%i/' % self.port.getHost().port
+        self.cache = LocalesCache(ttl=300)
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    def testCoalesced(self):
+        url = self.baseURL + 'all-locales'
+        d = defer.gatherResults([self.cache.getLocales(url)
+                                 for i in range(5)])
+
+        def check(results):
+            self.assertEquals(self.hg.requests, ['/all-locales'])
+            for locales in results:
+                self.assertEquals(locales['ja'], ['linux', 'win32'])
+            # Everybody gets their own copy
+            results[0]['ja'].append('osx')
+            return self.cache.getLocales(url)
+        d.addCallback(check)
+        d.addCallback(lambda locales: self.assertEquals(
+            (locales['ja'], len(self.hg.requests)), (['linux', 'win32'], 1)))
+        return d
+
+    def testExpiry(self):
+        head = self.baseURL + 'default/all-locales'
+        rev = self.baseURL + 'abcdef123456/all-locales'
+        self.now = time.time()
+        d = defer.gatherResults([self.cache.getLocales(head),
+                                 self.cache.getLocales(rev, immutable=True)])
+
+        def later(res):
+            self.assertEquals(len(self.hg.requests), 2)
+            # Five minutes later
+            self.patch(time, 'time', lambda: self.now + 301)
+            return defer.gatherResults([
+                self.cache.getLocales(head),
+                self.cache.getLocales(rev, immutable=True)])
+        d.addCallback(later)
+        d.addCallback(lambda res: self.assertEquals(
+            sorted(self.hg.requests), ['/abcdef123456/all-locales',
+                                       '/default/all-locales',
+                                       '/default/all-locales']))
+        return d
+
+    def testErrorsNotCached(self):
+        url = self.baseURL + 'missing/all-locales'
+        d = defer.DeferredList([self.cache.getLocales(url),
+                                self.cache.getLocales(url)],
+                               consumeErrors=True)
+
+        def check(results):
+            self.assertEquals([success for (success, res) in results],
+                              [False, False])
+            self.assertEquals(self.cache.fetching, {})
+            self.assertEquals(self.cache.locales, {})
+            return self.assertFailure(self.cache.getLocales(url), Exception)
+        d.addCallback(check)
+        d.addCallback(lambda res: self.assertEquals(self.cache.fetches, 2))
+        return d
+
+    def testSchedulers(self):
+        schedulers = []
+        for platform in ('linux', 'win32', 'macosx'):
+            s = TriggerableL10n(name='l10n %s' % platform,
+                                builderNames=['repack'], platform=platform,
+                                branch='b1', repo=self.baseURL)
+            s.localesCache = self.cache
+            schedulers.append(s)
+        d = defer.gatherResults([s.getLocales('abcdef123456')
+                                 for s in schedulers])
+
+        def check(results):
+            self.assertEquals(self.hg.requests,
+                              ['/b1/raw-file/abcdef123456/'
+                               'browser/locales/all-locales'])
+            self.assertEquals(self.cache.locales.values()[0][0], None)
+        d.addCallback(check)
+        return d
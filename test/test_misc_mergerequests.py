@@ -0,0 +1,66 @@
+import itertools
+
+import mock
+
+from twisted.trial import unittest
+
+from buildbot.changes.changes import Change
+from buildbot.buildrequest import BuildRequest
+from buildbot.sourcestamp import SourceStamp
+
+import buildbotcustom.misc
+from buildbotcustom.misc import mergeRequests
+
+
+def pairwiseMergeRequests(builder, req1, req2):
+    """What mergeRequests used to do"""
+    if builder.name in buildbotcustom.misc.nomergeBuilders:
+        return False
+    if 'Self-serve' in req1.reason or 'Self-serve' in req2.reason:
+        return False
+    return req1.canBeMergedWith(req2)
+
+
+def makeChange(revision):
+    return Change(who='me!', branch='b1', revision=revision, files=[],
+                  comments='really important')
+
+
+class TestMergeRequests(unittest.TestCase):
+    def setUp(self):
+        buildbotcustom.misc.nomergeBuilders = ['nomerge']
+        self.builder = mock.Mock()
+        self.builder.name = 'b1'
+
+        stamps = [
+            SourceStamp(branch='b1'),
+            SourceStamp(branch='b1', revision='r1'),
+            SourceStamp(branch='b1', revision='r1'),
+            SourceStamp(branch='b1', revision='r2'),
+            SourceStamp(branch='b2', revision='r1'),
+            SourceStamp(branch='b1', revision='r1', project='p1'),
+            SourceStamp(branch='b1', revision='r1', repository='repo1'),
+            SourceStamp(branch='b1', revision='r1', patch=(1, 'diff')),
+            SourceStamp(branch='b1', changes=[makeChange('r1')]),
+            SourceStamp(branch='b1', changes=[makeChange('r2')]),
+            SourceStamp(branch='b1', patch=(1, 'diff'),
+                        changes=[makeChange('r3')]),
+            SourceStamp(branch='b2', changes=[makeChange('r1')]),
+        ]
+        self.requests = []
+        for ss in stamps:
+            for reason in ('scheduler', 'Self-serve: Rebuilt by me'):
+                self.requests.append(BuildRequest(reason, ss, 'b1'))
+
+    def tearDown(self):
+        buildbotcustom.misc.nomergeBuilders = []
+
+    def test_sameAsPairwise(self):
+        for name in ('b1', 'nomerge'):
+            self.builder.name = name
+            for r1, r2 in itertools.permutations(self.requests, 2):
+                self.assertEquals(
+                    mergeRequests(self.builder, r1, r2),
+                    pairwiseMergeRequests(self.builder, r1, r2),
+                    (name, r1.source.asDict(), r1.reason,
+                     r2.source.asDict(), r2.reason))
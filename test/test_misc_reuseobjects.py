@@ -0,0 +1,129 @@
+import copy
+
+from twisted.trial import unittest
+
+from buildbot.process.factory import BuildFactory
+from buildbot.steps.shell import WithProperties
+
+import buildbotcustom.misc
+from buildbotcustom.misc import configFingerprint, reusesObjects, \
+    clearReusedObjects, forgetUnusedObjects
+
+
+def isImportant(change):
+    return 'important' in change.comments
+
+
+class Unstable(object):
+    def __repr__(self):
+        return '<Unstable at 0x%x>' % id(self)
+
+
+class TestConfigFingerprint(unittest.TestCase):
+    def makeConfig(self):
+        return {
+            'repo_path': 'mozilla-central',
+            'platforms': {
+                'linux': {'slaves': ['s1', 's2'], 'env': {'A': 'b'}},
+                'win32': {'slaves': ['s3'], 'env': {}},
+            },
+            'l10n_modules': set(['browser', 'toolkit']),
+            'fileIsImportant': isImportant,
+            'tag': WithProperties('%(buildid)s'),
+            'check': lambda x: x > 2,
+        }
+
+    def test_stable(self):
+        fp = configFingerprint(self.makeConfig(), 'b1')
+        self.assertEquals(configFingerprint(self.makeConfig(), 'b1'), fp)
+        self.assertEquals(
+            configFingerprint(copy.deepcopy(self.makeConfig()), 'b1'), fp)
+
+    def test_changes(self):
+        fp = configFingerprint(self.makeConfig(), 'b1')
+        self.assertNotEquals(configFingerprint(self.makeConfig(), 'b2'), fp)
+        for change in (
+            lambda c: c['platforms']['linux']['slaves'].append('s4'),
+            lambda c: c['platforms']['win32']['env'].update(B='c'),
+            lambda c: c['l10n_modules'].add('mail'),
+            lambda c: c.update(tag=WithProperties('%(buildnumber)s')),
+            lambda c: c.update(check=lambda x: x > 3),
+        ):
+            config = self.makeConfig()
+            change(config)
+            self.assertNotEquals(configFingerprint(config, 'b1'), fp)
+
+    def test_unstable(self):
+        config = self.makeConfig()
+        config['thing'] = Unstable()
+        self.assertEquals(configFingerprint(config), None)
+        config = self.makeConfig()
+        config['self'] = config
+        self.assertEquals(configFingerprint(config), None)
+
+
+class TestReusesObjects(unittest.TestCase):
+    def setUp(self):
+        clearReusedObjects()
+        buildbotcustom.misc.nomergeBuilders = []
+        self.calls = 0
+
+        @reusesObjects(1)
+        def generateObjects(config, name):
+            self.calls += 1
+            builders = [{'name': '%s %s' % (name, p),
+                         'factory': BuildFactory()} for p in config]
+            buildbotcustom.misc.nomergeBuilders.append(builders[0]['name'])
+            return {'builders': builders, 'schedulers': [object()]}
+        self.generateObjects = generateObjects
+
+    def tearDown(self):
+        clearReusedObjects()
+        buildbotcustom.misc.nomergeBuilders = []
+
+    def test_reused(self):
+        objs = self.generateObjects(['linux', 'win32'], 'b1')
+        # Callers may add to the lists they get
+        objs['builders'].append({'name': 'extra', 'factory': BuildFactory()})
+
+        buildbotcustom.misc.nomergeBuilders = []
+        again = self.generateObjects(['linux', 'win32'], name='b1')
+        self.assertEquals(self.calls, 1)
+        self.assertEquals(len(again['builders']), 2)
+        self.assert_(again['builders'][0] is objs['builders'][0])
+        self.assert_(again['schedulers'][0] is objs['schedulers'][0])
+        self.assertEquals(buildbotcustom.misc.nomergeBuilders, ['b1 linux'])
+
+    def test_changed(self):
+        objs = self.generateObjects(['linux', 'win32'], 'b1')
+        self.generateObjects(['linux'], 'b2')
+        changed = self.generateObjects(['linux'], 'b1')
+        self.assertEquals(self.calls, 3)
+        self.failIf(changed['builders'][0] is objs['builders'][0])
+        # Only the last objects for each name are kept
+        self.generateObjects(['linux', 'win32'], 'b1')
+        self.generateObjects(['linux'], 'b2')
+        self.assertEquals(self.calls, 4)
+
+    def test_unstable(self):
+        config = ['linux', Unstable()]
+        self.generateObjects(config, 'b1')
+        self.generateObjects(config, 'b1')
+        self.assertEquals(self.calls, 2)
+
+    def test_forgetUnused(self):
+        objs = self.generateObjects(['linux'], 'b1')
+        self.generateObjects(['linux'], 'b2')
+        forgetUnusedObjects()
+
+        # b2 is removed in this reconfig
+        self.generateObjects(['linux'], 'b1')
+        forgetUnusedObjects()
+        self.assertEquals(self.calls, 2)
+
+        # b1's objects are still reused, but b2's aren't handed back now that
+        # it has returned
+        again = self.generateObjects(['linux'], 'b1')
+        self.assert_(again['builders'][0] is objs['builders'][0])
+        self.generateObjects(['linux'], 'b2')
+        self.assertEquals(self.calls, 3)
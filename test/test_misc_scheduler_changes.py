@@ -0,0 +1,91 @@
+from __future__ import with_statement
+import os
+import shutil
+from twisted.trial import unittest
+
+from buildbot.db import dbspec, connector
+from buildbot.db.schema.manager import DBSchemaManager
+from buildbot.changes.changes import Change
+
+import mock
+
+import buildbotcustom.misc_scheduler
+from buildbotcustom.misc_scheduler import changeEventGeneratorInTransaction, \
+    lastChange
+
+
+class TestChangeEventGenerator(unittest.TestCase):
+    basedir = "test_misc_scheduler_changes"
+
+    def setUp(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        spec = dbspec.DBSpec.from_url("sqlite:///state.sqlite", self.basedir)
+        manager = DBSchemaManager(spec, self.basedir)
+        manager.upgrade()
+
+        self.dbc = connector.DBConnector(spec)
+        self.dbc.start()
+
+    def tearDown(self):
+        self.dbc.stop()
+        shutil.rmtree(self.basedir)
+
+    def addChange(self, branch, revision, comments='really important',
+                  revlink='from poller', **kwargs):
+        kwargs.setdefault('files', [])
+        c = Change(who='me!', branch=branch, revision=revision,
+                   comments=comments, revlink=revlink, **kwargs)
+        self.dbc.addChangeToDatabase(c)
+        return c
+
+    def changes(self, **kwargs):
+        return self.dbc.runInteractionNow(lambda t: list(
+            changeEventGeneratorInTransaction(self.dbc, t, **kwargs)))
+
+    def testPaging(self):
+        for i in range(12):
+            self.addChange('b%i' % (i % 2), str(i), files=['f%i' % i])
+        c = self.addChange('b0', '12', files=['b', 'a'],
+                           links=['http://l'], properties={'p': 'v'})
+
+        with mock.patch.object(buildbotcustom.misc_scheduler,
+                               'CHANGE_PAGE_SIZE', 5):
+            changes = self.changes(branches=['b0'])
+        self.assertEquals([x.revision for x in changes],
+                          ['12', '10', '8', '6', '4', '2', '0'])
+        self.assertEquals(changes[0].number, c.number)
+        self.assertEquals(changes[0].files, ['a', 'b'])
+        self.assertEquals(changes[0].links, ['http://l'])
+        self.assertEquals(changes[0].properties.getProperty('p'), 'v')
+        self.assertEquals(changes[1].files, ['f10'])
+
+        with mock.patch.object(buildbotcustom.misc_scheduler,
+                               'CHANGE_PAGE_SIZE', 5):
+            self.assertEquals(len(self.changes()), 13)
+
+    def testFilters(self):
+        self.addChange('b1', '1')
+        self.addChange('b1', '2', revlink=None)
+        self.addChange('b1', '3', comments='Bug 1 - DONTBUILD')
+        self.addChange('b1', '4', comments='dontbuild is fine')
+        self.addChange('b1', '5', comments='DONTBUILD', revlink=None)
+
+        self.assertEquals([c.revision for c in self.changes(
+            branches=['b1'], skipDontBuild=True, requireRevlink=True)],
+            ['4', '1'])
+        self.assertEquals([c.revision for c in self.changes(
+            branches=['b1'], requireRevlink=True)], ['4', '3', '1'])
+        self.assertEquals(len(self.changes(branches=['b1'])), 5)
+
+    def testLastChange(self):
+        self.addChange('b1', '1')
+        self.addChange('b1', '2', comments='DONTBUILD')
+        self.addChange('b1', '3', revlink=None)
+        c = self.dbc.runInteractionNow(
+            lambda t: lastChange(self.dbc, t, 'b1'))
+        self.assertEquals(c.revision, '1')
+        c = self.dbc.runInteractionNow(
+            lambda t: lastChange(self.dbc, t, 'b2'))
+        self.assertEquals(c, None)
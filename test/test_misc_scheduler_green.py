@@ -0,0 +1,165 @@
+from __future__ import with_statement
+import os
+import shutil
+import time
+from twisted.trial import unittest
+
+from buildbot.db import dbspec, connector
+from buildbot.db.schema.manager import DBSchemaManager
+
+import mock
+
+from buildbotcustom.misc_scheduler import lastGoodRev, \
+    lastGoodRevFromHistory, updateGreenBuilds, checkGreenBuilds, \
+    upgradeSchedulerTables, backfillGreenBuilds, _createSchema, \
+    GREEN_BUILDS_SCHEMA
+
+
+class TestGreenBuilds(unittest.TestCase):
+    basedir = "test_misc_scheduler_green"
+
+    def setUp(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        spec = dbspec.DBSpec.from_url("sqlite:///state.sqlite", self.basedir)
+        manager = DBSchemaManager(spec, self.basedir)
+        manager.upgrade()
+
+        self.dbc = connector.DBConnector(spec)
+        self.dbc.start()
+        self.bsid = 0
+        # Pretend it's just after the latest build request completed
+        self.now = 0
+
+    def setUpTables(self, since=0, step=3600):
+        _createSchema(self.dbc, GREEN_BUILDS_SCHEMA)
+        backfillGreenBuilds(self.dbc, since, self.now, step)
+
+    def tableExists(self, name):
+        return bool(self.dbc.runQueryNow(
+            "SELECT name FROM sqlite_master WHERE name = '%s'" % name))
+
+    def countGreenBuilds(self):
+        return self.dbc.runQueryNow("SELECT COUNT(*) FROM green_builds")[0][0]
+
+    def tearDown(self):
+        self.dbc.stop()
+        shutil.rmtree(self.basedir)
+
+    def addBuildset(self, branch, revision, results, complete_at):
+        """Adds a buildset for branch/revision, with a build request per
+        builder in results"""
+        self.bsid += 1
+        self.dbc.runQueryNow("""INSERT INTO sourcestamps (`id`, `branch`, `revision`) VALUES (%i, '%s', '%s')""" % (self.bsid, branch, revision))
+        self.dbc.runQueryNow("""INSERT INTO buildsets (`id`, `sourcestampid`, `submitted_at`) VALUES (%i, %i, 1)""" % (self.bsid, self.bsid))
+        for name, result in results.items():
+            self.dbc.runQueryNow("""INSERT INTO buildrequests (`buildsetid`, `complete`, `results`, `buildername`, `complete_at`, `submitted_at`) VALUES (%i, 1, %i, '%s', %i, 1)""" % (self.bsid, result, name, complete_at))
+        self.now = max(self.now, complete_at + 1)
+
+    def lastGood(self, func, starttime, endtime, branch='b1',
+                 builders=('builder1', 'builder2')):
+        time_method = mock.Mock(return_value=self.now)
+        with mock.patch.object(time, 'time', time_method):
+            return self.dbc.runInteractionNow(lambda t: func(
+                self.dbc, t, branch, list(builders), starttime, endtime))
+
+    def testIncremental(self):
+        self.setUpTables()
+        self.addBuildset('b1', 'r1', {'builder1': 0, 'builder2': 1}, 100)
+        self.assertEquals(self.lastGood(lastGoodRev, 0, 1000), 'r1')
+
+        # r2 isn't green on builder2
+        self.addBuildset('b1', 'r2', {'builder1': 0, 'builder2': 2}, 200)
+        self.assertEquals(self.lastGood(lastGoodRev, 0, 1000), 'r1')
+
+        # A retrigger of r2 on builder2 makes it green
+        self.addBuildset('b1', 'r2', {'builder2': 0}, 300)
+        self.assertEquals(self.lastGood(lastGoodRev, 0, 1000), 'r2')
+        self.assertEquals(self.lastGood(lastGoodRevFromHistory, 0, 1000),
+                          'r2')
+
+        # Other branches and builders don't count
+        self.assertEquals(self.lastGood(lastGoodRev, 0, 1000, 'b2'), None)
+        self.assertEquals(self.lastGood(lastGoodRev, 0, 1000,
+                                        builders=['builder1', 'builder3']),
+                          None)
+
+    def testBackfill(self):
+        self.addBuildset('b1', 'r1', {'builder1': 0, 'builder2': 0}, 100)
+        self.addBuildset('b1', 'r2', {'builder1': 0, 'builder2': 0}, 1000)
+        self.addBuildset('b1', 'r3', {'builder1': 0, 'builder2': 2}, 1100)
+        self.setUpTables(since=500, step=100)
+        self.assertEquals(self.countGreenBuilds(), 3)
+        self.assertEquals(self.lastGood(lastGoodRev, 500, 2000), 'r2')
+        # Asking about older history picks up builds from before the
+        # backfill
+        self.assertEquals(self.lastGood(lastGoodRev, 0, 500), 'r1')
+        # Backfilling again doesn't do anything
+        self.setUpTables(since=0)
+        self.assertEquals(self.countGreenBuilds(), 5)
+
+    def testNotSetUp(self):
+        # Without the tables, lastGoodRev looks through history, and doesn't
+        # create them itself
+        self.addBuildset('b1', 'r1', {'builder1': 0, 'builder2': 0}, 100)
+        self.assertEquals(self.lastGood(lastGoodRev, 0, 1000), 'r1')
+        self.assertFalse(self.tableExists('green_builds'))
+        # Nor if they've been created, but not filled in yet
+        _createSchema(self.dbc, GREEN_BUILDS_SCHEMA)
+        self.assertEquals(self.lastGood(lastGoodRev, 0, 1000), 'r1')
+        self.assertEquals(self.countGreenBuilds(), 0)
+
+    def testUpgrade(self):
+        self.addBuildset('b1', 'r1', {'builder1': 0, 'builder2': 0}, 100)
+        upgradeSchedulerTables(self.dbc, now=self.now)
+        self.assertEquals(self.countGreenBuilds(), 2)
+        self.assert_(self.tableExists('buildrequests_complete_at'))
+        # Running it again (e.g. from another master) is harmless
+        upgradeSchedulerTables(self.dbc, now=self.now)
+        self.assertEquals(self.countGreenBuilds(), 2)
+        self.assertEquals(self.lastGood(lastGoodRev, 0, 1000), 'r1')
+
+    def testNoDuplicates(self):
+        self.setUpTables()
+        self.addBuildset('b1', 'r1', {'builder1': 0, 'builder2': 0}, 100)
+        self.addBuildset('b1', 'r1', {'builder1': 0}, 150)
+        # The overlap means these build requests are looked at every time
+        for i in range(3):
+            self.assertEquals(self.lastGood(lastGoodRev, 0, 1000), 'r1')
+        self.assertEquals(self.dbc.runQueryNow(
+            "SELECT buildername, buildsetid, complete_at FROM green_builds "
+            "ORDER BY buildername"),
+            [('builder1', 2, 150), ('builder2', 1, 100)])
+
+    def testMatchesHistory(self):
+        self.setUpTables()
+        self.addBuildset('b1', 'r1', {'builder1': 0, 'builder2': 0}, 100)
+        self.addBuildset('b1', 'r2', {'builder1': 0, 'builder2': 2}, 150)
+        self.addBuildset('b1', 'r3', {'builder1': 1}, 200)
+        self.addBuildset('b1', 'r3', {'builder2': 0}, 250)
+        self.addBuildset('b2', 'r4', {'builder1': 0, 'builder2': 0}, 300)
+        for start, end in [(0, 120), (0, 160), (0, 220), (0, 400),
+                           (140, 400), (260, 400)]:
+            self.assertEquals(self.lastGood(lastGoodRev, start, end),
+                              self.lastGood(lastGoodRevFromHistory, start,
+                                            end))
+
+    def testCheckAndRebuild(self):
+        self.assertEquals(self.dbc.runInteractionNow(
+            lambda t: checkGreenBuilds(self.dbc, t, 0)), None)
+        self.setUpTables()
+        self.addBuildset('b1', 'r1', {'builder1': 0, 'builder2': 0}, 100)
+        self.dbc.runInteractionNow(
+            lambda t: updateGreenBuilds(self.dbc, t, 0, now=1000))
+        self.assertEquals(self.dbc.runInteractionNow(
+            lambda t: checkGreenBuilds(self.dbc, t, 0)), [])
+
+        # Lose a row
+        self.dbc.runQueryNow(
+            "DELETE FROM green_builds WHERE buildername = 'builder2'")
+        self.assertEquals(self.lastGood(lastGoodRev, 0, 1000), None)
+        diffs = self.dbc.runInteractionNow(
+            lambda t: checkGreenBuilds(self.dbc, t, 0, rebuild=True))
+        self.assertEquals(diffs, [(('b1', 'r1', 'builder2'), (1, 100), None)])
+        self.assertEquals(self.lastGood(lastGoodRev, 0, 1000), 'r1')
@@ -0,0 +1,148 @@
+import os
+import shutil
+import time
+from twisted.trial import unittest
+
+from buildbot.db import dbspec, connector
+from buildbot.db.schema.manager import DBSchemaManager
+from buildbot.changes.changes import Change
+
+from buildbotcustom.misc_scheduler import getLastBuiltRevision, \
+    getLastBuiltRevisionFromHistory, backfillLastBuiltRevisions, \
+    _createSchema, LAST_BUILT_SCHEMA
+
+
+class TestLastBuiltRevision(unittest.TestCase):
+    basedir = "test_misc_scheduler_lastbuilt"
+
+    def setUp(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        spec = dbspec.DBSpec.from_url("sqlite:///state.sqlite", self.basedir)
+        manager = DBSchemaManager(spec, self.basedir)
+        manager.upgrade()
+
+        self.dbc = connector.DBConnector(spec)
+        self.dbc.start()
+        self.bsid = 0
+
+    def tearDown(self):
+        self.dbc.stop()
+        shutil.rmtree(self.basedir)
+
+    def addChange(self, branch, revision, when):
+        self.dbc.addChangeToDatabase(Change(
+            who='me!', branch=branch, revision=revision, files=[],
+            comments='really important', when=when, revlink='from poller'))
+
+    def addBuildset(self, revision, builderNames, bsid=None):
+        if bsid is None:
+            self.bsid += 1
+            bsid = self.bsid
+        self.dbc.runQueryNow("""INSERT INTO sourcestamps (`id`, `branch`, `revision`) VALUES (%i, 'b1', '%s')""" % (bsid, revision))
+        self.dbc.runQueryNow("""INSERT INTO buildsets (`id`, `sourcestampid`, `submitted_at`) VALUES (%i, %i, %i)""" % (bsid, bsid, time.time()))
+        for name in builderNames:
+            self.dbc.runQueryNow("""INSERT INTO buildrequests (`buildsetid`, `complete`, `results`, `buildername`, `submitted_at`) VALUES (%i, 0, -1, '%s', 1)""" % (bsid, name))
+
+    def setUpTables(self, batch=1000):
+        _createSchema(self.dbc, LAST_BUILT_SCHEMA)
+        backfillLastBuiltRevisions(self.dbc, batch=batch)
+
+    def tableRows(self):
+        return self.dbc.runQueryNow("""SELECT buildername, branch, revision
+            FROM last_built_revisions ORDER BY buildername, branch""")
+
+    def lastBuilt(self, func, branch, builderNames):
+        return self.dbc.runInteractionNow(
+            lambda t: func(self.dbc, t, branch, builderNames))
+
+    def assertLastBuilt(self, branch, builderNames, expected):
+        for func in getLastBuiltRevision, getLastBuiltRevisionFromHistory:
+            self.assertEquals(self.lastBuilt(func, branch, builderNames),
+                              expected)
+
+    def testLastBuilt(self):
+        self.setUpTables()
+        self.addChange('b1', 'abcdef123456', 10)
+        self.addChange('b1', 'abcdef999999', 20)
+        self.addChange('b1', '123456abcdef', 30)
+        self.addChange('b2', '123456abcdef', 40)
+
+        self.assertLastBuilt('b1', ['builder1'], None)
+
+        self.addBuildset('abcdef123456', ['builder1'])
+        self.assertLastBuilt('b1', ['builder1'], 'abcdef123456')
+        self.assertLastBuilt('b1', ['builder2'], None)
+
+        # Forced builds with a short revision match the full revision
+        self.addBuildset('123456', ['builder1', 'builder2'])
+        self.assertLastBuilt('b1', ['builder1'], '123456abcdef')
+        self.assertLastBuilt('b1', ['builder2'], '123456abcdef')
+        self.assertLastBuilt('b2', ['builder2'], '123456abcdef')
+
+        # Building an older change doesn't go backwards
+        self.addBuildset('abcdef999999', ['builder1'])
+        self.assertLastBuilt('b1', ['builder1'], '123456abcdef')
+
+    def testUnknownRevision(self):
+        self.setUpTables()
+        self.addChange('b1', 'abcdef123456', 10)
+        self.addBuildset('fedcba', ['builder1'])
+        self.assertLastBuilt('b1', ['builder1'], None)
+
+    def testBackfill(self):
+        self.addChange('b1', 'abcdef123456', 10)
+        self.addChange('b1', '123456abcdef', 30)
+        self.addBuildset('abcdef123456', ['builder1', 'builder2'])
+        self.addBuildset('123456', ['builder1'])
+        self.addBuildset('fedcba', ['builder3'])
+        # Full revisions are looked up together
+        self.addChange('b2', 'f' * 40, 40)
+        self.addBuildset('f' * 40, ['builder2'])
+        self.setUpTables(batch=1)
+        self.assertEquals(self.tableRows(), [
+            ('builder1', 'b1', '123456abcdef'),
+            ('builder2', 'b1', 'abcdef123456'),
+            ('builder2', 'b2', 'f' * 40),
+        ])
+        self.assertLastBuilt('b1', ['builder2'], 'abcdef123456')
+        # Backfilling again doesn't do anything
+        self.dbc.runQueryNow("DELETE FROM last_built_revisions")
+        self.setUpTables()
+        self.assertEquals(self.tableRows(), [])
+
+    def testNotSetUp(self):
+        # Without the tables, getLastBuiltRevision looks through history,
+        # and doesn't create them itself
+        self.addChange('b1', 'abcdef123456', 10)
+        self.addBuildset('abcdef123456', ['builder1'])
+        self.assertEquals(
+            self.lastBuilt(getLastBuiltRevision, 'b1', ['builder1']),
+            'abcdef123456')
+        self.assertFalse(self.dbc.runQueryNow(
+            "SELECT name FROM sqlite_master "
+            "WHERE name = 'last_built_revisions'"))
+
+    def testLateBuildset(self):
+        self.setUpTables()
+        self.addChange('b1', 'abcdef123456', 10)
+        self.addChange('b1', '123456abcdef', 30)
+        self.addBuildset('abcdef123456', ['builder1'], bsid=5)
+        self.assertLastBuilt('b1', ['builder1'], 'abcdef123456')
+        # Another master's buildset with a lower id commits after we've
+        # looked at buildset 5
+        self.addBuildset('123456abcdef', ['builder1'], bsid=3)
+        self.assertLastBuilt('b1', ['builder1'], '123456abcdef')
+
+    def testNoDuplicates(self):
+        self.setUpTables()
+        self.addChange('b1', 'abcdef123456', 10)
+        self.addChange('b1', '123456abcdef', 30)
+        self.addBuildset('abcdef123456', ['builder1'])
+        self.addBuildset('123456abcdef', ['builder1'])
+        # The overlap means these buildsets are looked at every time
+        for i in range(3):
+            self.assertLastBuilt('b1', ['builder1'], '123456abcdef')
+        self.assertEquals(self.tableRows(),
+                          [('builder1', 'b1', '123456abcdef')])
@@ -10,7 +10,8 @@ from buildbot.changes.changes import Change
 
 import mock
 
-from buildbotcustom.misc_scheduler import buildIDSchedFunc, buildUIDSchedFunc
+from buildbotcustom.misc_scheduler import buildIDSchedFunc, \
+    buildIDSchedFuncBatch, buildUIDSchedFunc
 
 
 class TestPropFuncs(unittest.TestCase):
@@ -76,6 +77,22 @@ class TestPropFuncs(unittest.TestCase):
             self.assertEquals(state['last_buildid'], time.strftime(
                 "%Y%m%d%H%M%S", time.localtime(86461)))
 
+    def test_buildIDSchedFuncBatch(self):
+        import time
+        with mock.patch.object(time, 'time') as time_method:
+            time_method.return_value = 86458
+            one_at_a_time = [self.dbc.runInteractionNow(
+                lambda t: buildIDSchedFunc(self.s, t, None))['buildid']
+                for i in range(3)]
+
+            # Start from the same state
+            self.dbc.runInteractionNow(lambda t: self.s.set_state(t, {}))
+            props = self.dbc.runInteractionNow(
+                lambda t: buildIDSchedFuncBatch(self.s, t, [1, 2, 3]))
+            self.assertEquals([p['buildid'] for p in props], one_at_a_time)
+            state = self.dbc.runInteractionNow(lambda t: self.s.get_state(t))
+            self.assertEquals(state['last_buildid'], one_at_a_time[-1])
+
     def test_buildUIDSchedFunc(self):
         import uuid
         with mock.patch.object(uuid, 'uuid4') as uuid4_method:
@@ -1,3 +1,4 @@
+from __future__ import with_statement
 import os
 import shutil
 
@@ -7,13 +8,31 @@ from buildbot.db import dbspec, connector
 from buildbot.db.schema.manager import DBSchemaManager
 from buildbot.schedulers.basic import Scheduler
 from buildbot.changes.changes import Change
+from buildbot.process.properties import Properties
+from buildbot.sourcestamp import SourceStamp
 
+from buildbotcustom.buildsets import BulkBuildsetMixin
 from buildbotcustom.scheduler import makePropertiesScheduler
-from buildbotcustom.misc_scheduler import buildIDSchedFunc, buildUIDSchedFunc
+from buildbotcustom.misc_scheduler import buildIDSchedFunc, \
+    buildUIDSchedFunc, cacheablePropFunc
 
 import mock
 
 
+class BulkScheduler(Scheduler, BulkBuildsetMixin):
+    pass
+
+
+def makeCountingPropFunc(name):
+    def propfunc(sched, t, ssid):
+        propfunc.calls += 1
+        props = Properties()
+        props.setProperty(name, "%s-%i" % (ssid, propfunc.calls), name)
+        return props
+    propfunc.calls = 0
+    return propfunc
+
+
 class TestPropertiesScheduler(unittest.TestCase):
     basedir = "test_misc_scheduler_propscheduler"
 
@@ -59,3 +78,55 @@ class TestPropertiesScheduler(unittest.TestCase):
                 s.properties.asList(), [("scheduler", "s", "Scheduler")])
         d.addCallback(check)
         return d
+
+    def testCachedPropFuncs(self):
+        perTxn = cacheablePropFunc('transaction')(makeCountingPropFunc('txn'))
+        perSS = cacheablePropFunc('sourcestamp')(makeCountingPropFunc('ss'))
+        timed = cacheablePropFunc('ttl', 60)(makeCountingPropFunc('timed'))
+        S = makePropertiesScheduler(
+            BulkScheduler, propfuncs=[buildIDSchedFunc, buildUIDSchedFunc,
+                                      perTxn, perSS, timed])
+        s = S(name="s", builderNames=["b1"])
+        s.parent = mock.Mock()
+        s.parent.db = self.dbc
+
+        ssids = self.dbc.runInteractionNow(lambda t: [
+            self.dbc.get_sourcestampid(SourceStamp(branch=b), t)
+            for b in ('b1', 'b2')])
+
+        def createBuildsets(t):
+            return s.create_buildsets(
+                [(ssids[0], 'r', None, None), (ssids[0], 'r', None, None),
+                 (ssids[1], 'r', None, None)], t)
+
+        def getProps():
+            props = {}
+            for name, value in self.dbc.runQueryNow(
+                    "SELECT property_name, property_value"
+                    " FROM buildset_properties"):
+                props.setdefault(name, []).append(value)
+            return props
+
+        d = self.dbc.addSchedulers([s])
+        d.addCallback(lambda ign: self.dbc.runInteractionNow(createBuildsets))
+
+        def check(ign):
+            self.assertEquals((perTxn.calls, perSS.calls, timed.calls),
+                              (1, 2, 1))
+            props = getProps()
+            # Every buildset still gets its own ids
+            self.assertEquals(len(set(props['buildid'])), 3)
+            self.assertEquals(len(set(props['builduid'])), 3)
+            self.assertEquals(len(set(props['ss'])), 2)
+
+            with mock.patch('time.time') as time_method:
+                time_method.return_value = 2 ** 31
+                self.dbc.runInteractionNow(createBuildsets)
+            self.assertEquals((perTxn.calls, perSS.calls, timed.calls),
+                              (2, 2, 2))
+            props = getProps()
+            self.assertEquals(len(set(props['buildid'])), 6)
+            self.assertEquals(
+                s.properties.asList(), [("scheduler", "s", "Scheduler")])
+        d.addCallback(check)
+        return d
@@ -0,0 +1,138 @@
+from twisted.trial import unittest
+from twisted.internet import reactor, defer
+from twisted.web import server, resource
+
+from buildbot.changes.changes import Change
+from buildbot.util import json
+
+import mock
+
+from buildbotcustom.misc_scheduler import makeTryChooser, PushlogCache
+
+BUILDER_PRETTY_NAMES = {'linux': 'Linux try build',
+                        'win32': 'WINNT 5.2 try build'}
+
+
+class FakePushlog(resource.Resource):
+    """Serves json-pushes for a set of pushes, and counts requests"""
+    isLeaf = True
+
+    def __init__(self, pushes):
+        resource.Resource.__init__(self)
+        self.pushes = pushes
+        self.requests = []
+
+    def render_GET(self, request):
+        changeset = request.args['changeset'][0]
+        self.requests.append(changeset)
+        retval = {}
+        for pushid, push in self.pushes.items():
+            for c in push['changesets']:
+                if c['node'].startswith(changeset):
+                    retval[pushid] = push
+        return json.dumps(retval)
+
+
+def makePush(revisions, desc):
+    return {'changesets': [{'node': r, 'desc': desc} for r in revisions]}
+
+
+class TestTryChooser(unittest.TestCase):
+    def setUp(self):
+        self.pushlog = FakePushlog({
+            '1': makePush(['%040i' % i for i in range(50)],
+                          'try: -b o -p linux'),
+            '2': makePush(['a' * 40], 'no try syntax'),
+        })
+        self.port = reactor.listenTCP(0, server.Site(self.pushlog),
+                                      interface='127.0.0.1')
+        self.chooser = makeTryChooser(
+            'http://127.0.0.1:%i/try/' % self.port.getHost().port)
+
+        self.s = mock.Mock()
+        self.s.builderNames = BUILDER_PRETTY_NAMES.values()
+        self.s.prettyNames = BUILDER_PRETTY_NAMES
+        self.s.unittestPrettyNames = {}
+        self.s.unittestSuites = []
+        self.s.talosSuites = []
+        self.s.buildbotBranch = 'try'
+
+    def tearDown(self):
+        return self.port.stopListening()
+
+    def makeChange(self, revision, comments='commit'):
+        return Change(who='me!', branch='try', revision=revision, files=[],
+                      comments=comments)
+
+    def testOneFetchPerPush(self):
+        changes = [self.makeChange('%040i' % i) for i in range(50)]
+        d = self.chooser(self.s, changes)
+
+        def check(buildersPerChange):
+            self.assertEquals(len(self.pushlog.requests), 1)
+            for c in changes:
+                self.assertEquals(buildersPerChange[c], ['Linux try build'])
+
+            # Later lookups come from the cache
+            return self.chooser(self.s, changes[:2])
+        d.addCallback(check)
+        d.addCallback(lambda res: self.assertEquals(
+            len(self.pushlog.requests), 1))
+        return d
+
+    def testSeveralPushes(self):
+        changes = [self.makeChange('%040i' % 1), self.makeChange('a' * 40),
+                   self.makeChange('b' * 40),
+                   self.makeChange('c' * 40, 'try: -b o -p win32')]
+        d = self.chooser(self.s, changes)
+
+        def check(buildersPerChange):
+            # No fetch for the change with try syntax in its comments
+            self.assertEquals(sorted(self.pushlog.requests),
+                              ['%040i' % 1, 'a' * 40, 'b' * 40])
+            self.assertEquals(buildersPerChange[changes[0]],
+                              ['Linux try build'])
+            # Default set when there's no try syntax or no push
+            self.assertEquals(sorted(buildersPerChange[changes[1]]),
+                              sorted(BUILDER_PRETTY_NAMES.values()))
+            self.assertEquals(sorted(buildersPerChange[changes[2]]),
+                              sorted(BUILDER_PRETTY_NAMES.values()))
+            self.assertEquals(buildersPerChange[changes[3]],
+                              ['WINNT 5.2 try build'])
+        d.addCallback(check)
+        return d
+
+    def testFetchError(self):
+        changes = [self.makeChange('%040i' % 1), self.makeChange('a' * 40)]
+        d = defer.maybeDeferred(self.port.stopListening)
+        d.addCallback(lambda _: self.chooser(self.s, changes))
+
+        def check(buildersPerChange):
+            self.assertEquals(len(buildersPerChange), 2)
+            self.assertEquals(self.chooser.pushlogCache.fetches, 2)
+            self.assertEquals(self.chooser.pushlogCache.fetching, {})
+        d.addCallback(check)
+        return d
+
+
+class TestPushlogCache(unittest.TestCase):
+    def setUp(self):
+        self.cache = PushlogCache('http://pushlog.example.com/try')
+        self.fetched = []
+        self.cache._fetch = self.fetched.append
+
+    def testWaitsOnlyOnce(self):
+        a = self.cache.getPush('a')
+        b = self.cache.getPush('b')
+        c = self.cache.getPush('c')
+        self.cache.getPush('b')
+        self.assertEquals(self.fetched, ['a'])
+
+        # b and c weren't in a's push, so they're fetched at once
+        self.cache._fetched(None, 'a')
+        self.assertEquals(self.fetched, ['a', 'b', 'c'])
+        self.assertEquals(sorted(self.cache.fetching), ['b', 'c'])
+        # and lookups of the same revision share a request
+        self.assertEquals(len(self.cache.fetching['b']), 2)
+        self.assert_(a.called)
+        self.failIf(b.called or c.called)
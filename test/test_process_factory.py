@@ -1,6 +1,10 @@
 import unittest
 
-from buildbotcustom.process.factory import ReleaseUpdatesFactory
+from buildbot.process.factory import BuildFactory
+from buildbot.steps.shell import ShellCommand, WithProperties
+
+from buildbotcustom.process.factory import ReleaseUpdatesFactory, \
+    shareStepFactories, clearSharedSteps
 
 
 class SimpleUpdatesFactory(ReleaseUpdatesFactory):
@@ -77,3 +81,58 @@ class TestReleaseUpdatesFactory(unittest.TestCase):
         self.assertEqual(uf.channels, expectedChannels)
         self.assertEqual(uf.dirMap, expectedDirMap)
         self.assertEqual(uf.testChannel, 'esrtest')
+
+
+def makeFactory(platform, env):
+    f = BuildFactory()
+    f.addStep(ShellCommand(name='checkout', command=['hg', 'clone', 'repo'],
+                           env=env))
+    f.addStep(ShellCommand(name='build', command=['make', '-j4'], env=env,
+                           description=['building', platform]))
+    f.addStep(ShellCommand(name='upload',
+                           command=['make', WithProperties('%(buildid)s')]))
+    f.addStep(ShellCommand(name='upload',
+                           command=['make', WithProperties('%(x)s',
+                                                           x=lambda b: 1)]))
+    return f
+
+
+class TestShareStepFactories(unittest.TestCase):
+    def setUp(self):
+        clearSharedSteps()
+
+    def tearDown(self):
+        clearSharedSteps()
+
+    def testShared(self):
+        f1 = makeFactory('linux', {'A': '1'})
+        f2 = makeFactory('linux', {'A': '1'})
+        f3 = makeFactory('win32', {'A': '1'})
+        before = [list(f.steps) for f in (f1, f2, f3)]
+        shareStepFactories([f1, f2])
+        shareStepFactories([f3])
+        for f, steps in zip((f1, f2, f3), before):
+            self.assertEqual(f.steps, steps)
+
+        # Equal steps are the same object
+        for s1, s2 in zip(f1.steps, f2.steps)[:3]:
+            self.assert_(s1 is s2)
+        self.assert_(f1.steps[0] is f3.steps[0])
+        # Only the description of the build step is different
+        self.assert_(f1.steps[1] is not f3.steps[1])
+        self.assert_(f1.steps[1][1]['command'] is f3.steps[1][1]['command'])
+        self.assert_(f1.steps[1][1]['env'] is f3.steps[1][1]['env'])
+        self.assertEqual(f3.steps[1][1]['description'], ['building', 'win32'])
+        # WithProperties with different lambdas aren't shared
+        self.assert_(f1.steps[3] is not f2.steps[3])
+
+    def testDifferentTypes(self):
+        f1 = BuildFactory()
+        f1.addStep(ShellCommand(command=['make', 1], timeout=1))
+        f2 = BuildFactory()
+        f2.addStep(ShellCommand(command=('make', True), timeout=1.0))
+        shareStepFactories([f1, f2])
+        self.assertEqual(f1.steps[0][1]['command'], ['make', 1])
+        self.assertEqual(type(f1.steps[0][1]['timeout']), int)
+        self.assertEqual(f2.steps[0][1]['command'], ('make', True))
+        self.assertEqual(type(f2.steps[0][1]['timeout']), float)
@@ -0,0 +1,126 @@
+import os
+import sys
+
+from twisted.trial import unittest
+
+from buildbotcustom import reloader
+from buildbotcustom.reloader import reloadIfChanged
+
+
+class TestReloadIfChanged(unittest.TestCase):
+    def setUp(self):
+        self.dir = os.path.abspath(self.mktemp())
+        self.pkg = 'reloadertest_%i' % id(self)
+        os.makedirs(os.path.join(self.dir, self.pkg))
+        # Each module adds its name to loads when it's loaded
+        self.write('__init__', 'loads = []\n')
+        # user reloads leaf, top reloads user and other
+        self.write('leaf', 'value = 1\n')
+        self.write('other', 'value = 1\n')
+        self.write('user', self.reloading('leaf') +
+                   'from %s.leaf import value\n' % self.pkg)
+        self.write('top', self.reloading('user', 'other') +
+                   'from %s.user import value\n' % self.pkg)
+        # importer only imports a name from leaf, and topimporter reloads it
+        self.write('importer', 'from %s.leaf import value\n' % self.pkg)
+        self.write('topimporter', self.reloading('importer') +
+                   'from %s.importer import value\n' % self.pkg)
+        sys.path.insert(0, self.dir)
+        self.loads = __import__(self.pkg).loads
+
+    def tearDown(self):
+        sys.path.remove(self.dir)
+        for name in sys.modules.keys():
+            if name.startswith(self.pkg):
+                del sys.modules[name]
+                reloader._modules.pop(name, None)
+
+    def reloading(self, *names):
+        code = 'from buildbotcustom.reloader import reloadIfChanged\n'
+        for name in names:
+            code += 'import %s.%s\n' % (self.pkg, name)
+        for name in names:
+            code += 'reloadIfChanged(%s.%s)\n' % (self.pkg, name)
+        return code
+
+    def write(self, name, code, later=0):
+        path = os.path.join(self.dir, self.pkg, name + '.py')
+        if name != '__init__':
+            code += 'import %s\n%s.loads.append(%r)\n' % (self.pkg, self.pkg,
+                                                           name)
+        f = open(path, 'w')
+        f.write(code)
+        f.close()
+        # .pyc files only record the mtime to the second
+        mtime = os.path.getmtime(path) + later
+        os.utime(path, (mtime, mtime))
+        for ext in ('c', 'o'):
+            if os.path.exists(path + ext):
+                os.unlink(path + ext)
+
+    def load(self, top='top'):
+        """Loads top the way master.cfg does, and returns its value"""
+        name = '%s.%s' % (self.pkg, top)
+        if name in sys.modules:
+            top = reload(sys.modules[name])
+        else:
+            top = __import__(name, fromlist=['value'])
+        return top.value
+
+    def test_unchanged(self):
+        self.assertEquals(self.load(), 1)
+        # Modules that don't reload anything themselves are reloaded the
+        # first time, since we don't know when they were loaded
+        self.assertEquals(self.loads,
+                          ['leaf', 'leaf', 'user', 'other', 'other', 'top'])
+        del self.loads[:]
+        self.assertEquals(self.load(), 1)
+        self.assertEquals(self.loads, ['top'])
+
+    def test_leafChanged(self):
+        self.load()
+        del self.loads[:]
+        self.write('leaf', 'value = 22\n', later=10)
+        # user has to be reloaded to get the new value
+        self.assertEquals(self.load(), 22)
+        self.assertEquals(self.loads, ['leaf', 'user', 'top'])
+        del self.loads[:]
+        self.assertEquals(self.load(), 22)
+        self.assertEquals(self.loads, ['top'])
+
+    def test_reloadedElsewhere(self):
+        self.load()
+        del self.loads[:]
+        self.write('leaf', 'value = 22\n', later=10)
+        # Something else reloads leaf first
+        reloadIfChanged(sys.modules['%s.leaf' % self.pkg])
+        self.assertEquals(self.load(), 22)
+        self.assertEquals(self.loads, ['leaf', 'user', 'top'])
+
+    def test_forgetModules(self):
+        self.load()
+        del self.loads[:]
+        reloader.forgetModules()
+        self.assertEquals(self.load(), 1)
+        self.assertEquals(self.loads, ['leaf', 'user', 'other', 'top'])
+
+    def test_importedNameChanged(self):
+        self.assertEquals(self.load('topimporter'), 1)
+        del self.loads[:]
+        self.assertEquals(self.load('topimporter'), 1)
+        self.assertEquals(self.loads, ['topimporter'])
+        del self.loads[:]
+        self.write('leaf', 'value = 22\n', later=10)
+        # importer doesn't reload leaf itself, so leaf is reloaded first
+        self.assertEquals(self.load('topimporter'), 22)
+        self.assertEquals(self.loads, ['leaf', 'importer', 'topimporter'])
+
+    def test_importedNameReloadedElsewhere(self):
+        self.load('topimporter')
+        self.write('leaf', 'value = 22\n', later=10)
+        # Something else reloads leaf first, so importer is now older than
+        # it
+        reloadIfChanged(sys.modules['%s.leaf' % self.pkg])
+        del self.loads[:]
+        self.assertEquals(self.load('topimporter'), 22)
+        self.assertEquals(self.loads, ['importer', 'topimporter'])
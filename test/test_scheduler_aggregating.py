@@ -0,0 +1,141 @@
+import os
+import shutil
+from twisted.trial import unittest
+
+from buildbot.db import dbspec, connector
+from buildbot.db.schema.manager import DBSchemaManager
+from buildbot.util import now
+
+import mock
+
+from buildbotcustom.scheduler import AggregatingScheduler
+
+
+class TestAggregatingScheduler(unittest.TestCase):
+    basedir = "test_scheduler_aggregating"
+
+    def setUp(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        spec = dbspec.DBSpec.from_url("sqlite:///state.sqlite", self.basedir)
+        manager = DBSchemaManager(spec, self.basedir)
+        manager.upgrade()
+
+        self.dbc = connector.DBConnector(spec)
+        self.dbc.start()
+
+        self.s = AggregatingScheduler(name="agg", branch="b1",
+                                      builderNames=["down"],
+                                      upstreamBuilders=["up1", "up2"])
+        self.s.parent = mock.Mock()
+        self.s.parent.db = self.dbc
+        self.brid = 0
+
+        return self.dbc.addSchedulers([self.s])
+
+    def tearDown(self):
+        self.dbc.stop()
+        shutil.rmtree(self.basedir)
+
+    def addBuildRequest(self, buildername, results=0, delay=10):
+        self.brid += 1
+        self.dbc.runQueryNow("""INSERT INTO buildrequests (`id`, `buildsetid`, `complete`, `results`, `buildername`, `complete_at`, `submitted_at`) VALUES (%i, 0, 1, %i, '%s', %i, 1)""" % (self.brid, results, buildername, now() + delay))
+        return self.brid
+
+    def runScheduler(self, brids=(), reconcile=False):
+        self.dbc.runInteractionNow(
+            lambda t: self.s._run(t, brids, reconcile))
+
+    def numBuildsets(self):
+        return self.dbc.runQueryNow("SELECT COUNT(*) FROM buildsets")[0][0]
+
+    def getState(self):
+        return self.dbc.runInteractionNow(lambda t: self.s.get_state(t))
+
+    def testRetiredBuilds(self):
+        self.runScheduler([self.addBuildRequest("up1")])
+        self.assertEquals(self.getState()['remainingBuilders'], ["up2"])
+        self.assertEquals(self.numBuildsets(), 0)
+
+        # Failed builds and other builders don't count
+        self.runScheduler([self.addBuildRequest("up2", results=2),
+                           self.addBuildRequest("other")])
+        self.assertEquals(self.numBuildsets(), 0)
+
+        self.runScheduler([self.addBuildRequest("up2")])
+        self.assertEquals(self.numBuildsets(), 1)
+        self.assertEquals(self.getState()['remainingBuilders'],
+                          ["up1", "up2"])
+
+        # Reconciling doesn't count the same builds again
+        self.runScheduler(reconcile=True)
+        self.assertEquals(self.numBuildsets(), 1)
+        state = self.getState()
+        self.assertEquals(state['remainingBuilders'], ["up1", "up2"])
+        self.assertEquals(state['seenBuilds'], [])
+
+    def testReconcile(self):
+        # Builds that we weren't told about are found by findNewBuilds
+        self.addBuildRequest("up1")
+        self.runScheduler([self.addBuildRequest("up2")])
+        self.assertEquals(self.numBuildsets(), 0)
+        self.runScheduler(reconcile=True)
+        self.assertEquals(self.numBuildsets(), 1)
+
+        # Being told about them afterwards doesn't count them again
+        self.runScheduler([1, 2])
+        self.assertEquals(self.getState()['remainingBuilders'],
+                          ["up1", "up2"])
+
+    def testRunWithoutEvents(self):
+        self.s.parent.db = mock.Mock()
+        self.s.nextReconcile = now() + 100
+        self.assertEquals(self.s.run(), self.s.nextReconcile)
+        self.assertEquals(self.s.parent.db.runInteraction.call_count, 0)
+
+        self.s.buildRequestsRetired("retire-buildrequest", 1, 2)
+        self.s.run()
+        self.assertEquals(self.s.parent.db.runInteraction.call_count, 1)
+        self.assertEquals(
+            self.s.parent.db.runInteraction.call_args[0][1:],
+            ([1, 2], False))
+        self.assertEquals(self.s.retiredBrids, [])
+
+    def testSubscription(self):
+        self.s.parent.db = mock.Mock()
+        self.s.startService()
+        subscribe_to = self.s.parent.db.subscribe_to
+        retired = subscribe_to.call_args[0][1]
+        retired("retire-buildrequest", 1, 2)
+        self.assertEquals(self.s.retiredBrids, [1, 2])
+
+        # The connector is only subscribed to once
+        s2 = AggregatingScheduler(name="agg2", branch="b1",
+                                  builderNames=["down"],
+                                  upstreamBuilders=["up1"])
+        s2.parent = self.s.parent
+        s2.startService()
+        self.assertEquals(subscribe_to.call_count, 1)
+
+        # Stopped schedulers aren't told about retired requests any more
+        self.s.stopService()
+        s2.stopService()
+        retired("retire-buildrequest", 3)
+        self.assertEquals(self.s.retiredBrids, [])
+        self.assertEquals(s2.retiredBrids, [])
+
+    def testFailedReconcileWaits(self):
+        self.s.parent.db = mock.Mock()
+        self.s.parent.db.runInteraction.side_effect = Exception("db is down")
+        self.s.buildRequestsRetired("retire-buildrequest", 1, 2)
+        before = now()
+        d = self.s.run()
+
+        def check(nextReconcile):
+            # Don't come straight back to a failing database
+            self.assert_(nextReconcile >= before + self.s.reconcileInterval)
+            self.assertEquals(self.s.retiredBrids, [1, 2])
+        d.addCallback(check)
+        self.flushLoggedErrors(Exception)
+        return d
@@ -0,0 +1,84 @@
+import os
+import shutil
+from twisted.trial import unittest
+
+from buildbot.db import dbspec, connector
+from buildbot.db.schema.manager import DBSchemaManager
+from buildbot.changes.changes import Change
+
+import mock
+
+from buildbotcustom.scheduler import MultiScheduler, makePropertiesScheduler
+from buildbotcustom.misc_scheduler import buildUIDSchedFunc
+
+
+class TestMultiScheduler(unittest.TestCase):
+    basedir = "test_scheduler_multi"
+
+    def setUp(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        spec = dbspec.DBSpec.from_url("sqlite:///state.sqlite", self.basedir)
+        manager = DBSchemaManager(spec, self.basedir)
+        manager.upgrade()
+
+        self.dbc = connector.DBConnector(spec)
+        self.dbc.start()
+
+    def tearDown(self):
+        self.dbc.stop()
+        shutil.rmtree(self.basedir)
+
+    def makeScheduler(self, scheduler_class, **kwargs):
+        s = scheduler_class(name="s", branch="b1", treeStableTimer=None,
+                            builderNames=["b1", "b2"],
+                            numberOfBuildsToTrigger=3, **kwargs)
+        s.parent = mock.Mock()
+        s.parent.db = self.dbc
+        return s
+
+    def addChange(self, revision):
+        c = Change(who='me!', branch='b1', revision=revision, files=[],
+                   comments='really important')
+        self.dbc.addChangeToDatabase(c)
+        return c
+
+    def testBuildsets(self):
+        s = self.makeScheduler(MultiScheduler)
+        d = self.dbc.addSchedulers([s])
+
+        def check(_):
+            important = [self.addChange('r1'), self.addChange('r2')]
+            self.dbc.runInteractionNow(
+                lambda t: s._add_build_and_remove_changes(t, important, []))
+            rows = self.dbc.runQueryNow("""SELECT sourcestamps.revision,
+                    COUNT(DISTINCT buildsets.id), COUNT(buildrequests.id),
+                    COUNT(DISTINCT sourcestamps.id)
+                FROM buildsets, sourcestamps, buildrequests
+                WHERE buildsets.sourcestampid = sourcestamps.id AND
+                    buildrequests.buildsetid = buildsets.id
+                GROUP BY sourcestamps.revision ORDER BY sourcestamps.revision
+                """)
+            # 3 buildsets per change, sharing a sourcestamp
+            self.assertEquals([tuple(r) for r in rows],
+                              [('r1', 3, 6, 1), ('r2', 3, 6, 1)])
+            self.assertEquals(s.parent.publish_buildset.call_count, 6)
+        d.addCallback(check)
+        return d
+
+    def testPropFuncs(self):
+        s = self.makeScheduler(
+            makePropertiesScheduler(MultiScheduler, [buildUIDSchedFunc]))
+        d = self.dbc.addSchedulers([s])
+
+        def check(_):
+            important = [self.addChange('r1')]
+            self.dbc.runInteractionNow(
+                lambda t: s._add_build_and_remove_changes(t, important, []))
+            rows = self.dbc.runQueryNow("""SELECT DISTINCT property_value
+                FROM buildset_properties WHERE property_name = 'builduid'""")
+            # Each buildset gets its own builduid
+            self.assertEquals(len(rows), 3)
+        d.addCallback(check)
+        return d
@@ -0,0 +1,65 @@
+import os
+import shutil
+from twisted.trial import unittest
+
+from buildbot.db import dbspec, connector
+from buildbot.db.schema.manager import DBSchemaManager
+
+import mock
+
+from buildbotcustom.scheduler import PersistentScheduler
+
+
+class TestPersistentScheduler(unittest.TestCase):
+    basedir = "test_scheduler_persistent"
+
+    def setUp(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        spec = dbspec.DBSpec.from_url("sqlite:///state.sqlite", self.basedir)
+        manager = DBSchemaManager(spec, self.basedir)
+        manager.upgrade()
+
+        self.dbc = connector.DBConnector(spec)
+        self.dbc.start()
+
+        self.s = PersistentScheduler(name="p", numPending=3,
+                                     builderNames=["b1", "b2", "b3"])
+        self.s.parent = mock.Mock()
+        self.s.parent.db = self.dbc
+
+        return self.dbc.addSchedulers([self.s])
+
+    def tearDown(self):
+        self.dbc.stop()
+        shutil.rmtree(self.basedir)
+
+    def addBuildRequest(self, buildername, claimed_at=0, complete=0):
+        self.dbc.runQueryNow("""INSERT INTO buildrequests (`buildsetid`, `complete`, `buildername`, `claimed_at`, `submitted_at`) VALUES (0, %i, '%s', %i, 1)""" % (complete, buildername, claimed_at))
+
+    def pendingCounts(self):
+        return self.dbc.runInteractionNow(self.s.get_pending_counts)
+
+    def testPendingCounts(self):
+        self.addBuildRequest("b1")
+        self.addBuildRequest("b1")
+        self.addBuildRequest("b2")
+        # Claimed and complete requests aren't pending
+        self.addBuildRequest("b2", claimed_at=10)
+        self.addBuildRequest("b3", complete=1)
+        self.addBuildRequest("other")
+        self.assertEquals(self.pendingCounts(), {'b1': 2, 'b2': 1, 'b3': 0})
+
+    def testRun(self):
+        self.addBuildRequest("b1")
+        self.addBuildRequest("b2", claimed_at=10)
+        self.dbc.runInteractionNow(self.s._run)
+        self.assertEquals(self.pendingCounts(), {'b1': 3, 'b2': 3, 'b3': 3})
+        self.assertEquals(self.dbc.runQueryNow(
+            "SELECT COUNT(*) FROM buildsets")[0][0], 8)
+
+        # Nothing more is needed
+        self.dbc.runInteractionNow(self.s._run)
+        self.assertEquals(self.dbc.runQueryNow(
+            "SELECT COUNT(*) FROM buildsets")[0][0], 8)
@@ -0,0 +1,107 @@
+import os
+import shutil
+import cPickle
+from types import InstanceType
+from twisted.trial import unittest
+
+from buildbot.status.builder import BuildStepStatus, BuilderStatus
+
+import mock
+
+from buildbotcustom.status.build_files import loadBuild, writeBuildSummary, \
+    loadBuildSummary
+
+
+class FakeLog(object):
+    def __init__(self, name):
+        self.name = name
+        self.step = None
+
+    def __getstate__(self):
+        return {'name': self.name}
+
+
+class FakeBuild(object):
+    def __init__(self, steps):
+        self.steps = steps
+
+
+def makeStep(name, logs):
+    # Skip __init__, which wants a real parent build
+    return InstanceType(BuildStepStatus, dict(
+        name=name, logs=logs, watchers=[], finishedWatchers=[], updates={},
+        build=None))
+
+
+class TestBuildFiles(unittest.TestCase):
+    basedir = "test_status_build_files"
+
+    def setUp(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(os.path.join(self.basedir, "builder1"))
+        self.build_path = os.path.join(self.basedir, "builder1", "12")
+
+        build = FakeBuild([makeStep("compile", [FakeLog("stdio"),
+                                                 FakeLog("warnings")])])
+        cPickle.dump(build, open(self.build_path, "wb"))
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def testLoadBuildWithLogs(self):
+        build = loadBuild(self.build_path)
+        step = build.steps[0]
+        self.assertEquals([l.name for l in step.logs], ["stdio", "warnings"])
+        self.assert_(step.logs[0].step is step)
+        self.assertEquals(build.builder.name, "builder1")
+
+    def testLoadBuildWithoutLogs(self):
+        orig_setstate = BuildStepStatus.__dict__['__setstate__']
+        build = loadBuild(self.build_path, logs=False)
+        self.assertEquals(build.steps[0].name, "compile")
+        self.assertEquals(build.steps[0].logs, [])
+        # Other loads are not affected
+        self.assert_(BuildStepStatus.__dict__['__setstate__'] is
+                     orig_setstate)
+        build = loadBuild(self.build_path)
+        self.assertEquals(len(build.steps[0].logs), 2)
+
+    def testLoadMissingBuild(self):
+        self.assertRaises(ValueError, loadBuild,
+                          os.path.join(self.basedir, "builder1", "13"))
+
+    def testBuildSummary(self):
+        self.assertEquals(loadBuildSummary(self.build_path), None)
+
+        build = mock.Mock()
+        build.getBuilder.return_value.getName.return_value = "builder1"
+        build.getNumber.return_value = 12
+        build.asDict.return_value = {'properties': [['branch', 'try', 'b']]}
+        writeBuildSummary(build, self.build_path)
+
+        self.assertEquals(loadBuildSummary(self.build_path), {
+            'builder': 'builder1',
+            'number': 12,
+            'build': {'properties': [['branch', 'try', 'b']]},
+        })
+
+    def testBuildSummaryPruned(self):
+        build = mock.Mock()
+        build.getBuilder.return_value.getName.return_value = "builder1"
+        build.getNumber.return_value = 12
+        build.asDict.return_value = {}
+        writeBuildSummary(build, self.build_path)
+        builder_path = os.path.join(self.basedir, "builder1")
+        self.assertEquals(sorted(os.listdir(builder_path)),
+                          ["12", "12-summary.json"])
+
+        # buildbot deletes it along with the build
+        builder = BuilderStatus("builder1")
+        builder.basedir = builder_path
+        builder.events = []
+        builder.buildCache = {}
+        builder.nextBuildNumber = 20
+        builder.buildHorizon = builder.logHorizon = 5
+        builder.prune()
+        self.assertEquals(os.listdir(builder_path), [])
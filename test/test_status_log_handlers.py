@@ -0,0 +1,138 @@
+import sys
+import threading
+from twisted.trial import unittest
+from twisted.python import log
+from twisted.internet import defer
+
+import mock
+
+from buildbotcustom.status.log_handlers import ThreadedLogHandler, \
+    SubprocessLogHandler
+
+
+def makeBuild(number):
+    build = mock.Mock()
+    build.getNumber.return_value = number
+    build.getBuilder.return_value.getName.return_value = 'b1'
+    return build
+
+
+class TestThreadedLogHandlerQueue(unittest.TestCase):
+    def makeHandler(self, **kwargs):
+        handler = ThreadedLogHandler(**kwargs)
+        # Don't actually run anything, just record what would run
+        handler.runQueued = lambda: None
+        return handler
+
+    def queued(self, handler):
+        return [q[1].getNumber() for q in handler.queued]
+
+    def testDropNew(self):
+        handler = self.makeHandler(max_queued=2)
+        for i in range(3):
+            handler.queueBuild(mock.Mock(), makeBuild(i), 0)
+        self.assertEquals(self.queued(handler), [0, 1])
+        self.assertEquals(handler.getStats()['dropped'], 1)
+
+    def testDropOld(self):
+        handler = self.makeHandler(max_queued=2, overflow='drop-old')
+        for i in range(3):
+            handler.queueBuild(mock.Mock(), makeBuild(i), 0)
+        self.assertEquals(self.queued(handler), [1, 2])
+        self.assertEquals(handler.getStats()['dropped'], 1)
+
+    def testBadOverflow(self):
+        self.assertRaises(ValueError, ThreadedLogHandler, overflow='block')
+
+
+class TestThreadedLogHandlerPool(unittest.TestCase):
+    def setUp(self):
+        self.handler = ThreadedLogHandler(concurrency=1)
+        self.handler.pool.start()
+
+    def tearDown(self):
+        if not self.handler.pool.joined:
+            self.handler.pool.stop()
+
+    def testConcurrency(self):
+        handled = []
+        done = defer.Deferred()
+        self.handler.handleLogs = lambda builder, build, results: \
+            handled.append(build.getNumber())
+
+        orig_handled = self.handler._handled
+
+        def _handled(result):
+            orig_handled(result)
+            if not self.handler.running and not self.handler.queued:
+                done.callback(None)
+        self.handler._handled = _handled
+
+        for i in range(3):
+            self.handler.queueBuild(mock.Mock(), makeBuild(i), 0)
+        self.assertEquals(self.handler.running, 1)
+        self.assertEquals(len(self.handler.queued), 2)
+
+        def check(_):
+            self.assertEquals(handled, [0, 1, 2])
+            stats = self.handler.getStats()
+            self.assertEquals(stats['handled'], 3)
+            self.assertEquals(stats['dropped'], 0)
+        done.addCallback(check)
+        return done
+
+    def testStopServiceWaitsOffReactor(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def handleLogs(builder, build, results):
+            started.set()
+            release.wait()
+        self.handler.handleLogs = handleLogs
+        self.handler.queueBuild(mock.Mock(), makeBuild(0), 0)
+        started.wait()
+
+        # stopService returns without blocking on the running build
+        d = self.handler.stopService()
+        self.assertFalse(d.called)
+        release.set()
+
+        def check(_):
+            self.assert_(self.handler.pool.joined)
+        d.addCallback(check)
+        return d
+
+
+class TestSubprocessLogHandler(unittest.TestCase):
+    def setUp(self):
+        self.messages = []
+        log.addObserver(self.observe)
+
+    def tearDown(self):
+        log.removeObserver(self.observe)
+
+    def observe(self, event):
+        self.messages.extend(event['message'])
+
+    def runCommand(self, script, max_output):
+        handler = SubprocessLogHandler(
+            [sys.executable, '-c', script], max_output=max_output)
+        handler.master_status = mock.Mock()
+        handler.master_status.basedir = '/master'
+        builder = mock.Mock()
+        builder.basedir = 'b1'
+        build = makeBuild(1)
+        build.getProperties.return_value.render = lambda cmd: cmd
+        handler.handleLogs(builder, build, 0)
+
+    def testOutput(self):
+        self.runCommand("print 'hello'; print 'world'", 100)
+        self.assert_("Log output: hello" in self.messages)
+        self.assert_("Log output: world" in self.messages)
+
+    def testTruncated(self):
+        self.runCommand("print 'a' * 10; print 'b' * 10", 15)
+        self.assert_("Log output: aaaaaaaaaa" in self.messages)
+        self.assert_("Log output: bbbb" in self.messages)
+        self.assert_("Log output truncated; discarded 7 bytes"
+                     in self.messages)
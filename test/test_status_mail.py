@@ -0,0 +1,158 @@
+import smtpd
+import asyncore
+import threading
+import email
+from twisted.trial import unittest
+from twisted.internet import defer, reactor, task
+
+from buildbot.changes.changes import Change
+
+from buildbotcustom.status.mail import PooledSMTPSender, ChangeNotifier, \
+    MercurialEmailLookup
+
+
+class LocalSMTPServer(smtpd.SMTPServer):
+    """A stand-in SMTP server that records the messages it receives"""
+
+    def __init__(self):
+        smtpd.SMTPServer.__init__(self, ('127.0.0.1', 0), None)
+        self.port = self.socket.getsockname()[1]
+        self.messages = []
+        self.connections = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.serve)
+        self.thread.start()
+
+    def handle_accept(self):
+        self.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((mailfrom, sorted(rcpttos),
+                              email.message_from_string(data)))
+
+    def serve(self):
+        while self.running:
+            asyncore.loop(timeout=0.05, count=1)
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+        self.close()
+        asyncore.close_all()
+
+
+class TestPooledSMTPSender(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalSMTPServer()
+        self.sender = PooledSMTPSender('127.0.0.1', self.server.port,
+                                       maxConnections=1, idleTimeout=60)
+        self.sender.start()
+
+    def tearDown(self):
+        d = self.sender.stop()
+        d.addCallback(lambda _: self.server.stop())
+        return d
+
+    @defer.inlineCallbacks
+    def testReusesConnection(self):
+        for i in range(3):
+            yield self.sender.sendmail('from@example.com', ['to@example.com'],
+                                       'Subject: %i\n\nhello\n' % i)
+        self.assertEquals(len(self.server.messages), 3)
+        self.assertEquals(self.server.connections, 1)
+        self.assertEquals(self.sender.connections_opened, 1)
+
+    @defer.inlineCallbacks
+    def testIdleConnectionsClosed(self):
+        yield self.sender.sendmail('from@example.com', ['to@example.com'],
+                                   'Subject: 1\n\nhello\n')
+        self.sender.idleTimeout = 0
+        yield self.sender.closeIdle()
+        self.assertEquals(self.sender.idle, [])
+        yield self.sender.sendmail('from@example.com', ['to@example.com'],
+                                   'Subject: 2\n\nhello\n')
+        self.assertEquals(self.sender.connections_opened, 2)
+
+    @defer.inlineCallbacks
+    def testStopClosesConnections(self):
+        yield self.sender.sendmail('from@example.com', ['to@example.com'],
+                                   'Subject: 1\n\nhello\n')
+        d = self.sender.stop()
+        # Connections are closed off the reactor thread
+        self.failIf(d.called)
+        yield d
+        self.assertEquals(self.sender.idle, [])
+        self.assert_(self.sender.pool.joined)
+
+
+class TestChangeNotifierDigest(unittest.TestCase):
+    def setUp(self):
+        self.server = LocalSMTPServer()
+        self.notifier = ChangeNotifier(
+            fromaddr='try@example.com', lookup=MercurialEmailLookup(),
+            relayhost='127.0.0.1', smtpPort=self.server.port,
+            extraRecipients=['extra@example.com'], smtpMaxConnections=1,
+            digestDelay=0.2)
+        self.notifier.sender.start()
+
+    def tearDown(self):
+        d = self.notifier.sender.stop()
+        d.addCallback(lambda _: self.server.stop())
+        return d
+
+    def addChange(self, rev, who='dev@example.com', branch='try'):
+        change = Change(who, [], 'change %s\ntry: -b o' % rev,
+                        revision=rev, branch=branch)
+        return self.notifier.changeAdded(change)
+
+    @defer.inlineCallbacks
+    def testDigest(self):
+        for rev in ('aaa', 'bbb', 'ccc'):
+            yield self.addChange(rev)
+        yield self.addChange('ddd', who='other@example.com')
+        self.assertEquals(len(self.notifier.digests), 2)
+
+        yield task.deferLater(reactor, 0.5, lambda: None)
+        self.assertEquals(self.notifier.digests, {})
+        self.assertEquals(len(self.server.messages), 2)
+        messages = dict((m['To'], m) for _, _, m in self.server.messages)
+        m = messages['dev@example.com']
+        self.assertEquals(m['Subject'],
+                          "Notifcation of change ccc on branch try (3 changes)")
+        self.assertEquals(m['CC'], "extra@example.com")
+        body = m.get_payload(decode=True)
+        self.assert_("aaa - dev@example.com: change aaa" in body)
+        self.assert_("ccc - dev@example.com: change ccc" in body)
+        self.assertEquals(messages['other@example.com']['Subject'],
+                          "Notifcation of change ddd on branch try")
+
+    @defer.inlineCallbacks
+    def testMaxChanges(self):
+        self.notifier.digestMaxChanges = 2
+        yield self.addChange('aaa')
+        yield self.addChange('bbb')
+        self.assertEquals(self.notifier.digests, {})
+        self.assertEquals(len(self.server.messages), 1)
+        self.assert_(self.server.messages[0][2]['Subject'].endswith(
+                     "(2 changes)"))
+
+    @defer.inlineCallbacks
+    def testStopWithBrokenDigest(self):
+        yield self.addChange('aaa')
+        yield self.addChange('bbb', who='other@example.com')
+        createDigestEmail = self.notifier.createDigestEmail
+
+        def brokenForAaa(entries):
+            if entries[0][1].revision == 'aaa':
+                raise ValueError("broken")
+            return createDigestEmail(entries)
+        self.notifier.createDigestEmail = brokenForAaa
+
+        # The other digest is still sent
+        yield self.notifier.stopService()
+        self.assertEquals(self.notifier.digests, {})
+        self.assertEquals(len(self.server.messages), 1)
+        self.assertEquals(self.server.messages[0][2]['To'],
+                          'other@example.com')
+        self.assertEquals(len(self.flushLoggedErrors(ValueError)), 1)
@@ -0,0 +1,201 @@
+import os
+import shutil
+import gzip
+from cStringIO import StringIO
+from twisted.trial import unittest
+
+from buildbot.util import json
+
+import mock
+
+from buildbotcustom.status.pulse import PulseStatus
+
+
+class FakeQueueDir(object):
+    def __init__(self):
+        self.items = []
+
+    def add(self, data):
+        self.items.append(data)
+
+
+def makeEvents(n):
+    return [{'event': 'build.b%i.finished' % i, 'payload': 'x' * 30}
+            for i in range(n)]
+
+
+class TestPulseWrites(unittest.TestCase):
+    def setUp(self):
+        self.queuedir = FakeQueueDir()
+
+    def testSingleFile(self):
+        pulse = PulseStatus(self.queuedir)
+        events = makeEvents(20)
+        files, nbytes = pulse._writeEvents(events)
+        self.assertEquals(files, 1)
+        self.assertEquals(json.loads(self.queuedir.items[0]), events)
+        self.assertEquals(nbytes, len(self.queuedir.items[0]))
+
+    def testSplitOnMaxBytes(self):
+        pulse = PulseStatus(self.queuedir, max_bytes=200)
+        events = makeEvents(20)
+        files, nbytes = pulse._writeEvents(events)
+        self.assertEquals(files, len(self.queuedir.items))
+        self.assert_(files > 1)
+        written = []
+        for data in self.queuedir.items:
+            self.assert_(len(data) <= 200)
+            written.extend(json.loads(data))
+        self.assertEquals(written, events)
+
+    def testCompress(self):
+        pulse = PulseStatus(self.queuedir, compress=True)
+        events = makeEvents(3)
+        pulse._writeEvents(events)
+        data = gzip.GzipFile(fileobj=StringIO(self.queuedir.items[0])).read()
+        self.assertEquals(json.loads(data), events)
+
+    def testStats(self):
+        pulse = PulseStatus(self.queuedir)
+        events = makeEvents(5)
+        pulse._pushed(pulse._writeEvents(events), events)
+        stats = pulse.getStats()
+        self.assertEquals(stats['events'], 5)
+        self.assertEquals(stats['files'], 1)
+        self.assertEquals(stats['queue_depth'], 0)
+        self.assert_(stats['events_per_sec'] > 0)
+        # Rates are measured since the last call
+        self.assertEquals(pulse.getStats()['events_per_sec'], 0)
+
+
+class TestPulseFilters(unittest.TestCase):
+    def makePulse(self, **kwargs):
+        pulse = PulseStatus(FakeQueueDir(), **kwargs)
+        pulse.status = mock.Mock()
+        pulse.status.getBuilder.return_value.basedir = '/masters/m1/b.1'
+        return pulse
+
+    def testNoFilters(self):
+        pulse = self.makePulse()
+        self.assert_(pulse._wantEvent('build.b1.1.step.compile.started'))
+        self.assertEquals(pulse.stats['filtered'], 0)
+
+    def testEvents(self):
+        pulse = self.makePulse(events=['build.*.*.finished', 'slave.#'])
+        self.assert_(pulse._wantEvent('build.b1.1.finished'))
+        self.assert_(pulse._wantEvent('slave.s1.connected'))
+        self.assert_(not pulse._wantEvent('build.b1.1.started'))
+        self.assert_(not pulse._wantEvent('build.b1.1.step.compile.finished'))
+        self.assert_(not pulse._wantEvent('heartbeat'))
+        self.assertEquals(pulse.stats['filtered'], 3)
+
+    def testWildcardWithinWord(self):
+        pulse = self.makePulse(events=['build.*-debug-*.#'])
+        self.assert_(pulse._wantEvent('build.linux-debug-test.1.finished'))
+        self.assert_(not pulse._wantEvent('build.linux-opt-test.1.finished'))
+
+    def testIgnoreEvents(self):
+        pulse = self.makePulse(ignoreEvents=['build.*.*.step.#', '#.log.#'])
+        self.assert_(pulse._wantEvent('build.b1.1.finished'))
+        self.assert_(pulse._wantEvent('heartbeat'))
+        self.assert_(not pulse._wantEvent('build.b1.1.step.compile.started'))
+        self.assert_(not pulse._wantEvent('build.b1.1.step.s.log.stdio.chunk'))
+
+    def testFilteredEventsAreNotQueued(self):
+        pulse = self.makePulse(events=['build.*.*.finished'])
+        build = mock.Mock()
+        build.builder.name = 'b 1'
+        build.number = 3
+        step = mock.Mock()
+        step.name = 'compile'
+        pulse.stepFinished(build, step, 0)
+        self.assertEquals(pulse.queue.nbItems(), 0)
+        self.assertEquals(pulse.stats['filtered'], 1)
+        self.assertEquals(build.getProperties.call_count, 0)
+
+    def testWantedEventsFilteredOnce(self):
+        pulse = self.makePulse()
+        pulse._wantEvent = mock.Mock(return_value=True)
+        pulse._pushWanted = mock.Mock()
+        build = mock.Mock()
+        build.builder.name = 'b1'
+        build.number = 3
+        step = mock.Mock()
+        step.name = 'compile'
+        pulse.stepFinished(build, step, 0)
+        self.assertEquals(pulse._wantEvent.call_count, 1)
+        self.assertEquals(pulse._pushWanted.call_count, 1)
+
+    def testBuilderNameCache(self):
+        pulse = self.makePulse()
+        self.assertEquals(pulse._escapedBuilderName('b 1'), 'b_1')
+        self.assertEquals(pulse._escapedBuilderName('b 1'), 'b_1')
+        self.assertEquals(pulse.status.getBuilder.call_count, 1)
+        pulse.builderRemoved('b 1')
+        self.assertEquals(pulse._escapedBuilderName('b 1'), 'b_1')
+        self.assertEquals(pulse.status.getBuilder.call_count, 2)
+
+
+class TestPulseDrain(unittest.TestCase):
+    basedir = "test_status_pulse"
+
+    def setUp(self):
+        if os.path.exists(self.basedir):
+            shutil.rmtree(self.basedir)
+        os.makedirs(self.basedir)
+        self.queuedir = FakeQueueDir()
+        self.recovery_file = os.path.join(self.basedir, 'recovery.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def makePulse(self, **kwargs):
+        pulse = PulseStatus(self.queuedir, recovery_file=self.recovery_file,
+                            max_events=10, **kwargs)
+        pulse.status = mock.Mock()
+        pulse.status.botmaster.master_name = 'm1'
+        pulse.status.botmaster.master_incarnation = 'i1'
+        pulse._writer.start()
+        for e in makeEvents(25):
+            pulse.queue.pushItem(e)
+        return pulse
+
+    def written(self):
+        retval = []
+        for data in self.queuedir.items:
+            retval.extend(json.loads(data))
+        return retval
+
+    def testDrain(self):
+        pulse = self.makePulse()
+        d = pulse._drain()
+
+        def check(_):
+            self.assertEquals(len(self.queuedir.items), 3)
+            self.assertEquals([e['event'] for e in self.written()],
+                              [e['event'] for e in makeEvents(25)])
+            self.assertEquals(self.written()[0]['master_name'], 'm1')
+            self.assert_(not os.path.exists(self.recovery_file))
+            self.assert_(not pulse._writerRunning())
+        d.addCallback(check)
+        return d
+
+    def testDrainTimeoutAndReplay(self):
+        pulse = self.makePulse(drain_timeout=0)
+        d = pulse._drain()
+
+        def check(_):
+            self.assertEquals(self.queuedir.items, [])
+            self.assertEquals(len(json.load(open(self.recovery_file))), 25)
+
+            # Replay on the next startup
+            pulse = PulseStatus(self.queuedir,
+                                recovery_file=self.recovery_file)
+            pulse._writer.start()
+            pulse._replayRecoveryFile()
+            self.assert_(not os.path.exists(self.recovery_file))
+            pulse._writer.stop()
+            self.assertEquals([e['event'] for e in self.written()],
+                              [e['event'] for e in makeEvents(25)])
+        d.addCallback(check)
+        return d
@@ -1,3 +1,4 @@
+from __future__ import with_statement
 import os
 import shutil
 
@@ -16,6 +17,7 @@ from buildbot.steps.dummy import Dummy
 from buildbot.sourcestamp import SourceStamp
 from buildbot.process.properties import Properties
 
+from buildbotcustom.common import genBuildID
 from buildbotcustom.process.factory import RequestSortingBuildFactory
 
 import mock
@@ -381,3 +383,56 @@ class TestTestOrder(unittest.TestCase):
         d.addCallback(startBuild)
 
         return d
+
+
+class TestRequestSortKeys(unittest.TestCase):
+
+    def makeRequest(self, brid, buildid=None, changeBuildids=(),
+                    reason='scheduler', submittedAt=1297641600):
+        request = mock.Mock()
+        request.id = brid
+        request.reason = reason
+        request.submittedAt = submittedAt
+        request.properties = Properties()
+        if buildid:
+            request.properties.setProperty('buildid', buildid, 'test')
+        request.source.changes = [mock.Mock(properties={'buildid': b})
+                                  for b in changeBuildids]
+        return request
+
+    def test_sortKeys(self):
+        factory = RequestSortingBuildFactory([Dummy()])
+        # The greatest buildid wins, and junk is ignored
+        r1 = self.makeRequest(1, '20110301000002',
+                              ['20110301000003', 'junk'])
+        # Rebuilds use their submission time
+        r2 = self.makeRequest(2, '20110301000005', reason='Rebuilt by me')
+        # As do requests without buildids
+        r3 = self.makeRequest(3, submittedAt=1297641601)
+        self.assertEquals(factory.getSortKey(r1), 20110301000003)
+        self.assertEquals(factory.getSortKey(r2), int(genBuildID(1297641600)))
+        self.assertEquals(factory.getSortKey(r3), int(genBuildID(1297641601)))
+
+        with mock.patch.object(BuildFactory, 'newBuild') as newBuild:
+            factory.newBuild([r1, r2, r3])
+            self.assertEquals(newBuild.call_args[0][1], [r2, r3, r1])
+
+    def test_cachedKeys(self):
+        factory = RequestSortingBuildFactory([Dummy()])
+        factory.sortKeyCacheSize = 2
+        r1 = self.makeRequest(1, '20110214000001')
+        self.assertEquals(factory.getSortKey(r1), 20110214000001)
+
+        # The same request, loaded again, isn't looked at again
+        r1 = self.makeRequest(1, 'junk')
+        self.assertEquals(factory.getSortKey(r1), 20110214000001)
+
+        # Requests that aren't from the db aren't cached
+        r = self.makeRequest(None, '20110214000004')
+        self.assertEquals(factory.getSortKey(r), 20110214000004)
+        self.assertEquals(factory._sortkeys.keys(), [1])
+
+        # The cache is emptied when it gets too big
+        factory.getSortKey(self.makeRequest(2, '20110214000002'))
+        factory.getSortKey(self.makeRequest(3, '20110214000003'))
+        self.assertEquals(factory._sortkeys.keys(), [3])
@@ -1,4 +1,4 @@
-from buildbotcustom.try_parser import TryParser, processMessage
+from buildbotcustom.try_parser import TryParser, TryParserIndex, processMessage
 import unittest
 
 
@@ -639,5 +639,42 @@ try: -this -should -be -ignored""")
 try: -a -b -c""")
 
 
+class TestTryParserIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = TryParserIndex(
+            VALID_TESTER_NAMES + VALID_UPN, TESTER_PRETTY_NAMES,
+            UNITTEST_PRETTY_NAMES, UNITTEST_SUITES, TALOS_SUITES)
+
+    def test_SameAsTryParser(self):
+        for msg in ['try: -b do -p all -u all -t all',
+                    'try: -b d -p win32 -u crashtest,mochitest-other',
+                    'try: -b o -p full -u reftest -t tp4',
+                    'try: -b do -p linux -u mochitest-1[Fedora] -t none',
+                    'no try syntax']:
+            expected = TryParser(msg, VALID_TESTER_NAMES + VALID_UPN,
+                                 TESTER_PRETTY_NAMES, UNITTEST_PRETTY_NAMES,
+                                 UNITTEST_SUITES, TALOS_SUITES)
+            self.assertEqual(sorted(self.index.parse(msg)), sorted(expected))
+
+    def test_Memoized(self):
+        first = self.index.parse('try: -b do -p win32 -u all')
+        # Same arguments, different message
+        second = self.index.parse('Bug 1 - blah\ntry: -b do -p win32 -u all')
+        self.assertEqual(first, second)
+        self.assertEqual((self.index.hits, self.index.misses), (1, 1))
+
+        # Callers get their own list
+        second.append('bogus')
+        self.assertEqual(self.index.parse('try: -b do -p win32 -u all'), first)
+
+    def test_MaxCached(self):
+        self.index.maxCached = 2
+        for platform in ['linux', 'win32', 'macosx64']:
+            self.index.parse('try: -b o -p %s' % platform)
+        self.assertEqual(len(self.index.cache), 1)
+        self.assertEqual(self.index.misses, 3)
+
+
 if __name__ == '__main__':
     unittest.main()
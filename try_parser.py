@@ -253,10 +253,7 @@ def parseTestOptions(s, unittestSuites):
     return list(all_tests), restrictions_map
 
 
-def TryParser(
-    message, builderNames, prettyNames, unittestPrettyNames=None, unittestSuites=None, talosSuites=None,
-        buildbotBranch='try'):
-
+def _makeArgParser():
     parser = argparse.ArgumentParser(description='Pass in a commit message and a list \
                                      and tryParse populates the list with the builderNames\
                                      that need schedulers.')
@@ -277,106 +274,262 @@ def TryParser(
                         default='none',
                         dest='talos',
                         help='provide a list of talos tests, or specify all (default is None)')
+    return parser
 
-    (options, unknown_args) = parser.parse_known_args(processMessage(message))
+# parse_known_args doesn't modify the parser, so one will do for everybody
+_argParser = _makeArgParser()
 
+
+def parseBuildTypes(build):
     # Build options include a possible override of 'all' to get a buildset
     # that matches m-c
-    if options.build == 'do' or options.build == 'od':
-        options.build = ['opt', 'debug']
-    elif options.build == 'd':
-        options.build = ['debug']
-    elif options.build == 'o':
-        options.build = ['opt']
+    if build == 'do' or build == 'od':
+        return ['opt', 'debug']
+    elif build == 'd':
+        return ['debug']
+    elif build == 'o':
+        return ['opt']
     else:
         # for any input other than do/od, d, o, all set to default
-        options.build = ['opt', 'debug']
-
-    if unittestSuites:
-        all_platforms = prettyNames.keys()
-    else:
-        # for build builders (as opposed to test builders), check against the
-        # prettyNames for -debug
-        all_platforms = set()
-        if 'debug' in options.build:
-            all_platforms.update(
-                [p for p in prettyNames.keys() if p.endswith('debug')])
-        if 'opt' in options.build:
-            all_platforms.update(
-                [p for p in prettyNames.keys() if not p.endswith('debug')])
-
-        # Strip off -debug. It gets tacked on in the getPlatformBuilders for
-        # buildType == debug
-        all_platforms = list(
-            set([p.replace('-debug', '') for p in all_platforms]))
-
-    # Platforms whose prettyNames all have 'try-nondefault' in them are not
-    # included in -p all
-    default_platforms = set()
-    if unittestSuites:
-        for p in all_platforms:
-            default_platforms.update(
-                [p for n in prettyNames[p] if 'try-nondefault' not in n])
-    else:
-        defaultPrettyNames = dict([(k, v)
-                                   for k, v in prettyNames.items()
-                                   if 'try-nondefault' not in v])
-        for p in all_platforms:
-            if p in defaultPrettyNames:
-                default_platforms.add(p)
-            elif p + '-debug' in defaultPrettyNames:
-                default_platforms.add(p)
-
-    user_platforms = set()
-    for platform in options.user_platforms.split(','):
-        if platform == 'all':
-            user_platforms.update(default_platforms)
-        elif platform == 'full':
-            user_platforms.update(all_platforms)
+        return ['opt', 'debug']
+
+
+class TryParserIndex(object):
+    '''Does what TryParser does for one set of builders, with everything
+    that only depends on the builders worked out up front.  Schedulers
+    should keep one of these around rather than calling TryParser for each
+    push.
+
+    The builders for each try syntax are also remembered, up to maxCached
+    different messages.  Set maxCached to 0 to turn that off.'''
+
+    def __init__(self, builderNames, prettyNames, unittestPrettyNames=None,
+                 unittestSuites=None, talosSuites=None, buildbotBranch='try',
+                 maxCached=1000):
+        self.builderNames = frozenset(builderNames)
+        self.prettyNames = prettyNames
+        self.unittestPrettyNames = unittestPrettyNames
+        self.unittestSuites = unittestSuites
+        self.talosSuites = talosSuites
+        self.buildbotBranch = buildbotBranch
+        self.maxCached = maxCached
+        # tuple of try syntax arguments -> builder names
+        self.cache = {}
+        self.hits = 0
+        self.misses = 0
+
+        # tuple of build types -> (all platforms, default platforms)
+        self.platforms = {}
+        for buildTypes in (['opt', 'debug'], ['debug'], ['opt']):
+            self.platforms[tuple(buildTypes)] = \
+                self._getPlatforms(buildTypes)
+
+        # (expanded) platform -> builder name, as in getPlatformBuilders.
+        # When prettyNames contains list values rather than simple strings,
+        # it means that we're processing the argument for selecting test
+        # suites, so there are no build builders.
+        self.platformBuilders = {}
+        if not (prettyNames and isinstance(prettyNames.values()[0], list)):
+            for p, pretty in prettyNames.items():
+                builder = basePlatform(pretty)
+                if builder in self.builderNames:
+                    self.platformBuilders[p] = builder
+
+        # (platform, buildType, test) -> [(builder name, isDefault)] for
+        # test master unittests, as in getTestBuilders
+        self.testBuilders = {}
+        if unittestSuites:
+            for platform, pretties in prettyNames.items():
+                if not isinstance(pretties, list):
+                    pretties = [pretties]
+                for buildType in ('opt', 'debug'):
+                    for test in unittestSuites:
+                        builders = []
+                        for pretty in pretties:
+                            base_pretty = basePlatform(pretty)
+                            custom_builder = "%s %s %s %s %s" % (
+                                base_pretty, buildbotBranch, buildType,
+                                "test", test)
+                            if custom_builder in self.builderNames:
+                                builders.append((custom_builder,
+                                                 base_pretty == pretty))
+                        if builders:
+                            self.testBuilders[(platform, buildType,
+                                               test)] = builders
+
+        # platform -> (base pretty name, isDefault), for builder master
+        # unittests
+        self.unittestPretties = {}
+        for platform, pretty in (unittestPrettyNames or {}).items():
+            base_pretty = basePlatform(pretty)
+            self.unittestPretties[platform] = (base_pretty,
+                                               base_pretty == pretty)
+
+        # platform -> [(base slave platform, isDefault)], for talos
+        self.talosPretties = {}
+        if talosSuites is not None:
+            for platform in prettyNames:
+                self.talosPretties[platform] = [
+                    (basePlatform(sp), basePlatform(sp) == sp)
+                    for sp in prettyNames[platform]]
+
+    def _getPlatforms(self, buildTypes):
+        prettyNames = self.prettyNames
+        if self.unittestSuites:
+            all_platforms = prettyNames.keys()
         else:
-            user_platforms.add(platform)
+            # for build builders (as opposed to test builders), check against
+            # the prettyNames for -debug
+            all_platforms = set()
+            if 'debug' in buildTypes:
+                all_platforms.update(
+                    [p for p in prettyNames.keys() if p.endswith('debug')])
+            if 'opt' in buildTypes:
+                all_platforms.update(
+                    [p for p in prettyNames.keys() if not p.endswith('debug')])
+
+            # Strip off -debug. It gets tacked on in the getPlatformBuilders
+            # for buildType == debug
+            all_platforms = list(
+                set([p.replace('-debug', '') for p in all_platforms]))
+
+        # Platforms whose prettyNames all have 'try-nondefault' in them are
+        # not included in -p all
+        default_platforms = set()
+        if self.unittestSuites:
+            for p in all_platforms:
+                default_platforms.update(
+                    [p for n in prettyNames[p] if 'try-nondefault' not in n])
+        else:
+            defaultPrettyNames = dict([(k, v)
+                                       for k, v in prettyNames.items()
+                                       if 'try-nondefault' not in v])
+            for p in all_platforms:
+                if p in defaultPrettyNames:
+                    default_platforms.add(p)
+                elif p + '-debug' in defaultPrettyNames:
+                    default_platforms.add(p)
+        return all_platforms, default_platforms
+
+    def parse(self, message):
+        '''Returns the builder names requested by the try syntax in
+        message'''
+        key = tuple(processMessage(message))
+        if key in self.cache:
+            self.hits += 1
+            log.msg("TryChooser: using cached builders for %s" % (key,))
+            return list(self.cache[key])
+
+        self.misses += 1
+        builders = self._parse(key, message)
+        if self.maxCached:
+            if len(self.cache) >= self.maxCached:
+                self.cache.clear()
+            self.cache[key] = tuple(builders)
+        return builders
+
+    def _parse(self, args, message):
+        (options, unknown_args) = _argParser.parse_known_args(list(args))
+
+        options.build = parseBuildTypes(options.build)
+        all_platforms, default_platforms = \
+            self.platforms[tuple(options.build)]
+
+        user_platforms = set()
+        for platform in options.user_platforms.split(','):
+            if platform == 'all':
+                user_platforms.update(default_platforms)
+            elif platform == 'full':
+                user_platforms.update(all_platforms)
+            else:
+                user_platforms.add(platform)
+
+        options.user_platforms = user_platforms
+
+        testFilters = None
+        if self.unittestSuites:
+            options.test, testFilters = parseTestOptions(
+                options.test, self.unittestSuites)
+
+        if self.talosSuites:
+            if options.talos == 'all':
+                options.talos = self.talosSuites
+            elif options.talos == 'none':
+                options.talos = []
+            else:
+                options.talos = options.talos.split(',')
+
+        # List for the custom builder names that match prettyNames passed in
+        # from misc.py
+        customBuilderNames = []
+        if options.user_platforms:
+            log.msg("TryChooser OPTIONS : MESSAGE %s : %s" %
+                    (options, message))
+            customBuilderNames = self._getPlatformBuilders(
+                options.user_platforms, options.build)
+
+            if options.test and self.unittestSuites:
+                customBuilderNames.extend(self._getTestBuilders(
+                    options.user_platforms, options.test, testFilters,
+                    options.build))
+            if options.talos and self.talosSuites is not None:
+                customBuilderNames.extend(self._getTalosBuilders(
+                    options.user_platforms, options.talos))
+
+        return customBuilderNames
+
+    def _getPlatformBuilders(self, user_platforms, buildTypes):
+        platforms = expandPlatforms(user_platforms, buildTypes)
+        return list(set([self.platformBuilders[p] for p in platforms
+                         if p in self.platformBuilders]))
+
+    def _getTestBuilders(self, platforms, tests, testFilters, buildTypes):
+        testBuilders = set()
+        builder_test_platforms = set()
+        for buildType in buildTypes:
+            for platform in platforms:
+                # this is to catch debug unittests triggered on the build
+                # master if the user asks for win32 with -b d
+                if buildType == 'debug' and not platform.endswith('debug'):
+                    builder_test_platforms.add('%s-debug' % platform)
+                for test in tests:
+                    for custom_builder, isDefault in self.testBuilders.get(
+                            (platform, buildType, test), []):
+                        if passesFilter(testFilters, test, custom_builder,
+                                        isDefault):
+                            testBuilders.add(custom_builder)
+
+        # we do all but debug win32 over on test masters so have to check the
+        # unittestPrettyNames platforms for local builder master unittests
+        for platform in builder_test_platforms.intersection(
+                self.unittestPretties):
+            assert platform.endswith('-debug')
+            base_pretty, isDefault = self.unittestPretties[platform]
+            for test in tests:
+                debug_custom_builder = "%s %s" % (base_pretty, test)
+                if debug_custom_builder in self.builderNames and \
+                        passesFilter(testFilters, test, debug_custom_builder,
+                                     isDefault):
+                    testBuilders.add(debug_custom_builder)
+        return list(testBuilders)
 
-    options.user_platforms = user_platforms
+    def _getTalosBuilders(self, platforms, tests):
+        testBuilders = set()
+        for platform in set(platforms).intersection(self.talosPretties):
+            # check whether we do talos for this platform
+            for base_slave_platform, isDefault in self.talosPretties[platform]:
+                for test in tests:
+                    custom_builder = "%s %s talos %s" % (
+                        base_slave_platform, self.buildbotBranch, test)
+                    if custom_builder in self.builderNames and \
+                            passesFilter({}, test, custom_builder, isDefault):
+                        testBuilders.add(custom_builder)
+        return list(testBuilders)
 
-    testFilters = None
-    if unittestSuites:
-        orig = options.test
-        options.test, testFilters = parseTestOptions(
-            options.test, unittestSuites)
 
-    if talosSuites:
-        if options.talos == 'all':
-            options.talos = talosSuites
-        elif options.talos == 'none':
-            options.talos = []
-        else:
-            options.talos = options.talos.split(',')
-
-    # List for the custom builder names that match prettyNames passed in from
-    # misc.py
-    customBuilderNames = []
-    if options.user_platforms:
-        log.msg("TryChooser OPTIONS : MESSAGE %s : %s" % (options, message))
-        customBuilderNames = getPlatformBuilders(
-            options.user_platforms, builderNames, options.build, prettyNames)
-
-        if options.test and unittestSuites:
-            # get test builders for test_master first
-            customBuilderNames.extend(
-                getTestBuilders(
-                    options.user_platforms, "test", options.test, testFilters,
-                    builderNames, options.build, buildbotBranch, prettyNames, None))
-            # then add any builder_master test builders
-            if unittestPrettyNames:
-                customBuilderNames.extend(
-                    getTestBuilders(
-                        options.user_platforms, "test", options.test, testFilters,
-                        builderNames, options.build, buildbotBranch, {}, unittestPrettyNames))
-        if options.talos and talosSuites is not None:
-            customBuilderNames.extend(
-                getTestBuilders(
-                    options.user_platforms, "talos", options.talos, {
-                    }, builderNames,
-                    options.build, buildbotBranch, prettyNames, None))
-
-    return customBuilderNames
+def TryParser(
+    message, builderNames, prettyNames, unittestPrettyNames=None, unittestSuites=None, talosSuites=None,
+        buildbotBranch='try'):
+    index = TryParserIndex(builderNames, prettyNames, unittestPrettyNames,
+                           unittestSuites, talosSuites, buildbotBranch)
+    return index.parse(message)